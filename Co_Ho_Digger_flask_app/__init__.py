@@ -13,6 +13,16 @@ from .relationship_attribute_routes import relattr_bp
 from .case_routes import case_bp
 from .models import Case
 from .case_detail_routes import case_detail_bp
+from .crawl_routes import crawl_bp
+from .cli import register_commands
+from .cache_routes import cache_bp
+from .search_routes import search_bp
+from .job_routes import job_bp
+from . import companies_house
+from .query_stats import init_query_stats
+from .graph_index import init_graph_index
+from .jobs import init_jobs
+from .db_tuning import configure_database, tune_engines
 
 import os
 
@@ -21,11 +31,33 @@ def create_app():
     app.config["SECRET_KEY"] = "some_secret_key_for_sessions"
     # You might load from .env or environment variables here:
     db_url = os.getenv("DATABASE_URL", "sqlite:///localdev.db")
-    app.config["SQLALCHEMY_DATABASE_URI"] = db_url
+    # DB_PROFILE / DATABASE_READ_URL and friends: see db_tuning.py.
+    configure_database(app, db_url)
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["LIST_PAGE_SIZE"] = int(os.getenv("LIST_PAGE_SIZE", "50"))
+    # Seconds before the in-memory graph index is rebuilt from scratch.
+    app.config["GRAPH_INDEX_MAX_AGE"] = int(os.getenv("GRAPH_INDEX_MAX_AGE", "600"))
+    # Background Companies House fetch threads (0 = leave jobs to `flask run-jobs`).
+    app.config["JOB_WORKERS"] = int(os.getenv("JOB_WORKERS", "2"))
+    app.config["JOB_STALE_SECONDS"] = int(os.getenv("JOB_STALE_SECONDS", "300"))
+
+    # Companies House response cache (set CH_CACHE_ENABLED=false to turn it off).
+    if os.getenv("CH_CACHE_ENABLED", "true").lower() == "true":
+        os.makedirs(app.instance_path, exist_ok=True)
+        ttls = {}
+        for endpoint in ["profile", "officers", "psc", "appointments"]:
+            ttl = os.getenv(f"CH_CACHE_TTL_{endpoint.upper()}")
+            if ttl:
+                ttls[endpoint] = int(ttl)
+        companies_house.configure_cache(
+            os.getenv("CH_CACHE_PATH", os.path.join(app.instance_path, "ch_cache.db")),
+            max_bytes=int(os.getenv("CH_CACHE_MAX_MB", "256")) * 1024 * 1024,
+            ttls=ttls,
+        )
 
     # Initialize the db with this app
     db.init_app(app)
+    tune_engines(app, db)
     
     # Initialize Migrate with the app and db
     migrate = Migrate(app, db)
@@ -39,6 +71,15 @@ def create_app():
     app.register_blueprint(relattr_bp)
     app.register_blueprint(case_bp)
     app.register_blueprint(case_detail_bp)
+    app.register_blueprint(crawl_bp)
+    app.register_blueprint(cache_bp)
+    app.register_blueprint(search_bp)
+    app.register_blueprint(job_bp)
+
+    register_commands(app)
+    init_query_stats(app)
+    init_graph_index(app)
+    init_jobs(app)
 
     @app.route("/")
     def home():
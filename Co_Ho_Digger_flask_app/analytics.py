@@ -0,0 +1,396 @@
+# my_flask_app/analytics.py
+#
+# Whole-graph scores for every company and person, so hubs - nominee
+# directors, formation agents, corporate secretaries - can be picked out,
+# sorted on and hidden without any graph work per request.
+#
+# One batch run loads the relationship endpoints into a SciPy sparse
+# adjacency matrix and computes, all with vectorised matrix operations:
+#   - degree (in, out and total relationships);
+#   - PageRank by power iteration on the undirected graph;
+#   - betweenness, estimated with Brandes' algorithm from a sample of
+#     sources, several at once as the columns of a dense block;
+#   - connected components, and communities by label propagation with the
+#     hubs' edges left out (otherwise one nominee director glues hundreds of
+#     unrelated groups together);
+#   - a hub flag for nodes whose degree is at least HUB_MIN_DEGREE and in the
+#     top HUB_PERCENTILE.
+#
+# Results go to node_metric. A run compares them with what is stored and
+# writes only the rows that changed (new nodes, changed scores, nodes gone),
+# and is skipped altogether when the graph has not changed since the last
+# run: same graph_version (bumped by ORM and set-based writes) and the same
+# counts and highest ids (which catch bulk inserts). Betweenness sources are chosen by a hash of the node id, so the same
+# ones are sampled every run and unchanged parts of the graph keep their
+# estimates.
+
+import os
+from datetime import datetime
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+from sqlalchemy import delete, func, insert, select, update
+
+from .models import db, Node, Company, Person, Relationship, NodeMetric, GraphMetricsRun, GraphVersion
+
+BETWEENNESS_SAMPLES = int(os.getenv("BETWEENNESS_SAMPLES", "32"))
+# Sources searched together; each adds a few (nodes x 1) arrays of memory.
+BETWEENNESS_BLOCK = 8
+PAGERANK_DAMPING = 0.85
+PAGERANK_TOLERANCE = 1e-9
+PAGERANK_MAX_ITERATIONS = 100
+COMMUNITY_ROUNDS = 20
+HUB_MIN_DEGREE = int(os.getenv("HUB_MIN_DEGREE", "50"))
+HUB_PERCENTILE = 99.9
+# Scores within this relative difference of the stored ones are not rewritten.
+RELATIVE_TOLERANCE = 1e-3
+LOAD_CHUNK = 50000
+WRITE_CHUNK = 5000
+
+_INT_COLUMNS = ("degree", "in_degree", "out_degree", "component", "component_size", "community", "is_hub")
+_FLOAT_COLUMNS = ("pagerank", "betweenness")
+
+
+def graph_signature():
+    """Graph version, relationship count and highest id, node count and highest id, in one string."""
+    version = db.session.execute(select(func.max(GraphVersion.version))).scalar()
+    rel_count, rel_max = db.session.execute(select(func.count(Relationship.id), func.max(Relationship.id))).one()
+    node_count, node_max = db.session.execute(select(func.count(Node.id), func.max(Node.id))).one()
+    return f"{version or 0}:{rel_count}:{rel_max or 0}:{node_count}:{node_max or 0}"
+
+
+def load_graph():
+    """
+    (node_ids, kinds, sources, targets): every node id in ascending order
+    with its kind, and each relationship as indexes into node_ids.
+    """
+    node_ids, kinds = [], []
+    for node_id, kind in db.session.execute(select(Node.id, Node.kind).order_by(Node.id)
+                                            .execution_options(yield_per=LOAD_CHUNK)):
+        node_ids.append(node_id)
+        kinds.append(kind)
+    node_ids = np.array(node_ids, dtype=np.int64)
+
+    rel = Relationship.__table__
+    ends = db.session.execute(select(rel.c.source_node_id, rel.c.target_node_id)
+                              .where(rel.c.source_node_id.is_not(None), rel.c.target_node_id.is_not(None))
+                              .execution_options(yield_per=LOAD_CHUNK))
+    pairs = np.array(ends.all(), dtype=np.int64).reshape(-1, 2)
+    sources = np.searchsorted(node_ids, pairs[:, 0])
+    targets = np.searchsorted(node_ids, pairs[:, 1])
+    # Relationships pointing at a node that has gone are left out.
+    known = (sources < len(node_ids)) & (targets < len(node_ids))
+    known[known] &= (node_ids[sources[known]] == pairs[known, 0]) & (node_ids[targets[known]] == pairs[known, 1])
+    return node_ids, np.array(kinds, dtype=object), sources[known], targets[known]
+
+
+def undirected_adjacency(n, sources, targets):
+    """Symmetric 0/1 CSR matrix: parallel relationships count once, self-loops not at all."""
+    keep = sources != targets
+    rows = np.concatenate([sources[keep], targets[keep]])
+    cols = np.concatenate([targets[keep], sources[keep]])
+    adjacency = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(n, n))
+    adjacency.data[:] = 1.0
+    return adjacency
+
+
+def pagerank(adjacency, damping=PAGERANK_DAMPING, tolerance=PAGERANK_TOLERANCE,
+             max_iterations=PAGERANK_MAX_ITERATIONS, heartbeat=None):
+    """PageRank by power iteration; scores sum to 1. Nodes without links share their rank out evenly."""
+    n = adjacency.shape[0]
+    if n == 0:
+        return np.zeros(0)
+    degree = np.asarray(adjacency.sum(axis=1)).ravel()
+    dangling = degree == 0
+    inverse_degree = np.where(dangling, 0.0, 1.0 / np.maximum(degree, 1))
+    rank = np.full(n, 1.0 / n)
+    for _ in range(max_iterations):
+        if heartbeat:
+            heartbeat()
+        spread = adjacency @ (rank * inverse_degree)
+        new_rank = damping * spread + (damping * rank[dangling].sum() + 1.0 - damping) / n
+        if np.abs(new_rank - rank).sum() < tolerance:
+            return new_rank
+        rank = new_rank
+    return rank
+
+
+def betweenness_sources(node_ids, degree, samples):
+    """
+    Up to `samples` linked nodes to run betweenness searches from, picked by
+    a hash of their node id so the same ones come up every run.
+    """
+    candidates = np.flatnonzero(degree > 0)
+    if len(candidates) <= samples:
+        return candidates
+    hashed = (node_ids[candidates].astype(np.uint64) * np.uint64(2654435761)) % np.uint64(2 ** 32)
+    return candidates[np.argsort(hashed, kind="stable")[:samples]]
+
+
+def sampled_betweenness(adjacency, sources, block=BETWEENNESS_BLOCK, heartbeat=None):
+    """
+    Betweenness estimated from searches out of `sources` (Brandes), scaled
+    up to all sources and normalised to 0-1. Each block of sources is
+    searched at once: breadth-first layers are sparse-by-dense products.
+    """
+    n = adjacency.shape[0]
+    total = np.zeros(n)
+    if n < 3 or not len(sources):
+        return total
+    for start in range(0, len(sources), block):
+        batch = sources[start:start + block]
+        columns = np.arange(len(batch))
+        depth = np.full((n, len(batch)), -1, dtype=np.int32)
+        paths = np.zeros((n, len(batch)))
+        depth[batch, columns] = 0
+        paths[batch, columns] = 1.0
+
+        # Forward: count shortest paths layer by layer. Only the rows of
+        # nodes on the current layer (for any source) take part in a product.
+        level = 0
+        while True:
+            if heartbeat:
+                heartbeat()
+            at_level = depth == level
+            rows = np.flatnonzero(at_level.any(axis=1))
+            reached = adjacency[rows].T @ np.where(at_level[rows], paths[rows], 0.0)
+            new = depth < 0
+            new &= reached > 0
+            if not new.any():
+                break
+            level += 1
+            np.copyto(depth, level, where=new)
+            np.copyto(paths, reached, where=new)
+
+        # Backward: accumulate dependencies from the deepest layer up.
+        dependency = np.zeros((n, len(batch)))
+        share = np.zeros((n, len(batch)))
+        for level in range(level, 0, -1):
+            if heartbeat:
+                heartbeat()
+            share.fill(0.0)
+            np.divide(1.0 + dependency, paths, out=share, where=depth == level)
+            below = depth == level - 1
+            rows = np.flatnonzero(below.any(axis=1))
+            dependency[rows] += np.where(below[rows], paths[rows] * (adjacency[rows] @ share), 0.0)
+        dependency[batch, columns] = 0.0
+        total += dependency.sum(axis=1)
+    # Each unordered pair is counted from both ends when every node is a source.
+    estimate = total * (n / len(sources)) / 2
+    return estimate / ((n - 1) * (n - 2) / 2)
+
+
+def component_labels(adjacency, node_ids):
+    """(component, size) per node; a component is labelled by its lowest node id."""
+    count, labels = connected_components(adjacency, directed=False)
+    lowest = np.full(count, np.iinfo(np.int64).max)
+    np.minimum.at(lowest, labels, node_ids)
+    return lowest[labels], np.bincount(labels, minlength=count)[labels]
+
+
+def community_labels(adjacency, node_ids, exclude=None, rounds=COMMUNITY_ROUNDS, heartbeat=None):
+    """
+    Communities by label propagation: each node repeatedly takes the label
+    most common among its neighbours (the lowest on a tie). About half the
+    nodes move each round, which stops the two sides of the company/person
+    graph swapping labels back and forth; which half is decided by a hash of
+    the node id, so an unchanged part of the graph gets the same communities
+    as last run. Nodes in `exclude`
+    (a boolean mask) neither pass their label on nor take one. Labelled by
+    the lowest node id in each community.
+    """
+    n = adjacency.shape[0]
+    hashed = (node_ids.astype(np.uint64) * np.uint64(2654435761)) % np.uint64(2 ** 32)
+    graph = adjacency
+    if exclude is not None and exclude.any():
+        keep = sparse.diags((~exclude).astype(float))
+        graph = (keep @ adjacency @ keep).tocsr()
+        graph.eliminate_zeros()
+    graph = graph.tocoo()
+    rows, cols = graph.row.astype(np.int64), graph.col.astype(np.int64)
+    labels = np.arange(n, dtype=np.int64)
+    if not len(rows):
+        return node_ids.copy()
+
+    for round_number in range(rounds):
+        if heartbeat:
+            heartbeat()
+        keys, counts = np.unique(rows * n + labels[cols], return_counts=True)
+        node, label = keys // n, keys % n
+        starts = np.flatnonzero(np.r_[True, node[1:] != node[:-1]])
+        best = np.repeat(np.maximum.reduceat(counts, starts), np.diff(np.r_[starts, len(keys)]))
+        # Keys are sorted by node then label, so the first winner is the lowest label.
+        winners = np.flatnonzero(counts == best)
+        first = winners[np.r_[True, node[winners[1:]] != node[winners[:-1]]]]
+        proposed = labels.copy()
+        proposed[node[first]] = label[first]
+        differ = proposed != labels
+        if not differ.any():
+            break
+        moving = differ & ((hashed >> np.uint64(round_number % 32)) & np.uint64(1)).astype(bool)
+        labels[moving] = proposed[moving]
+
+    lowest = np.full(n, np.iinfo(np.int64).max)
+    np.minimum.at(lowest, labels, node_ids)
+    return lowest[labels]
+
+
+def compute_metrics(node_ids, sources, targets, samples=BETWEENNESS_SAMPLES, heartbeat=None):
+    """
+    Every score for every node, as {column: array aligned with node_ids}; see
+    the module notes. `heartbeat`, if given, is called throughout the long
+    loops (PageRank, betweenness, communities).
+    """
+    n = len(node_ids)
+    out_degree = np.bincount(sources, minlength=n)
+    in_degree = np.bincount(targets, minlength=n)
+    degree = out_degree + in_degree
+    adjacency = undirected_adjacency(n, sources, targets)
+    hub_degree = HUB_MIN_DEGREE
+    if n:
+        hub_degree = max(HUB_MIN_DEGREE, int(np.ceil(np.percentile(degree, HUB_PERCENTILE))))
+    is_hub = degree >= hub_degree
+    component, component_size = component_labels(adjacency, node_ids)
+    return {
+        "degree": degree,
+        "in_degree": in_degree,
+        "out_degree": out_degree,
+        "pagerank": pagerank(adjacency, heartbeat=heartbeat),
+        "betweenness": sampled_betweenness(adjacency, betweenness_sources(node_ids, degree, samples),
+                                           heartbeat=heartbeat),
+        "component": component,
+        "component_size": component_size,
+        "community": community_labels(adjacency, node_ids, exclude=is_hub, heartbeat=heartbeat),
+        "is_hub": is_hub,
+    }, hub_degree
+
+
+def _stored_metrics(node_ids):
+    """Stored scores aligned with node_ids, plus a mask of the nodes that have a row."""
+    columns = ("node_id",) + _INT_COLUMNS + _FLOAT_COLUMNS
+    rows = db.session.execute(select(*(getattr(NodeMetric, c) for c in columns))
+                              .order_by(NodeMetric.node_id).execution_options(yield_per=LOAD_CHUNK)).all()
+    stored = np.array(rows, dtype=float).reshape(-1, len(columns))
+    stored_ids = stored[:, 0].astype(np.int64)
+    position = np.searchsorted(node_ids, stored_ids)
+    present = (position < len(node_ids))
+    present[present] &= node_ids[position[present]] == stored_ids[present]
+    has_row = np.zeros(len(node_ids), dtype=bool)
+    has_row[position[present]] = True
+    aligned = {}
+    for i, column in enumerate(columns[1:], start=1):
+        values = np.zeros(len(node_ids))
+        values[position[present]] = stored[present, i]
+        aligned[column] = values
+    return aligned, has_row, stored_ids[~present]
+
+
+def _changed_rows(metrics, stored, has_row):
+    changed = ~has_row
+    for column in _INT_COLUMNS:
+        changed |= metrics[column].astype(float) != stored[column]
+    for column in _FLOAT_COLUMNS:
+        changed |= ~np.isclose(metrics[column], stored[column], rtol=RELATIVE_TOLERANCE, atol=1e-12)
+    return changed
+
+
+def refresh_node_metrics(samples=BETWEENNESS_SAMPLES, force=False, progress=None, heartbeat=None):
+    """
+    Recompute the scores and write the node_metric rows that changed.
+    Returns {"nodes", "edges", "written", "deleted", "skipped"}; skipped is
+    True (and nothing is computed) when the graph is as the last run saw it,
+    unless `force`. `progress`, if given, is called with the number of rows
+    written after each chunk; `heartbeat` goes to compute_metrics.
+    """
+    signature = graph_signature()
+    last = last_metrics_run()
+    if last is not None and last.signature == signature and not force:
+        return {"nodes": last.nodes, "edges": last.edges, "written": 0, "deleted": 0, "skipped": True}
+
+    run = GraphMetricsRun(started_at=datetime.utcnow(), signature=signature)
+    db.session.add(run)
+    db.session.commit()
+
+    node_ids, kinds, sources, targets = load_graph()
+    metrics, hub_degree = compute_metrics(node_ids, sources, targets, samples, heartbeat=heartbeat)
+    stored, has_row, gone = _stored_metrics(node_ids)
+    changed = _changed_rows(metrics, stored, has_row)
+
+    now = datetime.utcnow()
+    written = 0
+    for new_rows in (True, False):
+        indexes = np.flatnonzero(changed & (~has_row if new_rows else has_row))
+        for start in range(0, len(indexes), WRITE_CHUNK):
+            rows = []
+            for i in indexes[start:start + WRITE_CHUNK]:
+                row = {"node_id": int(node_ids[i]), "updated_at": now}
+                row.update((column, int(metrics[column][i])) for column in _INT_COLUMNS if column != "is_hub")
+                row.update((column, float(metrics[column][i])) for column in _FLOAT_COLUMNS)
+                row["is_hub"] = bool(metrics["is_hub"][i])
+                if new_rows:
+                    row["kind"] = kinds[i]
+                rows.append(row)
+            db.session.execute(insert(NodeMetric) if new_rows else update(NodeMetric), rows)
+            db.session.commit()
+            written += len(rows)
+            if progress:
+                progress(len(rows))
+    for start in range(0, len(gone), WRITE_CHUNK):
+        db.session.execute(delete(NodeMetric).where(NodeMetric.node_id.in_(gone[start:start + WRITE_CHUNK].tolist())))
+    run.nodes, run.edges, run.written, run.hub_degree = len(node_ids), len(sources), written, hub_degree
+    run.finished_at = datetime.utcnow()
+    db.session.commit()
+    return {"nodes": run.nodes, "edges": run.edges, "written": written, "deleted": len(gone), "skipped": False}
+
+
+def last_metrics_run():
+    """The most recent finished run, or None."""
+    return GraphMetricsRun.query.filter(GraphMetricsRun.finished_at.isnot(None))\
+        .order_by(GraphMetricsRun.id.desc()).first()
+
+
+def metrics_for(company_ids=(), person_ids=()):
+    """{("company", id) / ("person", id): NodeMetric} for the given entities, one query per kind and chunk."""
+    found = {}
+    for kind, model, ids in (("company", Company, list(company_ids)), ("person", Person, list(person_ids))):
+        for start in range(0, len(ids), WRITE_CHUNK):
+            query = db.session.query(model.id, NodeMetric).join(NodeMetric, NodeMetric.node_id == model.node_id)\
+                .filter(model.id.in_(ids[start:start + WRITE_CHUNK]))
+            for entity_id, metric in query:
+                found[(kind, entity_id)] = metric
+    return found
+
+
+# Scores the company and person lists can be sorted by, as (sort column, id
+# column) for keyset_paginate. Both are node_metric's own columns so the
+# ix_node_metric_* indexes give the order; only scored rows are listed.
+LIST_SCORES = {
+    "degree": (NodeMetric.degree, NodeMetric.node_id),
+    "pagerank": (NodeMetric.pagerank, NodeMetric.node_id),
+}
+
+
+def with_scores(query, model, sort_col, id_col, hubs_only=False):
+    """
+    Join a Company or Person query to its scores for keyset_paginate. Rows
+    come back as (entity, NodeMetric or None, sort value, id), so the
+    cursors can read the sort value by name; unwrap the page with
+    split_scores(). When sorting by a score (id_col is NodeMetric.node_id)
+    entities without one are left out rather than outer-joined, so the
+    scan can start from the score index.
+    """
+    if hubs_only or id_col is NodeMetric.node_id:
+        query = query.join(NodeMetric, NodeMetric.node_id == model.node_id)
+    else:
+        query = query.outerjoin(NodeMetric, NodeMetric.node_id == model.node_id)
+    if hubs_only:
+        query = query.filter(NodeMetric.is_hub.is_(True))
+    return query.add_columns(NodeMetric, sort_col, id_col)
+
+
+def split_scores(page):
+    """Turn a page of with_scores() rows back into entities; returns {entity id: NodeMetric or None}."""
+    scores = {row[0].id: row[1] for row in page.items}
+    page.items = [row[0] for row in page.items]
+    return scores
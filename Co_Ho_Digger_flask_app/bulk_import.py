@@ -0,0 +1,287 @@
+# my_flask_app/bulk_import.py
+#
+# Loaders for the Companies House bulk snapshot files, e.g.
+#   flask import-companies BasicCompanyDataAsOneFile-2026-10-01.zip
+#   flask import-psc persons-with-significant-control-snapshot-2026-10-01.zip
+#
+# Files are streamed (straight out of the zip) and written in chunks: one
+# SELECT to find the existing rows, one executemany INSERT for new rows, one
+# executemany UPDATE for changed rows and a commit that also moves the
+# checkpoint forward. Unchanged rows are not written at all, so loading next
+# month's snapshot only touches what changed.
+
+import csv
+import io
+import json
+import os
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import islice
+
+from sqlalchemy import insert, update
+
+from .models import db, normalize_company_number, create_nodes, Company, SnapshotImport
+from .ingest import (format_company_number, psc_record, company_ids_by_numbers, write_psc_rows,
+                     RelationshipTypeCache)
+
+DEFAULT_CHUNK_SIZE = 5000
+DEFAULT_PSC_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+
+# Columns written from the snapshot; also what decides "changed".
+COMPANY_COLUMNS = ("company_number", "name", "registered_address", "company_status", "incorporation_date")
+
+
+def open_snapshot(path):
+    """
+    Open a snapshot as text. A .zip is read from its first member without
+    extracting it; anything else is opened as a plain file.
+    """
+    if zipfile.is_zipfile(path):
+        archive = zipfile.ZipFile(path)
+        member = next(name for name in archive.namelist() if not name.endswith("/"))
+        return io.TextIOWrapper(archive.open(member), encoding="utf-8-sig", newline="")
+    return open(path, encoding="utf-8-sig", newline="")
+
+
+def iter_csv_rows(handle):
+    """Yield each data row as a dict. Header names are stripped, as some carry a leading space."""
+    reader = csv.reader(handle)
+    header = [name.strip() for name in next(reader, [])]
+    for row in reader:
+        yield dict(zip(header, row))
+
+
+def parse_snapshot_date(value):
+    value = (value or "").strip()
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, "%d/%m/%Y").date()
+    except ValueError:
+        return None
+
+
+def company_fields_from_snapshot(row):
+    """
+    Extract the Company columns from a BasicCompanyData row. The address is
+    built from the same parts, in the same order, as company_fields_from_profile
+    so a company loaded from the API is not seen as changed by the snapshot.
+    """
+    address_parts = [row.get(part, "").strip() for part in
+                     ("RegAddress.AddressLine1", "RegAddress.AddressLine2",
+                      "RegAddress.PostCode", "RegAddress.PostTown")]
+    return {
+        "company_number": format_company_number(row.get("CompanyNumber", "")),
+        "name": row.get("CompanyName", "").strip(),
+        "registered_address": ", ".join(part for part in address_parts if part),
+        "company_status": row.get("CompanyStatus", "").strip() or None,
+        "incorporation_date": parse_snapshot_date(row.get("IncorporationDate")),
+    }
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def start_or_resume_import(kind, path, restart=False):
+    """
+    Return the SnapshotImport for this file: the unfinished one for the same
+    file name and size when there is one (unless `restart`), else a new one.
+    The caller commits.
+    """
+    file_name, file_size = os.path.basename(path), os.path.getsize(path)
+    existing = SnapshotImport.query.filter_by(kind=kind, file_name=file_name, file_size=file_size)\
+        .filter(SnapshotImport.status != "finished")\
+        .order_by(SnapshotImport.id.desc()).first()
+    if existing and not restart:
+        existing.status = "running"
+        existing.error = None
+        return existing
+    run = SnapshotImport(kind=kind, file_name=file_name, file_size=file_size)
+    db.session.add(run)
+    db.session.flush()
+    return run
+
+
+def upsert_company_chunk(rows):
+    """
+    Insert or update one chunk of company field dicts. Returns
+    (inserted, updated, unchanged). Does not commit.
+    """
+    by_key = {}
+    for fields in rows:
+        if fields["company_number"] and fields["name"]:
+            by_key[normalize_company_number(fields["company_number"])] = fields
+
+    existing = {}
+    if by_key:
+        found = db.session.query(Company.id, Company.normalized_number,
+                                 *[getattr(Company, column) for column in COMPANY_COLUMNS])\
+            .filter(Company.normalized_number.in_(list(by_key))).order_by(Company.id)
+        for row in found:
+            existing.setdefault(row.normalized_number, row)
+
+    new_rows, changed_rows, unchanged = [], [], 0
+    for key, fields in by_key.items():
+        current = existing.get(key)
+        if current is None:
+            # Core inserts skip the @validates hook, so normalized_number is set here.
+            new_rows.append(dict(fields, normalized_number=key))
+        elif any(getattr(current, column) != fields[column] for column in COMPANY_COLUMNS):
+            changed_rows.append(dict(fields, id=current.id, normalized_number=key))
+        else:
+            unchanged += 1
+
+    if new_rows:
+        for row, node_id in zip(new_rows, create_nodes("company", len(new_rows))):
+            row["node_id"] = node_id
+        db.session.execute(insert(Company), new_rows)
+    if changed_rows:
+        db.session.execute(update(Company), changed_rows)
+    return len(new_rows), len(changed_rows), unchanged
+
+
+def import_companies(path, chunk_size=DEFAULT_CHUNK_SIZE, restart=False, progress=None):
+    """
+    Load a BasicCompanyData snapshot (.zip or .csv) into the company table,
+    resuming from the last committed chunk of an interrupted run of the same
+    file. `progress(run, rows_per_second)` is called after every chunk.
+    """
+    run = start_or_resume_import("companies", path, restart)
+    db.session.commit()
+
+    started = time.monotonic()
+    resumed_from = run.rows_done
+    try:
+        with open_snapshot(path) as handle:
+            rows = iter_csv_rows(handle)
+            for _ in range(resumed_from):
+                if next(rows, None) is None:
+                    break
+            for chunk in _chunks(rows, chunk_size):
+                inserted, updated, unchanged = upsert_company_chunk(
+                    [company_fields_from_snapshot(row) for row in chunk])
+                run.rows_done += len(chunk)
+                run.inserted += inserted
+                run.updated += updated
+                run.unchanged += unchanged
+                db.session.commit()
+                if progress:
+                    elapsed = time.monotonic() - started
+                    progress(run, (run.rows_done - resumed_from) / elapsed if elapsed else 0.0)
+    except Exception as exc:
+        db.session.rollback()
+        run.status = "failed"
+        run.error = str(exc)
+        db.session.commit()
+        raise
+
+    run.status = "finished"
+    run.finished_at = datetime.utcnow()
+    db.session.commit()
+    return run
+
+
+def parse_psc_lines(lines):
+    """
+    Parse a chunk of PSC snapshot lines ({"company_number": ..., "data":
+    {PSC item}}) into (company_number, entity, effective_date,
+    control_details) records. Runs in a worker process, so it must not touch
+    the database. Returns (line_count, records, skipped).
+    """
+    records, skipped = [], 0
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError:
+            skipped += 1
+            continue
+        # The last line of the file is a totals record with no company number.
+        number = item.get("company_number")
+        record = psc_record(item.get("data") or {}) if number else None
+        if record is None:
+            skipped += 1
+            continue
+        records.append((format_company_number(number),) + record)
+    return len(lines), records, skipped
+
+
+def write_psc_records(records, rel_types=None):
+    """
+    Write parsed PSC records for any number of companies. Records for
+    companies that are not in the database are skipped; load the company
+    snapshot first. Returns (inserted, updated, unchanged, skipped).
+    """
+    company_ids = company_ids_by_numbers({number for number, _, _, _ in records})
+    rows = [(company_ids[number], entity, effective_date, control_details)
+            for number, entity, effective_date, control_details in records if number in company_ids]
+    inserted, updated, unchanged = write_psc_rows(rows, rel_types)
+    return inserted, updated, unchanged, len(records) - len(rows)
+
+
+def import_psc(path, chunk_size=DEFAULT_CHUNK_SIZE, workers=DEFAULT_PSC_WORKERS, restart=False,
+               progress=None):
+    """
+    Load a PSC snapshot (.zip or JSON lines) into Person / Company /
+    Relationship / RelationshipAttribute rows. Lines are read in chunks of
+    `chunk_size` and parsed on a pool of `workers` processes, with at most
+    two chunks per worker in flight so memory stays bounded. Results are
+    written in file order, one transaction per chunk, so the checkpoint is
+    always a line count and an interrupted import resumes after its last
+    committed chunk. `progress(run, rows_per_second)` is called after every
+    chunk.
+    """
+    run = start_or_resume_import("psc", path, restart)
+    db.session.commit()
+
+    started = time.monotonic()
+    resumed_from = run.rows_done
+    rel_types = RelationshipTypeCache()
+    try:
+        with open_snapshot(path) as handle, ProcessPoolExecutor(max_workers=workers) as pool:
+            lines = islice(handle, resumed_from, None)
+            in_flight = deque()
+
+            def submit_next():
+                chunk = list(islice(lines, chunk_size))
+                if chunk:
+                    in_flight.append(pool.submit(parse_psc_lines, chunk))
+
+            for _ in range(workers * 2):
+                submit_next()
+            while in_flight:
+                line_count, records, skipped = in_flight.popleft().result()
+                submit_next()
+                inserted, updated, unchanged, missing = write_psc_records(records, rel_types)
+                run.rows_done += line_count
+                run.inserted += inserted
+                run.updated += updated
+                run.unchanged += unchanged
+                run.skipped += skipped + missing
+                db.session.commit()
+                if progress:
+                    elapsed = time.monotonic() - started
+                    progress(run, (run.rows_done - resumed_from) / elapsed if elapsed else 0.0)
+    except Exception as exc:
+        db.session.rollback()
+        run.status = "failed"
+        run.error = str(exc)
+        db.session.commit()
+        raise
+
+    run.status = "finished"
+    run.finished_at = datetime.utcnow()
+    db.session.commit()
+    return run
@@ -0,0 +1,23 @@
+# my_flask_app/cache_routes.py
+
+from flask import Blueprint, render_template, redirect, url_for, flash
+from . import companies_house
+
+cache_bp = Blueprint("cache_bp", __name__, template_folder="templates")
+
+
+@cache_bp.route("/cache")
+def cache_stats():
+    cache = companies_house.get_response_cache()
+    summary = cache.summary() if cache else None
+    return render_template("cache_stats.html", summary=summary,
+                           ttls=cache.ttls if cache else {})
+
+
+@cache_bp.route("/cache/clear", methods=["POST"])
+def cache_clear():
+    cache = companies_house.get_response_cache()
+    if cache:
+        cache.clear()
+        flash("Companies House response cache cleared.", "info")
+    return redirect(url_for("cache_bp.cache_stats"))
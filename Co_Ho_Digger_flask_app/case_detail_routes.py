@@ -1,5 +1,7 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session
 from .models import db, Case, Company, CaseDetail
+from .jobs import enqueue_job
+from . import companies_house
 
 case_detail_bp = Blueprint("case_detail_bp", __name__, template_folder="templates")
 
@@ -31,9 +33,24 @@ def details_new(case_id):
         flash("Company added to case.", "success")
         return redirect(url_for("case_detail_bp.details_list", case_id=case.id))
 
-    # Get companies sorted alphabetically for the dropdown.
-    companies = Company.query.order_by(Company.name.asc()).all()
-    return render_template("case_details_new.html", case=case, companies=companies)
+    # The company is picked with the /api/search typeahead.
+    return render_template("case_details_new.html", case=case)
+
+
+@case_detail_bp.route("/cases/<int:case_id>/refresh", methods=["POST"])
+def case_refresh(case_id):
+    """Queue a refresh of the profile, officers and PSCs of every company in the case."""
+    case = Case.query.get_or_404(case_id)
+    if not companies_house.get_api_key():
+        flash("Companies House API key is not configured.", "danger")
+        return redirect(url_for("case_detail_bp.details_list", case_id=case.id))
+    job, created = enqueue_job("refresh_case", f"refresh_case:{case.id}",
+                               {"case_id": case.id, "force": request.form.get("force") == "on"})
+    if created:
+        flash(f"Refreshing every company in the case (job {job.id}).", "info")
+    else:
+        flash(f"This case is already being refreshed (job {job.id}).", "info")
+    return redirect(url_for("case_detail_bp.details_list", case_id=case.id))
 
 
 @case_detail_bp.route("/cases/<int:case_id>/details/<int:detail_id>/delete", methods=["POST"])
@@ -0,0 +1,109 @@
+# my_flask_app/case_graph.py
+#
+# The network of a case: every company in the case is a starting point and
+# one breadth-first walk (over the graph index, or a recursive query while
+# the index is building) collects everything within `depth` hops of any of
+# them.
+#
+# The result is stored in case_subgraph per (case, depth, relationship
+# types) as relationship ids, with its nodes in case_subgraph_node, so
+# reopening a case's network skips the walk. Node and edge records are read
+# from those ids on each request, so renamed companies and changed
+# attributes show up without invalidating anything. A stored subgraph is
+# dropped (models.drop_case_subgraphs) when a company joins or leaves the
+# case, or a relationship touching one of its nodes is added, moved or
+# deleted; relationships bulk-inserted since it was stored, which fire no
+# events, are looked for with an indexed "id > highest seen" query before
+# it is reused. All of this reads and writes the primary database, even
+# from a @replica_reads view: the cache is written as it is read, and the
+# walk must see every relationship up to the mark it is stored with.
+
+import json
+from datetime import datetime
+
+from sqlalchemy import delete, func, insert, or_, select
+from sqlalchemy.exc import IntegrityError
+
+from .models import db, CaseDetail, CaseSubgraph, CaseSubgraphNode, Relationship
+from .db_tuning import primary_reads
+from .graph_data import node_ids_for, node_keys_for, relationship_type_ids
+from .graph_index import seeded_subgraph
+
+# case_subgraph_node rows per INSERT.
+WRITE_CHUNK = 5000
+
+
+def case_seeds(case_id):
+    """(kind, id) keys of the companies in a case."""
+    query = select(CaseDetail.company_id).where(CaseDetail.case_id == case_id).distinct()
+    return [("company", company_id) for company_id in db.session.execute(query).scalars()]
+
+
+def _types_key(rel_types):
+    return ",".join(sorted(set(rel_types or ())))
+
+
+def _is_current(cached):
+    """
+    Whether no relationship added since `cached` was stored touches its
+    nodes. When none does, the mark is moved up so the next check starts
+    from here.
+    """
+    rel = Relationship.__table__
+    members = select(CaseSubgraphNode.node_id).where(CaseSubgraphNode.subgraph_id == cached.id)
+    newer = select(rel.c.id).where(rel.c.id > cached.max_relationship_id,
+                                   or_(rel.c.source_node_id.in_(members), rel.c.target_node_id.in_(members)))
+    if db.session.execute(newer.limit(1)).first() is not None:
+        return False
+    highest = db.session.execute(select(func.max(rel.c.id))).scalar() or 0
+    if highest > cached.max_relationship_id:
+        cached.max_relationship_id = highest
+        db.session.commit()
+    return True
+
+
+def _drop(cached):
+    db.session.execute(delete(CaseSubgraphNode).where(CaseSubgraphNode.subgraph_id == cached.id))
+    db.session.execute(delete(CaseSubgraph).where(CaseSubgraph.id == cached.id))
+    db.session.commit()
+
+
+def _store(case_id, max_depth, types_key, node_keys, rel_ids, max_relationship_id):
+    node_ids = sorted(set(node_ids_for(node_keys).values()))
+    try:
+        cached = CaseSubgraph(case_id=case_id, depth=max_depth, rel_types=types_key,
+                              relationship_ids=json.dumps(sorted(rel_ids), separators=(",", ":")),
+                              node_count=len(node_ids), max_relationship_id=max_relationship_id,
+                              created_at=datetime.utcnow())
+        db.session.add(cached)
+        db.session.flush()
+        for start in range(0, len(node_ids), WRITE_CHUNK):
+            db.session.execute(insert(CaseSubgraphNode), [{"subgraph_id": cached.id, "node_id": node}
+                                                          for node in node_ids[start:start + WRITE_CHUNK]])
+        db.session.commit()
+    except IntegrityError:
+        # Another request stored the same view first; its subgraph will do next time.
+        db.session.rollback()
+
+
+def case_subgraph(case_id, max_depth, rel_types=None):
+    """
+    Return (node keys, relationship ids) within `max_depth` hops of any
+    company in a case, as focus_subgraph does for one company. Served from
+    case_subgraph while nothing it covers has changed.
+    """
+    types_key = _types_key(rel_types)
+    with primary_reads():
+        cached = CaseSubgraph.query.filter_by(case_id=case_id, depth=max_depth, rel_types=types_key).first()
+        if cached is not None:
+            if _is_current(cached):
+                node_ids = db.session.execute(select(CaseSubgraphNode.node_id)
+                                              .where(CaseSubgraphNode.subgraph_id == cached.id)).scalars()
+                return set(node_keys_for(node_ids).values()), set(json.loads(cached.relationship_ids))
+            _drop(cached)
+
+        # Taken before the walk, so relationships added during it are caught next time.
+        max_relationship_id = db.session.execute(select(func.max(Relationship.id))).scalar() or 0
+        node_keys, rel_ids = seeded_subgraph(case_seeds(case_id), max_depth, relationship_type_ids(rel_types))
+        _store(case_id, max_depth, types_key, node_keys, rel_ids, max_relationship_id)
+        return node_keys, rel_ids
@@ -0,0 +1,166 @@
+# my_flask_app/ch_cache.py
+#
+# Persistent cache for Companies House API responses, kept in its own SQLite
+# file so it survives restarts and is shared by the web app, the deep dig
+# crawler and the CLI.
+
+import json
+import sqlite3
+import threading
+import time
+
+from .ingest import format_company_number
+
+# How long a cached response is served without asking Companies House again.
+# After that it is revalidated with If-None-Match, which does not return a body
+# (and so is cheap) when nothing changed.
+DEFAULT_TTLS = {
+    "profile": 24 * 3600,
+    "officers": 12 * 3600,
+    "psc": 12 * 3600,
+    "appointments": 24 * 3600,
+    "other": 3600,
+}
+
+
+def endpoint_for_path(path):
+    """Classify an API path, e.g. "/company/01234567/officers" -> "officers"."""
+    parts = path.strip("/").split("/")
+    if parts[0] == "company":
+        if len(parts) == 2:
+            return "profile"
+        if parts[2] == "officers":
+            return "officers"
+        if parts[2] == "persons-with-significant-control":
+            return "psc"
+    if parts[0] == "officers" and parts[-1] == "appointments":
+        return "appointments"
+    return "other"
+
+
+def canonical_path(path):
+    """
+    The path with its company number in canonical form, so "/company/1234"
+    and "/company/00001234" are one request and one cache entry.
+    """
+    parts = path.split("/")
+    if len(parts) > 2 and parts[1] == "company":
+        parts[2] = format_company_number(parts[2])
+    return "/".join(parts)
+
+
+def cache_key(path, params=None):
+    path = canonical_path(path)
+    if not params:
+        return path
+    query = "&".join(f"{k}={params[k]}" for k in sorted(params))
+    return f"{path}?{query}"
+
+
+class CacheEntry:
+    __slots__ = ("key", "etag", "body", "fetched_at")
+
+    def __init__(self, key, etag, body, fetched_at):
+        self.key = key
+        self.etag = etag
+        self.body = body
+        self.fetched_at = fetched_at
+
+    def data(self):
+        return json.loads(self.body)
+
+
+class ResponseCache:
+    """
+    SQLite-backed response cache with per-endpoint TTLs, ETag revalidation
+    and LRU eviction once the stored bodies exceed `max_bytes`.
+    """
+
+    def __init__(self, path, max_bytes=256 * 1024 * 1024, ttls=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.stats = {"hits": 0, "misses": 0, "stale": 0, "revalidated": 0, "stored": 0, "evicted": 0}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS response (
+                key TEXT PRIMARY KEY,
+                endpoint TEXT NOT NULL,
+                etag TEXT,
+                body TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_response_accessed ON response (accessed_at)")
+        self._size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM response").fetchone()[0]
+
+    def ttl(self, endpoint):
+        return self.ttls.get(endpoint, self.ttls["other"])
+
+    def lookup(self, key):
+        """
+        Return (entry, fresh). `entry` is None on a miss; `fresh` says whether
+        it can be served without revalidation.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT etag, body, fetched_at, endpoint FROM response WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None, False
+            etag, body, fetched_at, endpoint = row
+            self._conn.execute("UPDATE response SET accessed_at = ? WHERE key = ?", (now, key))
+            fresh = now - fetched_at < self.ttl(endpoint)
+            self.stats["hits" if fresh else "stale"] += 1
+            return CacheEntry(key, etag, body, fetched_at), fresh
+
+    def revalidated(self, key):
+        """Record a 304: the cached body is still current as of now."""
+        with self._lock:
+            self._conn.execute("UPDATE response SET fetched_at = ? WHERE key = ?", (time.time(), key))
+            self.stats["revalidated"] += 1
+
+    def store(self, key, endpoint, etag, data):
+        body = json.dumps(data, separators=(",", ":"))
+        size = len(body)
+        now = time.time()
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM response WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO response (key, endpoint, etag, body, size, fetched_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, endpoint, etag, body, size, now, now))
+            self._size += size - (old[0] if old else 0)
+            self.stats["stored"] += 1
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Drop least recently used entries until we are back under 90% of the cap,
+        # so we don't evict on every single store once full.
+        target = int(self.max_bytes * 0.9)
+        victims = []
+        for key, size in self._conn.execute("SELECT key, size FROM response ORDER BY accessed_at"):
+            if self._size <= target:
+                break
+            victims.append((key,))
+            self._size -= size
+        self._conn.executemany("DELETE FROM response WHERE key = ?", victims)
+        self.stats["evicted"] += len(victims)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM response")
+            self._size = 0
+
+    def summary(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM response").fetchone()[0]
+            lookups = self.stats["hits"] + self.stats["misses"] + self.stats["stale"]
+            return dict(self.stats, entries=entries, size_bytes=self._size, max_bytes=self.max_bytes,
+                        hit_ratio=(self.stats["hits"] + self.stats["revalidated"]) / lookups if lookups else 0.0)
@@ -0,0 +1,252 @@
+# my_flask_app/cli.py
+#
+# Long-running jobs that are better started from a shell than a browser:
+#   flask deep-dig 01234567 --depth 3
+#   flask import-companies BasicCompanyDataAsOneFile-2026-10-01.zip
+#   flask import-psc persons-with-significant-control-snapshot-2026-10-01.zip
+#   flask bench-db --seconds 10
+#   flask dedupe-persons
+#   flask rebuild-search-index
+#   flask run-jobs
+#   flask stream-sync
+#   flask stream-sync --stream psc --replay psc-events.ndjson.gz
+#   flask graph-metrics
+#   flask export-graph network.gexf --case 3 --depth 2
+
+import os
+import tempfile
+import threading
+import time
+
+import click
+
+from .models import db, Company, Crawl
+from .crawler import start_crawl, run_crawl, DEFAULT_WORKERS, DEFAULT_BATCH_SIZE
+from .bulk_import import import_companies, import_psc, DEFAULT_CHUNK_SIZE, DEFAULT_PSC_WORKERS
+from .db_tuning import benchmark, PROFILES
+from .dedupe import run_dedupe, DEFAULT_THRESHOLD, DEFAULT_MAX_BLOCK
+from .search import rebuild_search_index
+from .jobs import JobRunner
+from .analytics import refresh_node_metrics, BETWEENNESS_SAMPLES
+from .export import graph_records, export_graph, missing_dependency, ExportStats, FORMATS
+from .streaming import (run_stream, write_events, synthetic_events, get_stream_key, STREAM_PATHS,
+                        DEFAULT_BATCH_SIZE as DEFAULT_STREAM_BATCH_SIZE, DEFAULT_FLUSH_SECONDS)
+
+
+def register_commands(app):
+
+    @app.cli.command("deep-dig")
+    @click.argument("company_number", required=False)
+    @click.option("--depth", default=2, show_default=True, help="How many hops to follow.")
+    @click.option("--follow-appointments", is_flag=True, help="Also follow officers' other appointments.")
+    @click.option("--workers", default=DEFAULT_WORKERS, show_default=True, help="Concurrent API fetches.")
+    @click.option("--batch-size", default=DEFAULT_BATCH_SIZE, show_default=True, help="Companies per transaction.")
+    @click.option("--resume", "resume_id", type=int, help="Resume an interrupted crawl by id.")
+    def deep_dig(company_number, depth, follow_appointments, workers, batch_size, resume_id):
+        """Crawl an ownership tree from COMPANY_NUMBER."""
+        if resume_id:
+            crawl = db.session.get(Crawl, resume_id)
+            if crawl is None:
+                raise click.ClickException(f"No crawl with id {resume_id}.")
+        elif company_number:
+            crawl = start_crawl(company_number, depth, follow_appointments)
+            db.session.commit()
+        else:
+            raise click.UsageError("Give a COMPANY_NUMBER or --resume ID.")
+
+        click.echo(f"Deep dig {crawl.id} from {crawl.root_company_number} (depth {crawl.max_depth})")
+
+        def progress(counts):
+            click.echo(f"  done {counts['done']}  pending {counts['pending']}  errors {counts['error']}")
+
+        crawl = run_crawl(crawl.id, workers=workers, batch_size=batch_size, progress=progress)
+        click.echo(f"Deep dig {crawl.id} {crawl.status}.")
+        if crawl.error:
+            click.echo(crawl.error, err=True)
+
+    @app.cli.command("import-companies")
+    @click.argument("path", type=click.Path(exists=True, dir_okay=False))
+    @click.option("--chunk-size", default=DEFAULT_CHUNK_SIZE, show_default=True, help="Rows per transaction.")
+    @click.option("--restart", is_flag=True, help="Ignore the checkpoint of an interrupted import of this file.")
+    def import_companies_command(path, chunk_size, restart):
+        """Load a BasicCompanyData snapshot (.zip or .csv) into the company table."""
+
+        def progress(run, rate):
+            click.echo(f"  {run.rows_done} rows  inserted {run.inserted}  updated {run.updated}  "
+                       f"unchanged {run.unchanged}  ({rate:.0f} rows/s)")
+
+        run = import_companies(path, chunk_size=chunk_size, restart=restart, progress=progress)
+        click.echo(f"Import {run.id} {run.status}: {run.rows_done} rows, {run.inserted} inserted, "
+                   f"{run.updated} updated, {run.unchanged} unchanged.")
+
+    @app.cli.command("import-psc")
+    @click.argument("path", type=click.Path(exists=True, dir_okay=False))
+    @click.option("--chunk-size", default=DEFAULT_CHUNK_SIZE, show_default=True, help="Lines per transaction.")
+    @click.option("--workers", default=DEFAULT_PSC_WORKERS, show_default=True, help="Parser processes.")
+    @click.option("--restart", is_flag=True, help="Ignore the checkpoint of an interrupted import of this file.")
+    def import_psc_command(path, chunk_size, workers, restart):
+        """Load a PSC snapshot (.zip or JSON lines); run import-companies first."""
+
+        def progress(run, rate):
+            click.echo(f"  {run.rows_done} lines  inserted {run.inserted}  updated {run.updated}  "
+                       f"unchanged {run.unchanged}  skipped {run.skipped}  ({rate:.0f} lines/s)")
+
+        run = import_psc(path, chunk_size=chunk_size, workers=workers, restart=restart, progress=progress)
+        click.echo(f"Import {run.id} {run.status}: {run.rows_done} lines, {run.inserted} inserted, "
+                   f"{run.updated} updated, {run.unchanged} unchanged, {run.skipped} skipped.")
+
+    @app.cli.command("dedupe-persons")
+    @click.option("--threshold", default=DEFAULT_THRESHOLD, show_default=True, help="Minimum match score, 0..1.")
+    @click.option("--max-block", default=DEFAULT_MAX_BLOCK, show_default=True,
+                  help="Skip blocking keys shared by more persons than this.")
+    @click.option("--rebuild-keys", is_flag=True, help="Recompute every blocking key, not just missing ones.")
+    def dedupe_persons_command(threshold, max_block, rebuild_keys):
+        """Find persons that look like the same individual and queue them for review."""
+
+        def progress(stage, count):
+            click.echo(f"  {stage}: {count}")
+
+        summary = run_dedupe(threshold=threshold, max_block=max_block, rebuild_keys=rebuild_keys,
+                             progress=progress)
+        click.echo(f"Keyed {summary['keyed']} persons; {summary['clusters']} clusters covering "
+                   f"{summary['persons']} persons are waiting on /persons/duplicates.")
+
+    @app.cli.command("rebuild-search-index")
+    def rebuild_search_index_command():
+        """Create the company/person search index if missing and refill it."""
+        with db.engine.begin() as connection:
+            rebuild_search_index(connection)
+        click.echo("Search index rebuilt.")
+
+    @app.cli.command("bench-db")
+    @click.option("--profile", "profiles", multiple=True, type=click.Choice(PROFILES),
+                  help="Profile to run (repeatable); all of them by default.")
+    @click.option("--seconds", default=10, show_default=True, help="Run time per profile.")
+    @click.option("--readers", default=4, show_default=True, help="Concurrent reader threads.")
+    @click.option("--writers", default=2, show_default=True, help="Concurrent upsert threads.")
+    def bench_db_command(profiles, seconds, readers, writers):
+        """Compare DB_PROFILE settings on the app's list, lookup and upsert queries, on a scratch SQLite file."""
+        for profile in profiles or PROFILES:
+            with tempfile.TemporaryDirectory() as scratch:
+                result = benchmark(os.path.join(scratch, "bench.db"), profile, seconds=seconds,
+                                   readers=readers, writers=writers)
+            click.echo(f"{profile:>8}: {result['writes_per_second']:.0f} companies upserted/s  "
+                       f"{result['reads_per_second']:.0f} queries/s  {result['errors']} lock errors")
+
+    @app.cli.command("run-jobs")
+    @click.option("--workers", default=2, show_default=True, help="Worker threads.")
+    @click.option("--drain", is_flag=True, help="Exit once the queue is empty instead of waiting for more.")
+    def run_jobs_command(workers, drain):
+        """Run queued Companies House fetch jobs (for use with JOB_WORKERS=0 on the web server)."""
+        runner = JobRunner(app, workers=workers, stale_seconds=app.config["JOB_STALE_SECONDS"])
+        if drain:
+            click.echo(f"Ran {runner.run_until_idle()} jobs.")
+            return
+        runner.start()
+        click.echo(f"Running jobs with {workers} workers; Ctrl-C to stop.")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            runner.stop(timeout=30)
+
+    @app.cli.command("stream-sync")
+    @click.option("--stream", "streams", multiple=True, type=click.Choice(list(STREAM_PATHS)),
+                  help="Stream to follow (repeatable); all of them by default.")
+    @click.option("--replay", type=click.Path(exists=True, dir_okay=False),
+                  help="Apply a recorded stream file instead of the live stream.")
+    @click.option("--record", type=click.Path(dir_okay=False), help="Also append the live events to this file.")
+    @click.option("--batch-size", default=DEFAULT_STREAM_BATCH_SIZE, show_default=True, help="Events per transaction.")
+    @click.option("--flush-seconds", default=DEFAULT_FLUSH_SECONDS, show_default=True,
+                  help="Write a part batch after this long.")
+    def stream_sync_command(streams, replay, record, batch_size, flush_seconds):
+        """Apply Companies House streaming API changes to the companies already loaded."""
+        streams = streams or tuple(STREAM_PATHS)
+        if (replay or record) and len(streams) != 1:
+            raise click.ClickException("--replay and --record need exactly one --stream.")
+        if not replay and not get_stream_key():
+            raise click.ClickException("COMPANIES_HOUSE_STREAM_KEY is not configured.")
+
+        def progress(checkpoint):
+            click.echo(f"  {checkpoint.stream}: timepoint {checkpoint.timepoint}, "
+                       f"{checkpoint.events} events, {checkpoint.applied} applied")
+
+        if replay:
+            started = time.monotonic()
+            summary = run_stream(streams[0], replay=replay, batch_size=batch_size,
+                                 flush_seconds=flush_seconds, progress=progress)
+            elapsed = time.monotonic() - started
+            click.echo(f"Replayed {summary['events']} events ({summary['applied']} applied) in {elapsed:.1f}s, "
+                       f"{summary['events'] / max(elapsed, 1e-9):.0f} events/s.")
+            return
+
+        # One connection per stream, each on its own thread with its own session.
+        stop = threading.Event()
+
+        def follow(stream):
+            with app.app_context():
+                try:
+                    run_stream(stream, record=record, batch_size=batch_size, flush_seconds=flush_seconds,
+                               stop=stop, progress=progress, log=click.echo)
+                except Exception:
+                    app.logger.exception("Stream %s stopped", stream)
+
+        threads = [threading.Thread(target=follow, args=(stream,), name=f"stream-{stream}", daemon=True)
+                   for stream in streams]
+        for thread in threads:
+            thread.start()
+        click.echo(f"Following {', '.join(streams)}; Ctrl-C to stop.")
+        try:
+            while any(thread.is_alive() for thread in threads):
+                time.sleep(1)
+        except KeyboardInterrupt:
+            stop.set()
+
+    @app.cli.command("stream-sample")
+    @click.argument("stream", type=click.Choice(list(STREAM_PATHS)))
+    @click.argument("path", type=click.Path(dir_okay=False))
+    @click.option("--events", default=100000, show_default=True, help="Events to write.")
+    @click.option("--unknown-share", default=0.5, show_default=True,
+                  help="Share of events for companies not in the database.")
+    def stream_sample_command(stream, path, events, unknown_share):
+        """Write a synthetic stream file over the loaded companies, for replay benchmarks."""
+        numbers = [number for (number,) in db.session.query(Company.company_number).limit(100000)]
+        count = write_events(path, synthetic_events(stream, numbers, events, unknown_share))
+        click.echo(f"Wrote {count} {stream} events to {path}.")
+
+    @app.cli.command("graph-metrics")
+    @click.option("--samples", default=BETWEENNESS_SAMPLES, show_default=True,
+                  help="Sources sampled for the betweenness estimate.")
+    @click.option("--force", is_flag=True, help="Recompute even if the graph has not changed.")
+    def graph_metrics_command(samples, force):
+        """Score every node (degree, PageRank, betweenness, components, communities, hubs)."""
+        started = time.monotonic()
+        summary = refresh_node_metrics(samples=samples, force=force)
+        if summary["skipped"]:
+            click.echo("Graph unchanged since the last run; nothing to do (use --force to recompute).")
+            return
+        click.echo(f"Scored {summary['nodes']} nodes over {summary['edges']} relationships in "
+                   f"{time.monotonic() - started:.1f}s: {summary['written']} rows written, "
+                   f"{summary['deleted']} removed.")
+
+    @app.cli.command("export-graph")
+    @click.argument("path", type=click.Path(dir_okay=False))
+    @click.option("--format", "fmt", type=click.Choice(list(FORMATS)),
+                  help="Output format; by default taken from PATH's extension, else graphml.")
+    @click.option("--case", "case_id", type=int, help="Export the network of this case.")
+    @click.option("--focus", "focus_company", type=int, help="Export the neighbourhood of this company id.")
+    @click.option("--depth", default=1, show_default=True, help="Hops around the case or focus company.")
+    @click.option("--types", "rel_types", multiple=True, help="Only these relationship types (repeatable).")
+    def export_graph_command(path, fmt, case_id, focus_company, depth, rel_types):
+        """Write the graph, a case's network or a company's neighbourhood to PATH."""
+        if fmt is None:
+            fmt = next((f for f, (_, extension) in FORMATS.items() if path.endswith("." + extension)), "graphml")
+        problem = missing_dependency(fmt)
+        if problem:
+            raise click.ClickException(problem)
+        stats = ExportStats()
+        nodes, edges = graph_records(focus_company, case_id, depth, list(rel_types))
+        with open(path, "wb") as out:
+            for chunk in export_graph(fmt, nodes, edges, stats):
+                out.write(chunk)
+        click.echo(f"Wrote {path} ({fmt}): {stats.summary()}.")
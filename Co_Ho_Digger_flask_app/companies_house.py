@@ -0,0 +1,197 @@
+# my_flask_app/companies_house.py
+
+import os
+import threading
+import time
+
+import requests
+
+from .ch_cache import ResponseCache, endpoint_for_path, cache_key, canonical_path
+
+API_BASE_URL = "https://api.company-information.service.gov.uk"
+
+# Companies House allows 600 requests per key in any 5 minute window.
+DEFAULT_RATE_LIMIT = 600
+DEFAULT_RATE_PERIOD = 300
+REQUEST_TIMEOUT = 30
+MAX_RETRIES = 3
+
+
+class RateLimiter:
+    """
+    Token bucket shared by every thread that talks to Companies House.
+    The bucket holds up to `capacity` tokens and refills at `rate` tokens
+    per second; each request takes one token, blocking until one is free.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """
+    Return the process-wide limiter, sized from CH_RATE_LIMIT requests
+    per CH_RATE_PERIOD seconds (defaults to the published quota).
+    """
+    global _rate_limiter
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            limit = int(os.getenv("CH_RATE_LIMIT", DEFAULT_RATE_LIMIT))
+            period = int(os.getenv("CH_RATE_PERIOD", DEFAULT_RATE_PERIOD))
+            # Allow a burst of a tenth of the window so short digs are not throttled.
+            _rate_limiter = RateLimiter(rate=limit / period, capacity=max(1, limit // 10))
+        return _rate_limiter
+
+
+_response_cache = None
+
+
+def configure_cache(path, max_bytes, ttls=None):
+    """Turn on the on-disk response cache (called once from create_app)."""
+    global _response_cache
+    _response_cache = ResponseCache(path, max_bytes=max_bytes, ttls=ttls)
+    return _response_cache
+
+
+def get_response_cache():
+    return _response_cache
+
+
+def get_api_key():
+    return os.getenv("COMPANIES_HOUSE_API_KEY")
+
+
+def debug_dump(label, data):
+    # Only print the raw JSON if DEBUG_JSON is set to true.
+    if os.getenv("DEBUG_JSON", "false").lower() == "true":
+        print(f"DEBUG: Raw {label} Data:")
+        print(data)
+
+
+def api_get(path, api_key=None, params=None):
+    """
+    GET a Companies House API path (e.g. "/company/01234567") and return the
+    decoded JSON. Fresh cached responses are returned without a request;
+    stale ones are revalidated with their ETag. Live requests wait on the
+    shared rate limiter and are retried when the API answers 429. HTTP
+    errors are raised as requests exceptions.
+    """
+    path = canonical_path(path)
+    cache = _response_cache
+    entry = None
+    if cache is not None:
+        key = cache_key(path, params)
+        entry, fresh = cache.lookup(key)
+        if fresh:
+            return entry.data()
+
+    headers = {}
+    if entry is not None and entry.etag:
+        headers["If-None-Match"] = entry.etag
+
+    api_key = api_key or get_api_key()
+    limiter = get_rate_limiter()
+    for attempt in range(MAX_RETRIES + 1):
+        limiter.acquire()
+        response = requests.get(API_BASE_URL + path, auth=(api_key, ""), params=params,
+                                headers=headers, timeout=REQUEST_TIMEOUT)
+        if response.status_code == 429 and attempt < MAX_RETRIES:
+            time.sleep(float(response.headers.get("Retry-After", 10)))
+            continue
+        if response.status_code == 304 and entry is not None:
+            cache.revalidated(key)
+            return entry.data()
+        response.raise_for_status()
+        data = response.json()
+        if cache is not None:
+            cache.store(key, endpoint_for_path(path), response.headers.get("ETag"), data)
+        return data
+
+
+def fetch_company_profile(company_number, api_key=None):
+    data = api_get(f"/company/{company_number}", api_key)
+    debug_dump("Company", data)
+    return data
+
+
+# The API accepts up to 100 items per page on the officer and PSC lists.
+PAGE_SIZE = 100
+
+
+def iter_pages(path, api_key=None, label="API", page_size=PAGE_SIZE):
+    """
+    Walk a paginated list endpoint with start_index/items_per_page, yielding
+    one page of `items` at a time so callers never hold the whole list.
+    """
+    start_index = 0
+    while True:
+        data = api_get(path, api_key, params={"start_index": start_index, "items_per_page": page_size})
+        debug_dump(label, data)
+        items = data.get("items") or []
+        if not items:
+            return
+        yield items
+        start_index += len(items)
+        # Pages can come back shorter than asked for, so only the total says
+        # when the list is done; without one, a short page is the end.
+        total = data.get("total_results")
+        if total is None:
+            if len(items) < page_size:
+                return
+        elif start_index >= total:
+            return
+
+
+def iter_officer_pages(company_number, api_key=None):
+    return iter_pages(f"/company/{company_number}/officers", api_key, "Officers")
+
+
+def iter_psc_pages(company_number, api_key=None):
+    return iter_pages(f"/company/{company_number}/persons-with-significant-control", api_key, "PSC")
+
+
+def fetch_officers(company_number, api_key=None):
+    return [item for page in iter_officer_pages(company_number, api_key) for item in page]
+
+
+def fetch_psc(company_number, api_key=None):
+    return [item for page in iter_psc_pages(company_number, api_key) for item in page]
+
+
+def fetch_officer_appointments(appointments_path, api_key=None):
+    """
+    Fetch the appointment list behind an officer's `links.officer.appointments`
+    path and return the company numbers that officer is appointed to.
+    """
+    data = api_get(appointments_path, api_key)
+    numbers = []
+    for item in data.get("items", []):
+        number = (item.get("appointed_to") or {}).get("company_number")
+        if number:
+            numbers.append(number)
+    return numbers
+
+
+def is_not_found(err):
+    return isinstance(err, requests.exceptions.HTTPError) and \
+        err.response is not None and err.response.status_code == 404
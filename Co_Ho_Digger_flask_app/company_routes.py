@@ -1,16 +1,21 @@
 # my_flask_app/company_routes.py
 
-from flask import flash, Blueprint, render_template, request, redirect, url_for, session
-from .models import db, Company, Relationship, Person, Relationship, RelationshipType, RelationshipAttribute, CaseDetail
-import requests
-import os
-from datetime import datetime
+from flask import flash, Blueprint, render_template, request, redirect, url_for, session, jsonify
+from .models import db, normalize_company_number, delete_relationships_of, Company, Relationship, Person, Relationship, RelationshipType, RelationshipAttribute, CaseDetail
 from sqlalchemy.exc import IntegrityError
+from . import companies_house
+from .relationship_display import relationship_display_rows
+from .pagination import keyset_neighbors, keyset_paginate, get_page_size, like_pattern
+from .db_tuning import replica_reads
+from .jobs import enqueue_job
+from .ownership import beneficial_owners, DEFAULT_THRESHOLD
+from .analytics import with_scores, split_scores, LIST_SCORES
 
 
 company_bp = Blueprint("company_bp", __name__, template_folder="templates")
 
 @company_bp.route("/companies")
+@replica_reads
 def companies_list():
     from .models import Company, CaseDetail  # ensure both are imported
     from flask import session
@@ -18,6 +23,8 @@ def companies_list():
     sort = request.args.get('sort', 'name')   # default sort by name
     order = request.args.get('order', 'asc')    # default ascending
     case_filter = request.args.get('case_filter', 'off')  # "on" or "off"
+    hubs = request.args.get('hubs', 'off')  # "on" lists only hubs
+    q = request.args.get('q', '').strip()
 
     current_case_id = session.get('current_case_id')
 
@@ -28,23 +35,37 @@ def companies_list():
                      .filter(CaseDetail.case_id == current_case_id)\
                      .distinct()
 
-    if sort == 'name':
-        query = query.order_by(Company.name.asc() if order == 'asc' else Company.name.desc())
-    elif sort == 'company_number':
-        query = query.order_by(Company.company_number.asc() if order == 'asc' else Company.company_number.desc())
+    if q:
+        pattern = like_pattern(q)
+        query = query.filter(db.or_(Company.name.ilike(pattern, escape="\\"),
+                                    Company.company_number.ilike(pattern, escape="\\"),
+                                    Company.normalized_number == normalize_company_number(q)))
+
+    id_col = Company.id
+    if sort == 'company_number':
+        sort_col = Company.company_number
+    elif sort in LIST_SCORES:
+        sort_col, id_col = LIST_SCORES[sort]
     else:
-        query = query.order_by(Company.name.asc())
+        sort, sort_col = 'name', Company.name
 
-    companies = query.all()
+    # One page at a time, in (sort column, id) order, with each company's graph scores.
+    query = with_scores(query, Company, sort_col, id_col, hubs_only=(hubs == 'on'))
+    page = keyset_paginate(query, sort_col, id_col, descending=(order == 'desc'),
+                           after=request.args.get('after'), before=request.args.get('before'),
+                           page_size=get_page_size())
+    scores = split_scores(page)
 
-    # If a case is selected, build a set of company IDs already associated with the current case.
+    # If a case is selected, find which of the companies on this page are already in it.
     case_company_ids = set()
-    if current_case_id:
-        details = CaseDetail.query.filter_by(case_id=current_case_id).all()
+    if current_case_id and page.items:
+        details = CaseDetail.query.filter(CaseDetail.case_id == current_case_id,
+                                          CaseDetail.company_id.in_([c.id for c in page.items])).all()
         case_company_ids = {detail.company_id for detail in details}
 
-    return render_template("companies_list.html", companies=companies, sort=sort, order=order,
-                           case_filter=case_filter, case_company_ids=case_company_ids)
+    return render_template("companies_list.html", companies=page, page=page, sort=sort, order=order,
+                           case_filter=case_filter, case_company_ids=case_company_ids, q=q,
+                           scores=scores, hubs=hubs)
 
 
 @company_bp.route("/companies/new", methods=["GET", "POST"])
@@ -115,19 +136,10 @@ def companies_edit(company_id):
 @company_bp.route("/companies/<int:company_id>/delete", methods=["POST"])
 def companies_delete(company_id):
     company = Company.query.get_or_404(company_id)
-    
-    # Query relationships where this company is the source.
-    rels_as_source = Relationship.query.filter_by(source_type="company", source_id=company.id).all()
-    # Query relationships where this company is the target.
-    rels_as_target = Relationship.query.filter_by(target_type="company", target_id=company.id).all()
-    
-    # Combine the lists.
-    all_relationships = rels_as_source + rels_as_target
-    
-    # Delete each relationship.
-    for rel in all_relationships:
-        db.session.delete(rel)
-    
+
+    # Remove every relationship touching the company in one statement.
+    delete_relationships_of(company.node_id)
+
     # Delete the company record.
     db.session.delete(company)
     db.session.commit()
@@ -143,93 +155,19 @@ def dig_company():
             flash("Company number is required.", "warning")
             return render_template("dig_company_form.html")
 
-        api_key = os.getenv("COMPANIES_HOUSE_API_KEY")
-        if not api_key:
+        if not companies_house.get_api_key():
             flash("Companies House API key is not configured.", "danger")
             return render_template("dig_company_form.html")
 
-        url = f"https://api.company-information.service.gov.uk/company/{company_number}"
-        try:
-            response = requests.get(url, auth=(api_key, ""))
-            response.raise_for_status()
-        except requests.exceptions.HTTPError as err:
-            flash(f"Error calling Companies House: {err}", "danger")
-            return render_template("dig_company_form.html")
-        except requests.exceptions.RequestException as err:
-            flash(f"Network error: {err}", "danger")
-            return render_template("dig_company_form.html")
-
-        data = response.json()
-
-        # Only print the raw JSON if DEBUG_JSON is set to true.
-        if os.getenv("DEBUG_JSON", "false").lower() == "true":
-            print("DEBUG: Raw PSC Data:")
-            print(data)
-
-        ch_company_name = data.get("company_name")
-        if not ch_company_name:
-            flash("No company name found in API response.", "danger")
-            return render_template("dig_company_form.html")
-
-        # Extract additional fields.
-        address_parts = []
-        reg_address = data.get("registered_office_address", {})
-        for part in ["address_line_1", "address_line_2", "postal_code", "locality"]:
-            if reg_address.get(part):
-                address_parts.append(reg_address.get(part))
-        registered_address = ", ".join(address_parts)
-        company_status = data.get("company_status")
-        incorporation_date_str = data.get("date_of_creation")
-        incorporation_date = None
-        if incorporation_date_str:
-            from datetime import datetime
-            try:
-                incorporation_date = datetime.strptime(incorporation_date_str, "%Y-%m-%d").date()
-            except ValueError:
-                incorporation_date = None
-
-        # Upsert: update if exists, else create.
-        existing = Company.query.filter_by(company_number=company_number).first()
-        if existing:
-            existing.name = ch_company_name
-            existing.registered_address = registered_address
-            existing.company_status = company_status
-            existing.incorporation_date = incorporation_date
-            flash("Existing company updated with latest data.", "info")
-            company_record = existing
+        # Fetched in the background; the new company is added to the current case, if any.
+        normalized = normalize_company_number(company_number)
+        job, created = enqueue_job("dig_company", f"dig_company:{normalized}",
+                                   {"company_number": company_number, "case_id": session.get("current_case_id")})
+        if created:
+            flash(f"Fetching company {company_number} from Companies House (job {job.id}).", "info")
         else:
-            new_company = Company(
-                name=ch_company_name,
-                company_number=company_number,
-                registered_address=registered_address,
-                company_status=company_status,
-                incorporation_date=incorporation_date
-            )
-            db.session.add(new_company)
-            flash("New company added.", "success")
-            company_record = new_company
-        try:
-            db.session.commit()
-        except IntegrityError:
-            db.session.rollback()
-            flash("A company with that number already exists.", "danger")
-            return render_template("dig_company_form.html")
-
-        # If a case is currently selected, add this company to the case details.
-        from flask import session  # ensure session is imported
-        current_case_id = session.get("current_case_id")
-        if current_case_id:
-            from .models import CaseDetail  # ensure CaseDetail is imported
-            # Check if the company is already linked to the current case.
-            existing_detail = CaseDetail.query.filter_by(case_id=current_case_id, company_id=company_record.id).first()
-            if not existing_detail:
-                new_detail = CaseDetail(case_id=current_case_id, company_id=company_record.id)
-                db.session.add(new_detail)
-                db.session.commit()
-                flash("New company created and added to the current case.", "success")
-            else:
-                flash("New company created.", "success")
-        return redirect(url_for("company_bp.companies_list"))
+            flash(f"Company {company_number} is already being fetched (job {job.id}).", "info")
+        return redirect(url_for("job_bp.jobs_list"))
 
     return render_template("dig_company_form.html")
 
@@ -238,319 +176,56 @@ def dig_company():
 def companies_view(company_id):
     company = Company.query.get_or_404(company_id)
     
-    # Get all companies sorted by name (alphabetically)
-    all_companies = Company.query.order_by(Company.name.asc()).all()
-    current_index = None
-    for idx, comp in enumerate(all_companies):
-        if comp.id == company.id:
-            current_index = idx
-            break
-    previous_company = all_companies[current_index - 1] if current_index and current_index > 0 else None
-    next_company = all_companies[current_index + 1] if current_index is not None and current_index < len(all_companies) - 1 else None
-
-    # Existing relationships logic remains unchanged.
-    relationships_source = Relationship.query.filter_by(source_type="company", source_id=company.id).all()
-    relationships_target = Relationship.query.filter_by(target_type="company", target_id=company.id).all()
-    all_relationships = relationships_source + relationships_target
-    display_data = []
-    for r in all_relationships:
-        rtype = r.relationship_type.name if r.relationship_type else "Unknown"
-        if r.source_type.lower() == "company":
-            source_obj = Company.query.get(r.source_id)
-            source_display = f"{source_obj.name} ({source_obj.company_number})" if source_obj else "Unknown Company"
-        else:
-            source_obj = Person.query.get(r.source_id)
-            source_display = source_obj.full_name if source_obj else "Unknown Person"
-        if r.target_type.lower() == "company":
-            target_obj = Company.query.get(r.target_id)
-            target_display = f"{target_obj.name} ({target_obj.company_number})" if target_obj else "Unknown Company"
-        else:
-            target_obj = Person.query.get(r.target_id)
-            target_display = target_obj.full_name if target_obj else "Unknown Person"
-        attributes_str = ", ".join([f"{attr.key}: {attr.value}" for attr in r.attributes]) if r.attributes else "N/A"
-        effective_date_str = r.effective_date.isoformat() if r.effective_date else "N/A"
-        display_data.append({
-            "id": r.id,
-            "relationship_type": rtype,
-            "source_display": source_display,
-            "source_type": r.source_type,
-            "source_id": r.source_id,
-            "target_display": target_display,
-            "target_type": r.target_type,
-            "target_id": r.target_id,
-            "effective_date": effective_date_str,
-            "attributes": attributes_str
-        })
+    # Neighbours in (name, id) order for the previous/next links.
+    previous_company, next_company = keyset_neighbors(Company.query, Company.name, Company.id,
+                                                      company.name, company.id)
+
+    # Relationships where this company is source or target, resolved in bulk.
+    all_relationships = Relationship.touching(company.node_id).all()
+    display_data = relationship_display_rows(all_relationships)
+
+    # Ultimate beneficial owners through the PSC chain (cached, see ownership.py).
+    threshold = _requested_threshold()
+    owners = beneficial_owners(company, threshold)
 
     return render_template("companies_view.html", company=company, relationships=display_data,
-                           previous_company=previous_company, next_company=next_company)
+                           previous_company=previous_company, next_company=next_company,
+                           owners=owners, threshold=threshold * 100)
+
+@company_bp.route("/api/companies/<int:company_id>/owners")
+def company_owners_api(company_id):
+    """Ultimate beneficial owners of a company; ?threshold= is a percentage (default 25)."""
+    company = Company.query.get_or_404(company_id)
+    threshold = _requested_threshold()
+    return jsonify({"company_id": company.id, "threshold": threshold * 100,
+                    "owners": beneficial_owners(company, threshold)})
+
+def _requested_threshold():
+    threshold = request.args.get("threshold", type=float)
+    if threshold is None or not 0 <= threshold <= 100:
+        return DEFAULT_THRESHOLD
+    return threshold / 100
 
 @company_bp.route("/companies/<int:company_id>/update_officers", methods=["POST"])
 def update_officers(company_id):
-    company = Company.query.get_or_404(company_id)
-    
-    api_key = os.getenv("COMPANIES_HOUSE_API_KEY")
-    if not api_key:
-        flash("Companies House API key is not configured.", "danger")
-        return redirect(url_for("company_bp.companies_view", company_id=company.id))
-    
-    officers_url = f"https://api.company-information.service.gov.uk/company/{company.company_number}/officers"
-    
-    try:
-        response = requests.get(officers_url, auth=(api_key, ""))
-        response.raise_for_status()
-    except requests.exceptions.HTTPError as err:
-        flash(f"Error fetching officers: {err}", "danger")
-        return redirect(url_for("company_bp.companies_view", company_id=company.id))
-    except requests.exceptions.RequestException as err:
-        flash(f"Network error: {err}", "danger")
-        return redirect(url_for("company_bp.companies_view", company_id=company.id))
-    
-    data = response.json()
-    
-    # Only print the raw JSON if DEBUG_JSON is set to true.
-    if os.getenv("DEBUG_JSON", "false").lower() == "true":
-        print("DEBUG: Raw PSC Data:")
-        print(data)
-    
-    officers_list = data.get("items", [])
-    
-    for officer in officers_list:
-        # Skip if officer has resigned
-        if officer.get("resigned_on"):
-            continue
-        
-        officer_name = officer.get("name")
-        officer_role = officer.get("officer_role")  # e.g., "director", "secretary"
-        appointed_on = officer.get("appointed_on")
-        
-        if not officer_name:
-            continue
-
-        # Find or create Person record for the officer.
-        person = Person.query.filter_by(full_name=officer_name).first()
-        if not person:
-            person = Person(full_name=officer_name)
-            db.session.add(person)
-            db.session.flush()  # Assign ID
-        
-        # Determine relationship type based on officer_role
-        rel_type_name = None
-        if officer_role and "director" in officer_role.lower():
-            rel_type_name = "Director"
-        elif officer_role and "secretary" in officer_role.lower():
-            rel_type_name = "Secretary"
-        else:
-            continue  # Skip roles we don't handle
-        
-        rel_type = RelationshipType.query.filter_by(name=rel_type_name).first()
-        if not rel_type:
-            rel_type = RelationshipType(name=rel_type_name)
-            db.session.add(rel_type)
-            db.session.flush()
-        
-        # Now, create or update the relationship such that:
-        #   - Source: Person (officer)
-        #   - Target: Company (the one we're viewing)
-        existing_rel = Relationship.query.filter_by(
-            relationship_type_id=rel_type.id,
-            source_type="person", source_id=person.id,
-            target_type="company", target_id=company.id
-        ).first()
-        
-        effective_date = None
-        if appointed_on:
-            try:
-                effective_date = datetime.strptime(appointed_on, "%Y-%m-%d").date()
-            except ValueError:
-                effective_date = None
-
-        if existing_rel:
-            existing_rel.effective_date = effective_date
-        else:
-            new_rel = Relationship(
-                relationship_type_id=rel_type.id,
-                source_type="person",  # now person is the source
-                source_id=person.id,
-                target_type="company",  # company is the target
-                target_id=company.id,
-                effective_date=effective_date
-            )
-            db.session.add(new_rel)
-    
-    try:
-        db.session.commit()
-        flash("Officers updated successfully.", "success")
-    except IntegrityError as e:
-        db.session.rollback()
-        flash(f"Database error: {e}", "danger")
-    
-    return redirect(url_for("company_bp.companies_view", company_id=company.id))
+    return _queue_company_job(company_id, "update_officers", "Officer")
 
 @company_bp.route("/companies/<int:company_id>/update_psc", methods=["POST"])
 def update_psc(company_id):
+    return _queue_company_job(company_id, "update_psc", "PSC")
+
+
+def _queue_company_job(company_id, kind, label):
+    """Queue an officer or PSC refresh of the company and go straight back to it."""
     company = Company.query.get_or_404(company_id)
-    api_key = os.getenv("COMPANIES_HOUSE_API_KEY")
-    if not api_key:
+    if not companies_house.get_api_key():
         flash("Companies House API key is not configured.", "danger")
         return redirect(url_for("company_bp.companies_view", company_id=company.id))
-    
-    # Build the PSC endpoint URL.
-    psc_url = f"https://api.company-information.service.gov.uk/company/{company.company_number}/persons-with-significant-control"
-    
-    try:
-        response = requests.get(psc_url, auth=(api_key, ""))
-        response.raise_for_status()
-    except requests.exceptions.HTTPError as err:
-        flash(f"Error fetching PSC data: {err}", "danger")
-        return redirect(url_for("company_bp.companies_view", company_id=company.id))
-    except requests.exceptions.RequestException as err:
-        flash(f"Network error: {err}", "danger")
-        return redirect(url_for("company_bp.companies_view", company_id=company.id))
-    
-    data = response.json()
-    
-    # Only print the raw JSON if DEBUG_JSON is set to true.
-    if os.getenv("DEBUG_JSON", "false").lower() == "true":
-        print("DEBUG: Raw PSC Data:")
-        print(data)
-    
-    psc_list = data.get("items", [])
-    
-    if not psc_list:
-        flash("No PSC data returned from Companies House.", "warning")
-        return redirect(url_for("company_bp.companies_view", company_id=company.id))
-    
-    # Define UK countries.
-    uk_countries = ['england', 'scotland', 'wales', 'northern ireland']
-    
-    for psc in psc_list:
-        # Skip if the PSC is inactive.
-        if psc.get("ceased") or psc.get("ceased_on"):
-            continue
-        
-        # Use notified_on as effective date.
-        notified_on = psc.get("notified_on")
-        effective_date = None
-        if notified_on:
-            try:
-                effective_date = datetime.strptime(notified_on, "%Y-%m-%d").date()
-            except ValueError:
-                effective_date = None
-
-        # Extract natures_of_control (list) and join into a string.
-        natures = psc.get("natures_of_control", [])
-        control_details = ", ".join(natures) if natures else None
-
-        psc_kind = psc.get("kind", "").lower()
-        psc_entity_type = None
-        psc_entity_id = None
-        
-        if "corporate-entity" in psc_kind:
-            psc_name = psc.get("name")
-            identification = psc.get("identification", {})
-            reg_number = identification.get("registration_number", "")
-            country_registered = identification.get("country_registered", "").lower()
-            if country_registered in uk_countries:
-                try:
-                    psc_reg_numeric = int(reg_number.lstrip("0"))
-                except ValueError:
-                    psc_reg_numeric = None
-                psc_company = None
-                if psc_reg_numeric is not None:
-                    all_companies = Company.query.all()
-                    for comp in all_companies:
-                        try:
-                            comp_reg_numeric = int(comp.company_number.lstrip("0"))
-                        except ValueError:
-                            comp_reg_numeric = None
-                        if comp_reg_numeric is not None and comp_reg_numeric == psc_reg_numeric:
-                            psc_company = comp
-                            break
-                if not psc_company:
-                    psc_company = Company(name=psc_name, company_number=reg_number)
-                    db.session.add(psc_company)
-                    db.session.flush()
-                psc_entity_type = "company"
-                psc_entity_id = psc_company.id
-            else:
-                psc_entity_type = "person"
-                psc_person = Person.query.filter_by(full_name=psc.get("name")).first()
-                if not psc_person:
-                    psc_person = Person(full_name=psc.get("name"))
-                    db.session.add(psc_person)
-                    db.session.flush()
-                psc_entity_id = psc_person.id            
-        else:
-            # For individual PSC, try to get details from "individual_person"; if not, use top-level "name".
-            individual = psc.get("individual_person")
-            if individual and individual.get("name"):
-                psc_name = individual.get("name")
-            else:
-                psc_name = psc.get("name")
-            if not psc_name:
-                continue
-            psc_entity_type = "person"
-            psc_person = Person.query.filter_by(full_name=psc_name).first()
-            if not psc_person:
-                psc_person = Person(full_name=psc_name)
-                db.session.add(psc_person)
-                db.session.flush()
-            psc_entity_id = psc_person.id
-        
-        # Map to relationship type "PSC"
-        rel_type_name = "PSC"
-        rel_type = RelationshipType.query.filter_by(name=rel_type_name).first()
-        if not rel_type:
-            rel_type = RelationshipType(name=rel_type_name)
-            db.session.add(rel_type)
-            db.session.flush()
-        
-        # Create or update the relationship: Person is source, Company is target.
-        existing_rel = Relationship.query.filter_by(
-            relationship_type_id=rel_type.id,
-            source_type=psc_entity_type, source_id=psc_entity_id,
-            target_type="company", target_id=company.id
-        ).first()
-        if existing_rel:
-            existing_rel.effective_date = effective_date
-            rel_obj = existing_rel
-        else:
-            new_rel = Relationship(
-                relationship_type_id=rel_type.id,
-                source_type=psc_entity_type,
-                source_id=psc_entity_id,
-                target_type="company",
-                target_id=company.id,
-                effective_date=effective_date
-            )
-            db.session.add(new_rel)
-            db.session.flush()
-            rel_obj = new_rel
-        
-        # For the PSC relationship, add/update a relationship attribute for control details.
-        if control_details:
-            # Try to find an existing attribute with key "control".
-            existing_attr = None
-            for attr in rel_obj.attributes:
-                if attr.key.lower() == "control":
-                    existing_attr = attr
-                    break
-            if existing_attr:
-                existing_attr.value = control_details
-            else:
-                new_attr = RelationshipAttribute(
-                    relationship_id=rel_obj.id,
-                    key="control",
-                    value=control_details
-                )
-                db.session.add(new_attr)
-    
-    try:
-        db.session.commit()
-        flash("PSC data updated successfully.", "success")
-    except IntegrityError as e:
-        db.session.rollback()
-        flash(f"Database error: {e}", "danger")
-    
+
+    job, created = enqueue_job(kind, f"{kind}:{company.id}", {"company_id": company.id})
+    if created:
+        flash(f"{label} update queued (job {job.id}); see Jobs for progress.", "info")
+    else:
+        flash(f"{label} update is already queued (job {job.id}).", "info")
     return redirect(url_for("company_bp.companies_view", company_id=company.id))
+
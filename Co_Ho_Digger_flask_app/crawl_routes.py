@@ -0,0 +1,83 @@
+# my_flask_app/crawl_routes.py
+
+import threading
+
+from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app
+from .models import db, Crawl
+from .crawler import start_crawl, run_crawl, crawl_progress
+from . import companies_house
+
+crawl_bp = Blueprint("crawl_bp", __name__, template_folder="templates")
+
+# Crawls with a live thread in this process. A crawl marked "running" that is
+# not in here was interrupted (e.g. by a restart) and can be resumed.
+_active_crawls = set()
+
+
+def _run_in_background(crawl_id):
+    app = current_app._get_current_object()
+    _active_crawls.add(crawl_id)
+
+    def target():
+        with app.app_context():
+            try:
+                run_crawl(crawl_id)
+            except Exception:
+                app.logger.exception("Deep dig %s failed", crawl_id)
+            finally:
+                _active_crawls.discard(crawl_id)
+
+    threading.Thread(target=target, name=f"crawl-{crawl_id}", daemon=True).start()
+
+
+@crawl_bp.route("/crawls")
+def crawls_list():
+    crawls = Crawl.query.order_by(Crawl.created_at.desc()).all()
+    progress = {crawl.id: crawl_progress(crawl.id) for crawl in crawls}
+    return render_template("crawls_list.html", crawls=crawls, progress=progress,
+                           active_crawls=_active_crawls)
+
+
+@crawl_bp.route("/crawls/new", methods=["GET", "POST"])
+def crawls_new():
+    if request.method == "POST":
+        company_number = request.form.get("company_number", "").strip()
+        if not company_number:
+            flash("Company number is required.", "warning")
+            return render_template("crawls_new.html")
+        if not companies_house.get_api_key():
+            flash("Companies House API key is not configured.", "danger")
+            return render_template("crawls_new.html")
+        try:
+            max_depth = max(0, min(int(request.form.get("depth", 2)), 10))
+        except ValueError:
+            max_depth = 2
+        follow_appointments = request.form.get("follow_appointments") == "on"
+
+        crawl = start_crawl(company_number, max_depth, follow_appointments)
+        db.session.commit()
+        _run_in_background(crawl.id)
+        flash(f"Deep dig of {crawl.root_company_number} started.", "success")
+        return redirect(url_for("crawl_bp.crawls_list"))
+
+    return render_template("crawls_new.html")
+
+
+@crawl_bp.route("/crawls/<int:crawl_id>/resume", methods=["POST"])
+def crawls_resume(crawl_id):
+    crawl = Crawl.query.get_or_404(crawl_id)
+    if crawl.id in _active_crawls:
+        flash("That deep dig is already running.", "warning")
+    else:
+        _run_in_background(crawl.id)
+        flash(f"Deep dig of {crawl.root_company_number} resumed.", "success")
+    return redirect(url_for("crawl_bp.crawls_list"))
+
+
+@crawl_bp.route("/crawls/<int:crawl_id>/delete", methods=["POST"])
+def crawls_delete(crawl_id):
+    crawl = Crawl.query.get_or_404(crawl_id)
+    db.session.delete(crawl)
+    db.session.commit()
+    flash("Deep dig deleted.", "info")
+    return redirect(url_for("crawl_bp.crawls_list"))
@@ -0,0 +1,215 @@
+# my_flask_app/crawler.py
+#
+# Deep dig: expand an ownership tree from one company by following corporate
+# PSCs and corporate officers (and optionally officers' other appointments).
+# HTTP fetches run on a bounded thread pool behind the shared rate limiter;
+# all database writes happen on the calling thread in batched transactions.
+# refresh_companies() uses the same machinery to re-fetch a known set of
+# companies (e.g. a case's) without following links.
+
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
+from datetime import datetime
+
+import requests
+
+from .models import db, Company, Crawl, CrawlItem
+from . import companies_house
+from .ingest import apply_company_bundle, linked_company_numbers, format_company_number, RelationshipTypeCache
+
+DEFAULT_WORKERS = 4
+DEFAULT_BATCH_SIZE = 20
+# Companies written per transaction by refresh_companies().
+DEFAULT_REFRESH_BATCH_SIZE = 50
+
+
+def start_crawl(company_number, max_depth, follow_appointments=False):
+    """Create a crawl seeded with its root company. The caller commits."""
+    company_number = format_company_number(company_number)
+    crawl = Crawl(root_company_number=company_number, max_depth=max_depth,
+                  follow_appointments=follow_appointments)
+    db.session.add(crawl)
+    db.session.flush()
+    db.session.add(CrawlItem(crawl_id=crawl.id, company_number=company_number, depth=0))
+    return crawl
+
+
+def crawl_progress(crawl_id):
+    """Return a dict of item counts by status for one crawl."""
+    rows = db.session.query(CrawlItem.status, db.func.count(CrawlItem.id))\
+        .filter(CrawlItem.crawl_id == crawl_id)\
+        .group_by(CrawlItem.status).all()
+    counts = {"pending": 0, "done": 0, "error": 0}
+    counts.update(dict(rows))
+    return counts
+
+
+def fetch_company_bundle(company_number, api_key, follow_appointments=False):
+    """
+    Fetch everything a crawl needs for one company. Runs on a worker thread,
+    so it must not touch the database session.
+    """
+    profile = companies_house.fetch_company_profile(company_number, api_key)
+    try:
+        officers = companies_house.fetch_officers(company_number, api_key)
+    except requests.exceptions.HTTPError as err:
+        if not companies_house.is_not_found(err):
+            raise
+        officers = []
+    try:
+        psc_list = companies_house.fetch_psc(company_number, api_key)
+    except requests.exceptions.HTTPError as err:
+        if not companies_house.is_not_found(err):
+            raise
+        psc_list = []
+
+    links = linked_company_numbers(officers, psc_list)
+    if follow_appointments:
+        for officer in officers:
+            if officer.get("resigned_on"):
+                continue
+            path = ((officer.get("links") or {}).get("officer") or {}).get("appointments")
+            if path:
+                links.update(format_company_number(number) for number in
+                             companies_house.fetch_officer_appointments(path, api_key))
+    links.discard(company_number)
+    return {"profile": profile, "officers": officers, "psc": psc_list, "links": links}
+
+
+def _write_batch(crawl, results, rel_types):
+    """Apply a batch of fetched bundles and grow the frontier, in one transaction."""
+    discovered = {}
+    for item, bundle, error in results:
+        if error is not None:
+            item.status = "error"
+            item.error = str(error)
+            continue
+        try:
+            apply_company_bundle(item.company_number, bundle, rel_types)
+        except ValueError as err:
+            item.status = "error"
+            item.error = str(err)
+            continue
+        item.status = "done"
+        item.error = None
+        if item.depth < crawl.max_depth:
+            for number in bundle["links"]:
+                discovered.setdefault(number, item.depth + 1)
+
+    if discovered:
+        known = {number for (number,) in db.session.query(CrawlItem.company_number)
+                 .filter(CrawlItem.crawl_id == crawl.id,
+                         CrawlItem.company_number.in_(list(discovered)))}
+        for number, depth in discovered.items():
+            if number not in known:
+                db.session.add(CrawlItem(crawl_id=crawl.id, company_number=number, depth=depth))
+    db.session.commit()
+
+
+def run_crawl(crawl_id, workers=DEFAULT_WORKERS, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    """
+    Run (or resume) a crawl until its frontier is empty. Items still pending
+    from an interrupted run are simply fetched again. `progress`, if given,
+    is called with the counts dict after every batch.
+    """
+    crawl = db.session.get(Crawl, crawl_id)
+    api_key = companies_house.get_api_key()
+    if not api_key:
+        crawl.status = "failed"
+        crawl.error = "Companies House API key is not configured."
+        db.session.commit()
+        return crawl
+
+    crawl.status = "running"
+    crawl.error = None
+    db.session.commit()
+
+    rel_types = RelationshipTypeCache()
+    in_flight = {}  # future -> CrawlItem id
+    results = []
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while True:
+                # Keep the pool topped up, shallowest items first.
+                free = workers * 2 - len(in_flight)
+                if free > 0:
+                    # Fetched items stay pending until their batch is written.
+                    busy = list(in_flight.values()) + [item.id for item, _, _ in results]
+                    query = CrawlItem.query.filter_by(crawl_id=crawl.id, status="pending")
+                    if busy:
+                        query = query.filter(CrawlItem.id.notin_(busy))
+                    for item in query.order_by(CrawlItem.depth, CrawlItem.id).limit(free):
+                        future = pool.submit(fetch_company_bundle, item.company_number, api_key,
+                                             crawl.follow_appointments)
+                        in_flight[future] = item.id
+                if not in_flight:
+                    break
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    item = db.session.get(CrawlItem, in_flight.pop(future))
+                    try:
+                        results.append((item, future.result(), None))
+                    except requests.exceptions.RequestException as err:
+                        results.append((item, None, err))
+
+                if len(results) >= batch_size or not in_flight:
+                    _write_batch(crawl, results, rel_types)
+                    results = []
+                    if progress:
+                        progress(crawl_progress(crawl.id))
+    except Exception as err:
+        db.session.rollback()
+        crawl = db.session.get(Crawl, crawl_id)
+        crawl.status = "failed"
+        crawl.error = str(err)
+        db.session.commit()
+        raise
+
+    crawl.status = "finished"
+    crawl.finished_at = datetime.utcnow()
+    db.session.commit()
+    return crawl
+
+
+def refresh_companies(company_ids, api_key, workers=DEFAULT_WORKERS, batch_size=DEFAULT_REFRESH_BATCH_SIZE,
+                      force=False, progress=None):
+    """
+    Re-fetch the profile, officers and PSCs of the given companies on the
+    worker pool and write them `batch_size` companies per transaction,
+    skipping parts whose content is unchanged since the last fetch.
+    `progress`, if given, is called with the number of companies written in
+    each batch just before it commits. Returns a summary dict.
+    """
+    numbers = [number for (number,) in db.session.query(Company.company_number)
+               .filter(Company.id.in_(list(company_ids))).order_by(Company.id)]
+    summary = {"companies": len(numbers), "changed": 0, "unchanged": 0, "errors": {}}
+    rel_types = RelationshipTypeCache()
+
+    def write(results):
+        for number, bundle, error in results:
+            if error is None:
+                try:
+                    _, changed = apply_company_bundle(number, bundle, rel_types, force=force)
+                    summary["changed" if changed else "unchanged"] += 1
+                    continue
+                except ValueError as err:
+                    error = err
+            summary["errors"][number] = str(error)
+        if progress:
+            progress(len(results))
+        db.session.commit()
+
+    results = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(fetch_company_bundle, number, api_key): number for number in numbers}
+        for future in as_completed(futures):
+            try:
+                results.append((futures[future], future.result(), None))
+            except requests.exceptions.RequestException as err:
+                results.append((futures[future], None, err))
+            if len(results) >= batch_size:
+                write(results)
+                results = []
+    if results:
+        write(results)
+    return summary
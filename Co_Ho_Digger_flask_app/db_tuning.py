@@ -0,0 +1,255 @@
+# my_flask_app/db_tuning.py
+#
+# Engine profiles picked with DB_PROFILE:
+#   tuned   (default) SQLite: WAL, synchronous=NORMAL, mmap, a bigger page
+#           cache and a busy timeout so background writers (deep digs, bulk
+#           imports, the graph index build) don't make requests fail with
+#           "database is locked". PostgreSQL: sized pool, overflow, recycle,
+#           pre-ping and a bigger compiled statement cache.
+#   default plain SQLAlchemy defaults, as before profiles existed.
+# Every setting can be overridden from the environment (see .env.sample).
+#
+# DATABASE_READ_URL adds a read replica; views wrapped in @replica_reads
+# send their queries there while writes and flushes stay on the primary.
+
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import g, has_app_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, create_engine, insert, select, update, bindparam, tuple_
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import OperationalError
+
+PROFILES = ("tuned", "default")
+REPLICA_BIND = "replica"
+
+
+def _env_int(name, default):
+    return int(os.getenv(name, default))
+
+
+def sqlite_pragmas(profile):
+    """PRAGMA name -> value to run on every new SQLite connection."""
+    if profile != "tuned":
+        return {}
+    return {
+        "journal_mode": "WAL",
+        "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+        "mmap_size": _env_int("SQLITE_MMAP_MB", 256) * 1024 * 1024,
+        # Negative cache_size is in KiB rather than pages.
+        "cache_size": -_env_int("SQLITE_CACHE_MB", 64) * 1024,
+        "busy_timeout": _env_int("SQLITE_BUSY_TIMEOUT_MS", 5000),
+    }
+
+
+def engine_options(url, profile):
+    """Keyword arguments for create_engine (SQLALCHEMY_ENGINE_OPTIONS)."""
+    if profile != "tuned" or make_url(url).get_backend_name() == "sqlite":
+        return {}
+    return {
+        "pool_size": _env_int("DB_POOL_SIZE", 10),
+        "max_overflow": _env_int("DB_MAX_OVERFLOW", 20),
+        "pool_recycle": _env_int("DB_POOL_RECYCLE", 1800),
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "true").lower() == "true",
+        "query_cache_size": _env_int("DB_QUERY_CACHE_SIZE", 1500),
+    }
+
+
+def apply_sqlite_pragmas(engine, pragmas):
+    if not pragmas or engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+
+def get_profile():
+    profile = os.getenv("DB_PROFILE", "tuned").lower()
+    if profile not in PROFILES:
+        raise ValueError(f"DB_PROFILE must be one of {', '.join(PROFILES)}, not {profile!r}")
+    return profile
+
+
+def configure_database(app, db_url):
+    """Set the engine config for `db_url` (and any replica) on the app, before db.init_app."""
+    profile = get_profile()
+    app.config["DB_PROFILE"] = profile
+    app.config["SQLALCHEMY_DATABASE_URI"] = db_url
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(db_url, profile)
+    read_url = os.getenv("DATABASE_READ_URL")
+    if read_url:
+        app.config["SQLALCHEMY_BINDS"] = {
+            REPLICA_BIND: dict(engine_options(read_url, profile), url=read_url),
+        }
+
+
+def tune_engines(app, db):
+    """Install the SQLite PRAGMAs on every engine; call after db.init_app."""
+    pragmas = sqlite_pragmas(app.config.get("DB_PROFILE", "tuned"))
+    with app.app_context():
+        for engine in db.engines.values():
+            apply_sqlite_pragmas(engine, pragmas)
+
+
+class RoutingSession(Session):
+    """
+    db.session class that sends reads to the replica bind while the current
+    request is inside a @replica_reads view. Flushes always go to the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and has_app_context() and g.get("replica_reads"):
+            replica = self._db.engines.get(REPLICA_BIND)
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def replica_reads(view):
+    """Run a read-only view's queries against DATABASE_READ_URL when one is set."""
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.replica_reads = True
+        return view(*args, **kwargs)
+
+    return wrapper
+
+
+@contextmanager
+def primary_reads():
+    """Read from the primary inside a @replica_reads view, e.g. when replica lag would matter."""
+    previous = g.get("replica_reads") if has_app_context() else None
+    if previous:
+        g.replica_reads = False
+    try:
+        yield
+    finally:
+        if previous:
+            g.replica_reads = previous
+
+
+def benchmark(path, profile, seconds=10, readers=4, writers=2, seed_companies=20000, batch_size=50):
+    """
+    The app's hot queries against a scratch SQLite file at `path` built from
+    the real schema (db.metadata, search triggers included): `writers`
+    threads upsert batches of companies and their PSC relationships, as a
+    deep dig or import does, while `readers` threads page through the
+    company and person lists and look up relationships by node, as the list
+    and network pages do. Returns a dict of counts and rates.
+    """
+    # models imports this module, so its tables are looked up here.
+    from .models import db, Node, Company, Person, Relationship, RelationshipType
+
+    url = f"sqlite:///{path}"
+    engine = create_engine(url, **engine_options(url, profile))
+    apply_sqlite_pragmas(engine, sqlite_pragmas(profile))
+    db.metadata.create_all(engine)
+    nodes, companies, persons = Node.__table__, Company.__table__, Person.__table__
+    relationships = Relationship.__table__
+
+    def new_nodes(conn, kind, count):
+        return list(conn.scalars(insert(nodes).returning(nodes.c.id), [{"kind": kind}] * count))
+
+    seed_persons = max(seed_companies // 2, 1)
+    with engine.begin() as conn:
+        rel_type = conn.execute(insert(RelationshipType.__table__).values(name="PSC")).inserted_primary_key[0]
+        company_nodes = new_nodes(conn, "company", seed_companies)
+        person_nodes = new_nodes(conn, "person", seed_persons)
+        conn.execute(insert(companies), [
+            {"name": f"Company {n}", "company_number": f"{n:08d}", "normalized_number": str(n),
+             "company_status": "active", "node_id": node} for n, node in enumerate(company_nodes, 1)])
+        conn.execute(insert(persons), [{"full_name": f"Person {n}", "node_id": node}
+                                       for n, node in enumerate(person_nodes, 1)])
+        conn.execute(insert(relationships), [
+            {"relationship_type_id": rel_type, "source_type": "person", "source_id": (n % seed_persons) + 1,
+             "source_node_id": person_nodes[n % seed_persons], "target_type": "company", "target_id": n,
+             "target_node_id": node} for n, node in enumerate(company_nodes, 1)])
+
+    counts = {"writes": 0, "reads": 0, "errors": 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+
+    def count(key, n=1):
+        with lock:
+            counts[key] += n
+
+    def upsert_batch(conn, rng, index):
+        # As bulk_import.upsert_company_chunk: look the numbers up, update
+        # the known ones and insert the rest with their nodes. Each writer
+        # draws from its own numbers so none insert the same company.
+        numbers = {str(rng.randrange(index + 1, seed_companies * 2, writers)) for _ in range(batch_size)}
+        known = dict(conn.execute(select(companies.c.normalized_number, companies.c.id)
+                                  .where(companies.c.normalized_number.in_(numbers))).all())
+        if known:
+            conn.execute(update(companies).where(companies.c.id == bindparam("company_id"))
+                         .values(company_status=bindparam("status")),
+                         [{"company_id": company_id, "status": rng.choice(("active", "dissolved"))}
+                          for company_id in known.values()])
+        fresh = sorted(numbers - set(known))
+        if fresh:
+            fresh_nodes = new_nodes(conn, "company", len(fresh))
+            ids = conn.scalars(insert(companies).returning(companies.c.id, sort_by_parameter_order=True), [
+                {"name": f"Company {number}", "company_number": f"{int(number):08d}",
+                 "normalized_number": number, "node_id": node}
+                for number, node in zip(fresh, fresh_nodes)]).all()
+            owners = [rng.randrange(seed_persons) for _ in ids]
+            conn.execute(insert(relationships), [
+                {"relationship_type_id": rel_type, "source_type": "person", "source_id": owner + 1,
+                 "source_node_id": person_nodes[owner], "target_type": "company", "target_id": company_id,
+                 "target_node_id": node} for owner, company_id, node in zip(owners, ids, fresh_nodes)])
+        return len(numbers)
+
+    def writer(index):
+        rng = random.Random()
+        while time.monotonic() < deadline:
+            try:
+                with engine.begin() as conn:
+                    written = upsert_batch(conn, rng, index)
+                count("writes", written)
+            except OperationalError:
+                count("errors")
+
+    def list_page(conn, table, sort_col, rng):
+        # One keyset page, as pagination.keyset_paginate reads it.
+        start = (f"{table.name.title()} {rng.randrange(seed_companies)}", 0)
+        return conn.execute(select(table).where(tuple_(sort_col, table.c.id) > tuple_(*start))
+                            .order_by(sort_col, table.c.id).limit(51)).all()
+
+    def reader():
+        rng = random.Random()
+        while time.monotonic() < deadline:
+            try:
+                with engine.connect() as conn:
+                    list_page(conn, companies, companies.c.name, rng)
+                    list_page(conn, persons, persons.c.full_name, rng)
+                    node = rng.choice(person_nodes)
+                    # One hop of the network view: out from a node, then into its targets.
+                    targets = conn.scalars(select(relationships.c.target_node_id)
+                                           .where(relationships.c.source_node_id == node)).all()
+                    conn.execute(select(relationships.c.id, relationships.c.source_node_id)
+                                 .where(relationships.c.target_node_id.in_(targets or [node]))).all()
+                count("reads", 4)
+            except OperationalError:
+                count("errors")
+
+    threads = ([threading.Thread(target=writer, args=(index,)) for index in range(writers)]
+               + [threading.Thread(target=reader) for _ in range(readers)])
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+    engine.dispose()
+    return dict(counts, profile=profile, seconds=elapsed,
+                writes_per_second=counts["writes"] / elapsed, reads_per_second=counts["reads"] / elapsed)
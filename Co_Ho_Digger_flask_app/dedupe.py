@@ -0,0 +1,366 @@
+# my_flask_app/dedupe.py
+#
+# Duplicate person detection. Officers come back as "SMITH, John Michael",
+# PSCs as "Mr John Michael Smith", and both are matched by exact name when
+# they are written, so one individual often ends up as several persons.
+#
+#   flask dedupe-persons            (or "Find duplicates" on /persons/duplicates)
+#
+# 1. Every person gets a few blocking keys (normalised name, Soundex of the
+#    surname plus first initial, the same with month/year of birth...) in the
+#    indexed person_block_key table. Keys are only computed for persons that
+#    have none, so a re-run after an import only keys the new people.
+# 2. Persons sharing a key are scored pairwise: names token by token
+#    (initials, typos and word order allowed), month/year of birth and
+#    nationality. A known birth date that differs rules a pair out.
+#    Blocks bigger than max_block are skipped; the more specific keys still
+#    pair their members.
+# 3. Pairs above the threshold are joined into clusters (never joining two
+#    different birth dates) and written to duplicate_cluster for review.
+#    Clusters a reviewer dismissed are not suggested again.
+
+import re
+import unicodedata
+from difflib import SequenceMatcher
+from functools import lru_cache
+from itertools import combinations
+
+from sqlalchemy import insert, update, delete, select, func, exists
+
+from .models import (db, Person, Relationship, RelationshipAttribute, PersonBlockKey, DuplicateCluster,
+                     DuplicateClusterMember, drop_case_subgraphs)
+from .graph_index import record_node_merge, record_edge_removal
+
+DEFAULT_THRESHOLD = 0.85
+DEFAULT_MAX_BLOCK = 200
+KEY_CHUNK = 10000
+
+# Dropped from names before comparing.
+_NAME_NOISE = {
+    "mr", "mrs", "ms", "miss", "mx", "dr", "sir", "dame", "lord", "lady", "prof", "professor", "rev",
+    "revd", "reverend", "hon", "honourable", "the", "esq", "jr", "jnr", "sr", "snr", "obe", "mbe",
+    "cbe", "kbe", "dbe", "qc", "kc",
+}
+
+_SOUNDEX_CODES = {}
+for _letters, _digit in (("bfpv", "1"), ("cgjkqsxz", "2"), ("dt", "3"), ("l", "4"), ("mn", "5"), ("r", "6")):
+    for _letter in _letters:
+        _SOUNDEX_CODES[_letter] = _digit
+
+
+def name_tokens(full_name):
+    """
+    Normalise a name to a tuple of lower-case tokens, forenames first and
+    surname last: accents, punctuation and titles are dropped and the
+    Companies House "SURNAME, Forenames" form is turned round.
+    """
+    name = full_name or ""
+    if not name.isascii():
+        name = "".join(c for c in unicodedata.normalize("NFKD", name) if not unicodedata.combining(c))
+    name = name.lower().replace("'", "")
+    if "," in name:
+        surname, _, forenames = name.partition(",")
+        name = f"{forenames} {surname}"
+    return tuple(token for token in re.split(r"[^a-z0-9]+", name) if token and token not in _NAME_NOISE)
+
+
+@lru_cache(maxsize=100000)
+def soundex(word):
+    """American Soundex code of a word ("robert" -> "R163")."""
+    word = "".join(c for c in word.lower() if c.isalpha())
+    if not word:
+        return ""
+    code, last = word[0].upper(), _SOUNDEX_CODES.get(word[0])
+    for c in word[1:]:
+        digit = _SOUNDEX_CODES.get(c)
+        if digit and digit != last:
+            code += digit
+            if len(code) == 4:
+                break
+        if c not in "hw":
+            last = digit
+    return code.ljust(4, "0")
+
+
+def blocking_keys(tokens, birth_year=None, birth_month=None):
+    """The keys a person is filed under; persons are only compared with people sharing one."""
+    if not tokens:
+        return set()
+    surname, first = tokens[-1], tokens[0]
+    keys = {"n:" + " ".join(sorted(tokens))[:110]}
+    if len(tokens) > 1:
+        keys.add(f"s:{soundex(surname)}:{first[0]}")
+        if birth_year:
+            keys.add(f"d:{soundex(surname)}:{first[0]}:{birth_year}-{birth_month or 0}")
+            # Catches surname typos and changes for people with a known birth date.
+            keys.add(f"f:{soundex(first)}:{birth_year}-{birth_month or 0}")
+    return keys
+
+
+def _similar(a, b):
+    """Close spelling: difflib ratio >= 0.85, with its cheap upper bound checked first."""
+    matcher = SequenceMatcher(None, a, b)
+    return matcher.quick_ratio() >= 0.85 and matcher.ratio() >= 0.85
+
+
+def _forename_score(a, b):
+    if a == b:
+        return 1.0
+    if len(a) == 1 or len(b) == 1:
+        return 0.5 if a[0] == b[0] else 0.0
+    return 0.85 if _similar(a, b) else 0.0
+
+
+def name_similarity(a, b):
+    """0..1 similarity of two name_tokens() tuples."""
+    if a == b:
+        return 1.0
+    if sorted(a) == sorted(b):
+        return 0.95
+    if not a or not b:
+        return 0.0
+    if a[-1] == b[-1]:
+        surname = 1.0
+    elif soundex(a[-1]) == soundex(b[-1]) or _similar(a[-1], b[-1]):
+        surname = 0.85  # "Smyth" / "Smith", typos
+    else:
+        return 0.0
+    forenames_a, forenames_b = a[:-1], b[:-1]
+    if not forenames_a or not forenames_b:
+        return 0.4 * surname + 0.3
+    first = _forename_score(forenames_a[0], forenames_b[0])
+    if not first:
+        return 0.4 * surname
+    # Middle names only count against a pair when both have them.
+    middles = list(zip(forenames_a[1:], forenames_b[1:]))
+    middle = sum(_forename_score(x, y) for x, y in middles) / len(middles) if middles else 1.0
+    return 0.4 * surname + 0.4 * first + 0.2 * middle
+
+
+def score_pair(a, b):
+    """
+    Score two (tokens, birth_year, birth_month, nationality) tuples from 0
+    (different people) to 1 (same person).
+    """
+    tokens_a, year_a, month_a, nationality_a = a
+    tokens_b, year_b, month_b, nationality_b = b
+    if (year_a and year_b and year_a != year_b) or (month_a and month_b and month_a != month_b):
+        return 0.0
+    score = name_similarity(tokens_a, tokens_b)
+    if year_a and year_b:
+        score += 0.15 if month_a and month_b else 0.1
+    if nationality_a and nationality_b and nationality_a.lower() != nationality_b.lower():
+        score -= 0.1
+    return max(0.0, min(score, 1.0))
+
+
+def _features(full_name, birth_year, birth_month, nationality):
+    return name_tokens(full_name), birth_year, birth_month, nationality
+
+
+def build_block_keys(rebuild=False, progress=None):
+    """
+    Compute blocking keys for every person without any (all persons with
+    `rebuild`), walking the person table in id order, KEY_CHUNK persons and
+    one executemany per transaction. Returns the number of persons keyed.
+    """
+    if rebuild:
+        db.session.execute(delete(PersonBlockKey))
+        db.session.commit()
+    unkeyed = ~exists().where(PersonBlockKey.person_id == Person.id)
+    last_id, keyed = 0, 0
+    while True:
+        people = db.session.query(Person.id, Person.full_name, Person.birth_year, Person.birth_month)\
+            .filter(Person.id > last_id, unkeyed).order_by(Person.id).limit(KEY_CHUNK).all()
+        if not people:
+            break
+        rows = [{"person_id": person_id, "key": key}
+                for person_id, full_name, birth_year, birth_month in people
+                for key in blocking_keys(name_tokens(full_name), birth_year, birth_month)]
+        if rows:
+            # Core insert on the table: millions of rows, no ORM bookkeeping wanted.
+            db.session.execute(insert(PersonBlockKey.__table__), rows)
+        db.session.commit()
+        last_id, keyed = people[-1][0], keyed + len(people)
+        if progress:
+            progress("keys", keyed)
+    return keyed
+
+
+def _birth_conflict(a, b):
+    """Whether two (year, month) births, either part possibly None, can't be the same person."""
+    return any(x and y and x != y for x, y in zip(a, b))
+
+
+class _Clusters:
+    """Union-find over person ids that refuses to join two different known birth dates."""
+
+    def __init__(self):
+        self.parent, self.birth, self.score = {}, {}, {}
+
+    def find(self, x):
+        parent = self.parent
+        root = parent.setdefault(x, x)
+        while root != parent[root]:
+            parent[root] = parent[parent[root]]
+            root = parent[root]
+        return root
+
+    def union(self, a, b, birth_a, birth_b, score):
+        ra, rb = self.find(a), self.find(b)
+        if ra == rb:
+            return
+        birth_a, birth_b = self.birth.get(ra, birth_a), self.birth.get(rb, birth_b)
+        if _birth_conflict(birth_a, birth_b):
+            return
+        self.parent[rb] = ra
+        self.birth[ra] = tuple(x or y for x, y in zip(birth_a, birth_b))
+        self.score[ra] = min(score, self.score.get(ra, 1.0), self.score.get(rb, 1.0))
+
+    def same(self, a, b):
+        return a in self.parent and b in self.parent and self.find(a) == self.find(b)
+
+    def groups(self):
+        """{root: [person ids]} for every cluster of two or more."""
+        groups = {}
+        for x in self.parent:
+            groups.setdefault(self.find(x), []).append(x)
+        return {root: sorted(ids) for root, ids in groups.items() if len(ids) > 1}
+
+
+def find_duplicate_clusters(threshold=DEFAULT_THRESHOLD, max_block=DEFAULT_MAX_BLOCK, progress=None):
+    """
+    Score persons within each shared block and return a list of
+    (score, [person ids]) clusters. One streaming query, in key order, over
+    the block key index joined to the persons of blocks with 2..max_block
+    members; singletons are never read.
+    """
+    sizes = select(PersonBlockKey.key).group_by(PersonBlockKey.key)\
+        .having(func.count().between(2, max_block))
+    rows = db.session.query(PersonBlockKey.key, Person.id, Person.full_name, Person.birth_year,
+                            Person.birth_month, Person.nationality)\
+        .join(Person, Person.id == PersonBlockKey.person_id)\
+        .filter(PersonBlockKey.key.in_(sizes))\
+        .order_by(PersonBlockKey.key, Person.id)
+
+    clusters, features = _Clusters(), {}
+    blocks = pairs = 0
+
+    def score_block(members):
+        nonlocal pairs
+        for a, b in combinations(members, 2):
+            if clusters.same(a, b):
+                continue
+            pairs += 1
+            fa, fb = features[a], features[b]
+            score = score_pair(fa, fb)
+            if score >= threshold:
+                clusters.union(a, b, fa[1:3], fb[1:3], score)
+
+    current_key, members = None, []
+    for key, person_id, full_name, birth_year, birth_month, nationality in rows.yield_per(KEY_CHUNK):
+        if key != current_key:
+            if len(members) > 1:
+                score_block(members)
+                blocks += 1
+                if progress and blocks % 10000 == 0:
+                    progress("blocks", blocks)
+            current_key, members = key, []
+        if person_id not in features:
+            features[person_id] = _features(full_name, birth_year, birth_month, nationality)
+        members.append(person_id)
+    if len(members) > 1:
+        score_block(members)
+        blocks += 1
+
+    if progress:
+        progress("pairs", pairs)
+    return [(clusters.score[root], ids) for root, ids in clusters.groups().items()]
+
+
+def write_clusters(clusters):
+    """
+    Replace the pending clusters with `clusters` ((score, person ids)
+    pairs), leaving out any whose members were all in one dismissed
+    cluster. Returns (clusters written, persons in them); the caller commits.
+    """
+    dismissed = {}
+    for cluster_id, person_id in db.session.query(DuplicateClusterMember.cluster_id,
+                                                  DuplicateClusterMember.person_id)\
+            .join(DuplicateCluster).filter(DuplicateCluster.status == "dismissed"):
+        dismissed.setdefault(person_id, set()).add(cluster_id)
+
+    def was_dismissed(person_ids):
+        common = set(dismissed.get(person_ids[0], ()))
+        for person_id in person_ids[1:]:
+            common &= dismissed.get(person_id, set())
+        return bool(common)
+
+    pending = select(DuplicateCluster.id).where(DuplicateCluster.status == "pending")
+    db.session.execute(delete(DuplicateClusterMember).where(DuplicateClusterMember.cluster_id.in_(pending)))
+    db.session.execute(delete(DuplicateCluster).where(DuplicateCluster.status == "pending"))
+
+    clusters = [(score, ids) for score, ids in clusters if not was_dismissed(ids)]
+    if not clusters:
+        return 0, 0
+    # Ids must come back in order here, to attach the members.
+    cluster_ids = db.session.scalars(
+        insert(DuplicateCluster).returning(DuplicateCluster.id, sort_by_parameter_order=True),
+        [{"score": round(score, 3), "status": "pending"} for score, _ in clusters]).all()
+    db.session.execute(insert(DuplicateClusterMember), [
+        {"cluster_id": cluster_id, "person_id": person_id}
+        for cluster_id, (_, ids) in zip(cluster_ids, clusters) for person_id in ids])
+    return len(clusters), sum(len(ids) for _, ids in clusters)
+
+
+def run_dedupe(threshold=DEFAULT_THRESHOLD, max_block=DEFAULT_MAX_BLOCK, rebuild_keys=False, progress=None):
+    """Key any new persons, find clusters and store them for review. Returns a summary dict."""
+    keyed = build_block_keys(rebuild=rebuild_keys, progress=progress)
+    clusters = find_duplicate_clusters(threshold, max_block, progress)
+    written, persons = write_clusters(clusters)
+    db.session.commit()
+    return {"keyed": keyed, "clusters": written, "persons": persons}
+
+
+def merge_persons(keep, others):
+    """
+    Fold `others` (Person rows) into `keep`: their relationships are
+    repointed with one UPDATE per end, relationships that now say the same
+    thing twice are dropped, details `keep` lacks are copied over and the
+    duplicates are deleted. The caller commits.
+    """
+    others = [person for person in others if person.id != keep.id]
+    if not others:
+        return
+    node_ids = [person.node_id for person in others]
+    drop_case_subgraphs(node_ids + [keep.node_id])
+    for end in ("source", "target"):
+        node_column = getattr(Relationship, f"{end}_node_id")
+        db.session.execute(update(Relationship).where(node_column.in_(node_ids)).values({
+            f"{end}_type": "person",
+            f"{end}_id": keep.id,
+            node_column: keep.node_id,
+        }).execution_options(synchronize_session=False))
+    for person in others:
+        for column in ("birth_year", "birth_month", "nationality"):
+            if getattr(keep, column) is None and getattr(person, column) is not None:
+                setattr(keep, column, getattr(person, column))
+        record_node_merge(("person", person.id), ("person", keep.id))
+        db.session.delete(person)
+
+    # Both copies of a person were often appointed to the same company.
+    seen, repeated = set(), []
+    for rel_id, type_id, source_node_id, target_node_id in db.session.query(
+            Relationship.id, Relationship.relationship_type_id, Relationship.source_node_id,
+            Relationship.target_node_id).filter(db.or_(Relationship.source_node_id == keep.node_id,
+                                            Relationship.target_node_id == keep.node_id))\
+            .order_by(Relationship.id):
+        key = (type_id, source_node_id, target_node_id)
+        if key in seen:
+            repeated.append(rel_id)
+        seen.add(key)
+    if repeated:
+        db.session.execute(delete(RelationshipAttribute).where(RelationshipAttribute.relationship_id.in_(repeated)))
+        db.session.execute(delete(Relationship).where(Relationship.id.in_(repeated))
+                           .execution_options(synchronize_session=False))
+        record_edge_removal(repeated)
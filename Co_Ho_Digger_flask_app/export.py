@@ -0,0 +1,251 @@
+# my_flask_app/export.py
+#
+# Graph export for Gephi and notebooks: GraphML, GEXF, and CSV or Parquet
+# tables of nodes and edges (nodes and edges files in one zip).
+#
+# Every writer is a generator of byte chunks fed by the node and edge record
+# generators in graph_data, the same records the network page draws
+# (labels with relationship attributes included). Those read their tables
+# with yield_per, a server-side cursor where the driver has one, and each
+# batch is written out before the next is fetched, so memory stays flat
+# however big the graph is. The same chunks go to a chunked HTTP response or
+# to a file.
+#
+# Parquet needs pyarrow, which is optional: pip install pyarrow.
+
+import csv
+import importlib.util
+import io
+import re
+import time
+import zipfile
+from xml.sax.saxutils import escape, quoteattr
+
+from .models import Relationship
+from .graph_data import (iter_nodes, iter_edges, iter_edges_by_ids, filter_relationship_types,
+                         relationship_type_names, relationship_type_ids, split_node_keys)
+from .graph_index import seeded_subgraph
+from .case_graph import case_subgraph
+
+# format -> (mimetype, file extension)
+FORMATS = {
+    "graphml": ("application/graphml+xml", "graphml"),
+    "gexf": ("application/gexf+xml", "gexf"),
+    "csv": ("application/zip", "csv.zip"),
+    "parquet": ("application/zip", "parquet.zip"),
+}
+# Records per chunk written; Parquet writes one row group per PARQUET_ROW_GROUP.
+EXPORT_CHUNK = 1000
+PARQUET_ROW_GROUP = 50000
+
+NODE_COLUMNS = ("id", "kind", "label")
+EDGE_COLUMNS = ("id", "source", "target", "rtype", "label")
+
+# Characters XML 1.0 does not allow, even escaped.
+_XML_INVALID = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")
+
+
+class ExportStats:
+    """Rows and bytes written by an export, for reporting throughput."""
+
+    def __init__(self):
+        self.nodes = 0
+        self.edges = 0
+        self.bytes = 0
+        self.started = time.monotonic()
+
+    def summary(self):
+        seconds = max(time.monotonic() - self.started, 1e-6)
+        rows = self.nodes + self.edges
+        return (f"{self.nodes} nodes and {self.edges} edges ({self.bytes / 1e6:.1f} MB) in {seconds:.1f}s: "
+                f"{rows / seconds:,.0f} rows/s, {self.bytes / 1e6 / seconds:.1f} MB/s")
+
+
+def graph_records(focus_company=None, case_id=None, max_depth=1, rel_types=None):
+    """
+    (nodes, edges) record generators for the whole graph, a case's network
+    or one company's neighbourhood, chosen as /api/network chooses them.
+    """
+    type_names = relationship_type_names()
+    if case_id or focus_company:
+        if case_id:
+            node_keys, rel_ids = case_subgraph(case_id, max_depth, rel_types)
+        else:
+            node_keys, rel_ids = seeded_subgraph([("company", focus_company)], max_depth,
+                                                 relationship_type_ids(rel_types))
+        company_ids, person_ids = split_node_keys(node_keys)
+        return iter_nodes(company_ids, person_ids), iter_edges_by_ids(rel_ids, type_names)
+    return iter_nodes(), iter_edges(filter_relationship_types(Relationship.query, rel_types), type_names)
+
+
+def missing_dependency(fmt):
+    """Why `fmt` cannot be written here, or None if it can."""
+    if fmt == "parquet" and importlib.util.find_spec("pyarrow") is None:
+        return "Parquet export needs pyarrow (pip install pyarrow)."
+    return None
+
+
+def _batched(records, size=EXPORT_CHUNK):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _counted(records, stats, kind):
+    for record in records:
+        setattr(stats, kind, getattr(stats, kind) + 1)
+        yield record
+
+
+def _text(value):
+    return _XML_INVALID.sub("", str(value))
+
+
+def _attr(value):
+    return quoteattr(_text(value))
+
+
+# -- XML ------------------------------------------------------------------------
+
+def _graphml(nodes, edges):
+    yield ('<?xml version="1.0" encoding="UTF-8"?>\n'
+           '<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n'
+           '  <key id="label" for="node" attr.name="label" attr.type="string"/>\n'
+           '  <key id="kind" for="node" attr.name="kind" attr.type="string"/>\n'
+           '  <key id="edge_label" for="edge" attr.name="label" attr.type="string"/>\n'
+           '  <key id="rtype" for="edge" attr.name="rtype" attr.type="string"/>\n'
+           '  <graph id="network" edgedefault="directed">\n')
+    for batch in _batched(nodes):
+        yield "".join(f'    <node id={_attr(n["id"])}><data key="label">{escape(_text(n["label"]))}</data>'
+                      f'<data key="kind">{escape(_text(n["group"]))}</data></node>\n' for n in batch)
+    for batch in _batched(edges):
+        yield "".join(f'    <edge id={_attr(e["id"])} source={_attr(e["from"])} target={_attr(e["to"])}>'
+                      f'<data key="edge_label">{escape(_text(e["label"]))}</data>'
+                      f'<data key="rtype">{escape(_text(e["rtype"]))}</data></edge>\n' for e in batch)
+    yield "  </graph>\n</graphml>\n"
+
+
+def _gexf(nodes, edges):
+    yield ('<?xml version="1.0" encoding="UTF-8"?>\n'
+           '<gexf xmlns="http://gexf.net/1.3" version="1.3">\n'
+           '  <meta><creator>Companies House Digger</creator></meta>\n'
+           '  <graph mode="static" defaultedgetype="directed">\n'
+           '    <attributes class="node"><attribute id="kind" title="kind" type="string"/></attributes>\n'
+           '    <attributes class="edge"><attribute id="rtype" title="rtype" type="string"/></attributes>\n'
+           '    <nodes>\n')
+    for batch in _batched(nodes):
+        yield "".join(f'      <node id={_attr(n["id"])} label={_attr(n["label"])}><attvalues>'
+                      f'<attvalue for="kind" value={_attr(n["group"])}/></attvalues></node>\n' for n in batch)
+    yield "    </nodes>\n    <edges>\n"
+    for batch in _batched(edges):
+        yield "".join(f'      <edge id={_attr(e["id"])} source={_attr(e["from"])} target={_attr(e["to"])} '
+                      f'label={_attr(e["label"])}><attvalues><attvalue for="rtype" value={_attr(e["rtype"])}/>'
+                      f'</attvalues></edge>\n' for e in batch)
+    yield "    </edges>\n  </graph>\n</gexf>\n"
+
+
+# -- tables ---------------------------------------------------------------------
+
+def _node_rows(nodes):
+    for n in nodes:
+        yield n["id"], n["group"], n["label"]
+
+
+def _edge_rows(edges):
+    for e in edges:
+        yield e["id"], e["from"], e["to"], e["rtype"], e["label"]
+
+
+class _Sink:
+    """Write-only buffer a ZipFile writes into; drained after every chunk."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _zipped(tables, write_table):
+    # Written without seeking, so the zip uses data descriptors and every
+    # compressed chunk can be sent as soon as it exists.
+    sink = _Sink()
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, columns, rows in tables:
+            with archive.open(name, "w", force_zip64=True) as handle:
+                for _ in write_table(handle, columns, rows):
+                    data = sink.drain()
+                    if data:
+                        yield data
+    yield sink.drain()
+
+
+def _write_csv(handle, columns, rows):
+    text = io.TextIOWrapper(handle, encoding="utf-8", newline="", write_through=True)
+    writer = csv.writer(text)
+    writer.writerow(columns)
+    for batch in _batched(rows):
+        writer.writerows(batch)
+        yield
+    # Leave closing the entry to the zip.
+    text.detach()
+
+
+def _write_parquet(handle, columns, rows):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([(column, pa.string()) for column in columns])
+    writer = pq.ParquetWriter(handle, schema)
+    for batch in _batched(rows, PARQUET_ROW_GROUP):
+        writer.write_table(pa.Table.from_arrays([pa.array(values, pa.string()) for values in zip(*batch)],
+                                                schema=schema))
+        yield
+    writer.close()
+
+
+def export_graph(fmt, nodes, edges, stats=None):
+    """
+    Byte chunks of the graph given by `nodes` and `edges` (record
+    generators, see graph_records) in `fmt`, one of FORMATS. `stats`, an
+    ExportStats, is kept up to date as the chunks are produced.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    problem = missing_dependency(fmt)
+    if problem:
+        raise ValueError(problem)
+    stats = stats if stats is not None else ExportStats()
+    nodes, edges = _counted(nodes, stats, "nodes"), _counted(edges, stats, "edges")
+
+    def generate():
+        if fmt in ("graphml", "gexf"):
+            chunks = (text.encode("utf-8") for text in (_graphml if fmt == "graphml" else _gexf)(nodes, edges))
+        else:
+            extension = "csv" if fmt == "csv" else "parquet"
+            tables = [(f"nodes.{extension}", NODE_COLUMNS, _node_rows(nodes)),
+                      (f"edges.{extension}", EDGE_COLUMNS, _edge_rows(edges))]
+            chunks = _zipped(tables, _write_csv if fmt == "csv" else _write_parquet)
+        for chunk in chunks:
+            stats.bytes += len(chunk)
+            yield chunk
+    return generate()
+
+
+def export_filename(fmt, focus_company=None, case_id=None):
+    scope = f"case-{case_id}" if case_id else f"company-{focus_company}" if focus_company else "all"
+    return f"network-{scope}.{FORMATS[fmt][1]}"
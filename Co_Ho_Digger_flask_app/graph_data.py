@@ -0,0 +1,237 @@
+# my_flask_app/graph_data.py
+#
+# Node and edge records for the network view, produced as generators so a
+# whole graph can be streamed without building it in memory. Node ids are
+# strings like "company_1" or "person_3"; edges carry "from", "to", "label"
+# and "rtype" as the Vis.js page expects.
+
+from sqlalchemy import case, literal, or_, select
+
+from .models import db, Node, Company, Person, Relationship, RelationshipType, RelationshipAttribute
+
+# Rows fetched per round trip when streaming a table.
+STREAM_CHUNK = 1000
+
+
+def node_id(kind, entity_id):
+    return f"{'company' if kind.lower() == 'company' else 'person'}_{entity_id}"
+
+
+def parse_node_id(value):
+    """Split "company_5" into ("company", 5); returns None for anything else."""
+    kind, _, raw_id = (value or "").partition("_")
+    if kind not in ("company", "person") or not raw_id.isdigit():
+        return None
+    return kind, int(raw_id)
+
+
+def company_node(c):
+    return {
+        "id": f"company_{c.id}",
+        "label": f"{c.name} ({c.company_number})",
+        "group": "company"
+    }
+
+
+def person_node(p):
+    return {
+        "id": f"person_{p.id}",
+        "label": p.full_name,
+        "group": "person"
+    }
+
+
+def _chunks(ids, size=STREAM_CHUNK):
+    ids = sorted(ids)
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def iter_nodes(company_ids=None, person_ids=None):
+    """
+    Yield node records for the given companies and persons, or for every
+    company and person when both are None. Streams in STREAM_CHUNK batches.
+    """
+    if company_ids is None and person_ids is None:
+        for c in Company.query.order_by(Company.id).yield_per(STREAM_CHUNK):
+            yield company_node(c)
+        for p in Person.query.order_by(Person.id).yield_per(STREAM_CHUNK):
+            yield person_node(p)
+        return
+    for chunk in _chunks(company_ids or ()):
+        for c in Company.query.filter(Company.id.in_(chunk)):
+            yield company_node(c)
+    for chunk in _chunks(person_ids or ()):
+        for p in Person.query.filter(Person.id.in_(chunk)):
+            yield person_node(p)
+
+
+def relationship_type_names():
+    return {t.id: t.name for t in RelationshipType.query.all()}
+
+
+def iter_edges(relationships=None, type_names=None):
+    """
+    Yield edge records for a Relationship query (all relationships by
+    default). Attributes are loaded per chunk with one IN query rather than
+    lazily per row.
+    """
+    if relationships is None:
+        relationships = Relationship.query
+    type_names = type_names if type_names is not None else relationship_type_names()
+
+    batch = []
+
+    def flush(batch):
+        attributes = {}
+        for attr in RelationshipAttribute.query.filter(
+                RelationshipAttribute.relationship_id.in_([r.id for r in batch]))\
+                .order_by(RelationshipAttribute.id):
+            attributes.setdefault(attr.relationship_id, []).append(attr)
+        for r in batch:
+            yield edge_record(r, type_names, attributes.get(r.id))
+
+    for r in relationships.order_by(Relationship.id).yield_per(STREAM_CHUNK):
+        batch.append(r)
+        if len(batch) >= STREAM_CHUNK:
+            yield from flush(batch)
+            batch = []
+    if batch:
+        yield from flush(batch)
+
+
+def edge_record(r, type_names, attributes):
+    base_rtype = type_names.get(r.relationship_type_id, "Unknown")
+    # Build attribute string (if any)
+    attributes_str = ", ".join([f"{attr.key}: {attr.value}" for attr in attributes]) if attributes else ""
+    edge_label = f"{base_rtype} ({attributes_str})" if attributes_str else base_rtype
+    return {
+        "id": f"rel_{r.id}",
+        "from": node_id(r.source_type, r.source_id),
+        "to": node_id(r.target_type, r.target_id),
+        "label": edge_label,
+        "rtype": base_rtype
+    }
+
+
+def filter_relationship_types(query, type_names):
+    """Restrict a Relationship query to the named relationship types."""
+    if not type_names:
+        return query
+    type_ids = db.select(RelationshipType.id).where(RelationshipType.name.in_(type_names))
+    return query.filter(Relationship.relationship_type_id.in_(type_ids))
+
+
+def relationship_type_ids(names):
+    """Ids of the named relationship types, or None (meaning all) when no names are given."""
+    if not names:
+        return None
+    return {t.id for t in RelationshipType.query.filter(RelationshipType.name.in_(names))}
+
+
+def split_node_keys(node_keys):
+    """Split (kind, id) tuples into (company_ids, person_ids)."""
+    company_ids, person_ids = set(), set()
+    for kind, entity_id in node_keys:
+        (company_ids if kind == "company" else person_ids).add(entity_id)
+    return company_ids, person_ids
+
+
+def iter_edges_by_ids(relationship_ids, type_names=None):
+    """Yield edge records for the given relationship ids, STREAM_CHUNK per query."""
+    type_names = type_names if type_names is not None else relationship_type_names()
+    for chunk in _chunks(relationship_ids):
+        yield from iter_edges(Relationship.query.filter(Relationship.id.in_(chunk)), type_names)
+
+
+def entity_node_id(kind, entity_id):
+    """Scalar subquery for the node of a company or person."""
+    model = Company if kind.lower() == "company" else Person
+    return select(model.node_id).where(model.id == entity_id).scalar_subquery()
+
+
+def node_keys_for(node_ids):
+    """Map node ids back to (kind, id) tuples: {node_id: ("company", 5)}."""
+    keys = {}
+    node_ids = list(node_ids)
+    for start in range(0, len(node_ids), STREAM_CHUNK):
+        chunk = node_ids[start:start + STREAM_CHUNK]
+        query = select(literal("company"), Company.id, Company.node_id).where(Company.node_id.in_(chunk))\
+            .union_all(select(literal("person"), Person.id, Person.node_id).where(Person.node_id.in_(chunk)))
+        for kind, entity_id, node_id in db.session.execute(query):
+            keys[node_id] = (kind, entity_id)
+    return keys
+
+
+def node_ids_for(node_keys):
+    """Map (kind, id) tuples to node ids: {("company", 5): node_id}; unknown keys are left out."""
+    company_ids, person_ids = split_node_keys(node_keys)
+    found = {}
+    for kind, model, ids in (("company", Company, company_ids), ("person", Person, person_ids)):
+        for chunk in _chunks(ids):
+            for entity_id, node in db.session.execute(select(model.id, model.node_id).where(model.id.in_(chunk))):
+                if node is not None:
+                    found[(kind, entity_id)] = node
+    return found
+
+
+def _type_filter(rel, type_ids):
+    # "+ 0" keeps planners off the relationship_type_id index, which would
+    # scan every relationship of the type instead of walking the endpoints.
+    return (rel.c.relationship_type_id + 0).in_(type_ids)
+
+
+def neighbourhood_query(kind, entity_id, max_depth, type_ids=None):
+    """
+    Return (nodes, relationship_ids) within `max_depth` undirected hops of
+    one node, in the same shape as GraphIndex.neighbourhood, computed in the
+    database with a recursive CTE over the relationship node ids. Each step
+    only reads the relationships touching the current frontier (via the
+    source and target node indexes), so the cost follows the size of the
+    neighbourhood, not of the table. Works on SQLite and PostgreSQL.
+    """
+    return seeded_neighbourhood_query([(kind, entity_id)], max_depth, type_ids)
+
+
+def seeded_neighbourhood_query(seeds, max_depth, type_ids=None):
+    """
+    neighbourhood_query for several starting (kind, id) keys at once:
+    everything within `max_depth` hops of any of them, in one traversal.
+    """
+    seeds = {("company" if kind.lower() == "company" else "person", entity_id) for kind, entity_id in seeds}
+    seed_node_ids = list(node_ids_for(seeds).values())
+    if not seed_node_ids:
+        return seeds, set()
+    rel = Relationship.__table__
+    reach = select(Node.id.label("node_id"), literal(0).label("depth")).where(Node.id.in_(seed_node_ids))\
+        .cte("reach", recursive=True)
+    at_source = rel.c.source_node_id == reach.c.node_id
+    step = select(
+        case((at_source, rel.c.target_node_id), else_=rel.c.source_node_id),
+        reach.c.depth + 1,
+    ).select_from(rel.join(reach, or_(at_source, rel.c.target_node_id == reach.c.node_id)))\
+        .where(reach.c.depth < max_depth)
+    if type_ids is not None:
+        step = step.where(_type_filter(rel, type_ids))
+    reach = reach.union(step)
+
+    nodes = select(reach.c.node_id).where(reach.c.node_id.is_not(None)).distinct().cte("nodes")
+    node_ids = list(db.session.execute(select(nodes.c.node_id)).scalars())
+
+    edges = select(rel.c.id).where(rel.c.source_node_id.in_(select(nodes.c.node_id)),
+                                   rel.c.target_node_id.in_(select(nodes.c.node_id)))
+    if type_ids is not None:
+        edges = edges.where(_type_filter(rel, type_ids))
+    node_keys = set(seeds)
+    node_keys.update(node_keys_for(node_ids).values())
+    return node_keys, set(db.session.execute(edges).scalars())
+
+
+def incident_relationship_ids(kind, entity_id, type_ids=None):
+    """Ids of the relationships touching one node: one lookup on the node indexes."""
+    rel = Relationship.__table__
+    node_id = entity_node_id(kind, entity_id)
+    query = select(rel.c.id).where(or_(rel.c.source_node_id == node_id, rel.c.target_node_id == node_id))
+    if type_ids is not None:
+        query = query.where(_type_filter(rel, type_ids))
+    return set(db.session.execute(query).scalars())
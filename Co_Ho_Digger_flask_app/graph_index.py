@@ -0,0 +1,385 @@
+# my_flask_app/graph_index.py
+#
+# Process-level adjacency index over the relationship table. Every company
+# and person is interned to a small integer and each node keeps a dict of
+# {relationship id: neighbour}, so a focus traversal touches only the
+# subgraph it returns instead of loading every relationship.
+#
+# The index is built on a background thread the first time it is asked for;
+# until it is ready callers fall back to the recursive SQL queries in
+# graph_data. It is kept current from SQLAlchemy events: ORM writes to
+# Relationship, Company and Person are collected as the session flushes and
+# applied when it commits (dropped on rollback). Rows added with bulk
+# inserts, which fire no mapper events, are picked up by an indexed
+# "id > highest seen" query before each use, and the whole index is rebuilt
+# after GRAPH_INDEX_MAX_AGE seconds to pick up writes from other processes.
+
+import threading
+import time
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
+
+from .models import db, Company, Person, Relationship, mark_graph_changed
+from .db_tuning import primary_reads
+from .paths import k_shortest_paths, clamp_search, DEFAULT_MAX_DEPTH
+from .graph_data import seeded_neighbourhood_query
+
+# Rows fetched per round trip while building.
+BUILD_CHUNK = 5000
+DEFAULT_MAX_AGE = 600
+
+_PENDING_KEY = "graph_index_changes"
+
+
+def _kind(value):
+    return "company" if value.lower() == "company" else "person"
+
+
+class GraphIndex:
+    """
+    Undirected multigraph of companies and persons keyed by relationship id.
+    All methods are thread safe.
+    """
+
+    def __init__(self, max_age=DEFAULT_MAX_AGE):
+        self.max_age = max_age
+        self._lock = threading.RLock()
+        self._reset()
+        self.built_at = None
+        self._rebuilding = False
+        # Changes committed while a rebuild runs, replayed onto the new index.
+        self._pending = None
+
+    def _reset(self):
+        self.node_ids = {}      # ("company", 5) -> node int
+        self.node_keys = []     # node int -> ("company", 5)
+        self.adjacency = []     # node int -> {relationship id: neighbour node int}
+        self.edges = {}         # relationship id -> (node int, node int, relationship_type_id)
+        self.max_relationship_id = 0
+
+    def _node(self, kind, entity_id):
+        key = (_kind(kind), entity_id)
+        node = self.node_ids.get(key)
+        if node is None:
+            node = len(self.node_keys)
+            self.node_ids[key] = node
+            self.node_keys.append(key)
+            self.adjacency.append({})
+        return node
+
+    # -- maintenance --------------------------------------------------------
+
+    def _add_edge(self, rel_id, source_type, source_id, target_type, target_id, type_id):
+        if rel_id in self.edges:
+            self._remove_edge(rel_id)
+        self._add_edge_nodes(rel_id, self._node(source_type, source_id),
+                             self._node(target_type, target_id), type_id)
+
+    def _add_edge_nodes(self, rel_id, u, v, type_id):
+        self.edges[rel_id] = (u, v, type_id)
+        self.adjacency[u][rel_id] = v
+        self.adjacency[v][rel_id] = u
+        self.max_relationship_id = max(self.max_relationship_id, rel_id)
+
+    def _remove_edge(self, rel_id):
+        edge = self.edges.pop(rel_id, None)
+        if edge:
+            u, v, _ = edge
+            self.adjacency[u].pop(rel_id, None)
+            self.adjacency[v].pop(rel_id, None)
+            if rel_id == self.max_relationship_id:
+                # SQLite hands the highest id out again once its row is gone.
+                self.max_relationship_id = max(self.edges, default=0)
+
+    def _remove_node(self, kind, entity_id):
+        # The slot is kept (ids are never reused) but loses all its edges.
+        node = self.node_ids.get((_kind(kind), entity_id))
+        if node is not None:
+            for rel_id in list(self.adjacency[node]):
+                self._remove_edge(rel_id)
+
+    def _merge_node(self, from_key, to_key):
+        # Move every edge of one node onto another (person -> company convert).
+        node = self.node_ids.get((_kind(from_key[0]), from_key[1]))
+        if node is None:
+            return
+        target = self._node(*to_key)
+        for rel_id in list(self.adjacency[node]):
+            u, v, type_id = self.edges[rel_id]
+            self._remove_edge(rel_id)
+            self._add_edge_nodes(rel_id, target if u == node else u, target if v == node else v, type_id)
+
+    def _load(self, query):
+        for row in query.yield_per(BUILD_CHUNK):
+            self._add_edge(*row)
+
+    def _endpoint_query(self):
+        return db.session.query(Relationship.id, Relationship.source_type, Relationship.source_id,
+                                Relationship.target_type, Relationship.target_id,
+                                Relationship.relationship_type_id)
+
+    def rebuild(self):
+        """
+        Build the index from scratch. The new structures are filled outside
+        the lock and swapped in at the end, so readers keep using the old
+        ones meanwhile.
+        """
+        fresh = GraphIndex(self.max_age)
+        with self._lock:
+            self._pending = []
+        try:
+            fresh._load(self._endpoint_query().order_by(Relationship.id))
+        except Exception:
+            with self._lock:
+                self._pending = None
+            raise
+        with self._lock:
+            self.node_ids, self.node_keys = fresh.node_ids, fresh.node_keys
+            self.adjacency, self.edges = fresh.adjacency, fresh.edges
+            self.max_relationship_id = fresh.max_relationship_id
+            pending, self._pending = self._pending, None
+            self._apply(pending)
+            self.built_at = time.monotonic()
+
+    def rebuild_in_background(self, app):
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+
+        def target():
+            with app.app_context():
+                try:
+                    self.rebuild()
+                except Exception:
+                    app.logger.exception("Graph index build failed")
+                finally:
+                    with self._lock:
+                        self._rebuilding = False
+
+        threading.Thread(target=target, name="graph-index", daemon=True).start()
+
+    def is_current(self):
+        return self.built_at is not None and time.monotonic() - self.built_at <= self.max_age
+
+    def catch_up(self):
+        """
+        Load relationships added since the last look (one indexed query).
+        Always read from the primary: a lagging replica would hide rows
+        below an id the index has already seen.
+        """
+        with self._lock, primary_reads():
+            self._load(self._endpoint_query()
+                       .filter(Relationship.id > self.max_relationship_id)
+                       .order_by(Relationship.id))
+
+    def apply(self, changes):
+        """Apply (op, args) tuples collected from a committed session."""
+        with self._lock:
+            if self._pending is not None:
+                self._pending.extend(changes)
+            if self.built_at is not None:
+                self._apply(changes)
+
+    def _apply(self, changes):
+        for op, args in changes:
+            if op == "edge":
+                self._add_edge(*args)
+            elif op == "remove_edge":
+                self._remove_edge(*args)
+            elif op == "node":
+                self._node(*args)
+            elif op == "remove_node":
+                self._remove_node(*args)
+            elif op == "merge_node":
+                self._merge_node(*args)
+
+    # -- queries ------------------------------------------------------------
+
+    def neighbourhood(self, kind, entity_id, max_depth, type_ids=None):
+        """
+        Return (nodes, relationship_ids) for everything within `max_depth`
+        undirected hops of one node. `nodes` is a set of (kind, id) tuples;
+        `relationship_ids` are the edges with both ends inside it. With
+        `type_ids`, only relationships of those types are followed.
+        """
+        return self.seeded_neighbourhood([(kind, entity_id)], max_depth, type_ids)
+
+    def seeded_neighbourhood(self, seeds, max_depth, type_ids=None):
+        """neighbourhood() of several (kind, id) keys at once, in one breadth-first walk."""
+        seeds = {(_kind(kind), entity_id) for kind, entity_id in seeds}
+        with self._lock:
+            starts = {self.node_ids[key] for key in seeds if key in self.node_ids}
+            edges, adjacency = self.edges, self.adjacency
+            visited = set(starts)
+            frontier = list(starts)
+            for _ in range(max_depth):
+                next_frontier = []
+                for node in frontier:
+                    for rel_id, neighbour in adjacency[node].items():
+                        if neighbour not in visited and (type_ids is None or edges[rel_id][2] in type_ids):
+                            visited.add(neighbour)
+                            next_frontier.append(neighbour)
+                if not next_frontier:
+                    break
+                frontier = next_frontier
+
+            rel_ids = set()
+            for node in visited:
+                for rel_id, neighbour in adjacency[node].items():
+                    if neighbour in visited and (type_ids is None or edges[rel_id][2] in type_ids):
+                        rel_ids.add(rel_id)
+            return seeds | {self.node_keys[node] for node in visited}, rel_ids
+
+    def incident(self, kind, entity_id, type_ids=None):
+        """Relationship ids touching one node."""
+        with self._lock:
+            node = self.node_ids.get((_kind(kind), entity_id))
+            if node is None:
+                return set()
+            return {rel_id for rel_id in self.adjacency[node]
+                    if type_ids is None or self.edges[rel_id][2] in type_ids}
+
+    def shortest_paths(self, source, target, k=1, type_ids=None, max_depth=DEFAULT_MAX_DEPTH):
+        """
+        Up to `k` shortest connections between two (kind, id) keys as
+        (node keys, relationship ids) pairs, shortest first; see paths.py.
+        """
+        k, max_depth = clamp_search(k, max_depth)
+        with self._lock:
+            start = self.node_ids.get((_kind(source[0]), source[1]))
+            end = self.node_ids.get((_kind(target[0]), target[1]))
+            if start is None or end is None:
+                return []
+            edges, adjacency = self.edges, self.adjacency
+
+            def expand(nodes):
+                return {node: [(rel_id, neighbour) for rel_id, neighbour in adjacency[node].items()
+                               if type_ids is None or edges[rel_id][2] in type_ids]
+                        for node in nodes}
+
+            paths = k_shortest_paths(start, end, expand, k, max_depth)
+            return [([self.node_keys[n] for n in nodes], rel_ids) for nodes, rel_ids in paths]
+
+    def summary(self):
+        with self._lock:
+            return {"nodes": len(self.node_keys), "edges": len(self.edges),
+                    "age_seconds": time.monotonic() - self.built_at if self.built_at else None}
+
+
+def get_graph_index():
+    """
+    The current app's index, caught up and ready to query, or None while
+    its first build is still running. An index past GRAPH_INDEX_MAX_AGE is
+    still returned while its replacement builds in the background.
+    """
+    index = current_app.extensions.get("graph_index")
+    if index is None:
+        index = current_app.extensions.setdefault(
+            "graph_index", GraphIndex(current_app.config.get("GRAPH_INDEX_MAX_AGE", DEFAULT_MAX_AGE)))
+    if not index.is_current():
+        index.rebuild_in_background(current_app._get_current_object())
+    if index.built_at is None:
+        return None
+    index.catch_up()
+    return index
+
+
+def seeded_subgraph(seeds, max_depth, type_ids=None):
+    """
+    (node keys, relationship ids) within `max_depth` hops of any of `seeds`
+    ((kind, id) keys): from the index when it is ready, else by recursive
+    query.
+    """
+    index = get_graph_index()
+    if index is not None:
+        return index.seeded_neighbourhood(seeds, max_depth, type_ids)
+    return seeded_neighbourhood_query(seeds, max_depth, type_ids)
+
+
+# -- event wiring -------------------------------------------------------------
+
+def _record(target, op, args):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault(_PENDING_KEY, []).append((op, args))
+        mark_graph_changed(session)
+
+
+def record_node_merge(from_key, to_key):
+    """
+    Tell the index that every edge of `from_key` now belongs to `to_key`,
+    e.g. after a set-based UPDATE that fires no mapper events. Applied when
+    the current session commits.
+    """
+    db.session.info.setdefault(_PENDING_KEY, []).append(("merge_node", (from_key, to_key)))
+    mark_graph_changed()
+
+
+def record_edge_removal(relationship_ids):
+    """Tell the index relationships were removed by a set-based DELETE; applied on commit."""
+    db.session.info.setdefault(_PENDING_KEY, []).extend(("remove_edge", (rel_id,)) for rel_id in relationship_ids)
+    mark_graph_changed()
+
+
+# What the index keeps of an edge; updates that touch nothing else (dates,
+# say) leave the graph, and its version, as they were.
+_EDGE_COLUMNS = ("source_type", "source_id", "target_type", "target_id",
+                 "source_node_id", "target_node_id", "relationship_type_id")
+
+
+def _relationship_saved(mapper, connection, target):
+    _record(target, "edge", (target.id, target.source_type, target.source_id,
+                             target.target_type, target.target_id, target.relationship_type_id))
+
+
+def _relationship_deleted(mapper, connection, target):
+    _record(target, "remove_edge", (target.id,))
+
+
+def _relationship_changed(mapper, connection, target):
+    state = inspect(target)
+    if any(state.attrs[column].history.has_changes() for column in _EDGE_COLUMNS):
+        _relationship_saved(mapper, connection, target)
+
+
+def _entity_saved(kind):
+    def listener(mapper, connection, target):
+        _record(target, "node", (kind, target.id))
+    return listener
+
+
+def _entity_deleted(kind):
+    def listener(mapper, connection, target):
+        _record(target, "remove_node", (kind, target.id))
+    return listener
+
+
+def _session_committed(session):
+    changes = session.info.pop(_PENDING_KEY, None)
+    if changes and has_app_context():
+        index = current_app.extensions.get("graph_index")
+        if index is not None:
+            index.apply(changes)
+
+
+def _session_rolled_back(session):
+    session.info.pop(_PENDING_KEY, None)
+
+
+def init_graph_index(app):
+    app.config.setdefault("GRAPH_INDEX_MAX_AGE", DEFAULT_MAX_AGE)
+    if event.contains(Session, "after_commit", _session_committed):
+        return
+    event.listen(Relationship, "after_insert", _relationship_saved)
+    event.listen(Relationship, "after_update", _relationship_changed)
+    event.listen(Relationship, "after_delete", _relationship_deleted)
+    # Updating a company or person never changes its edges, so only inserts
+    # and deletes matter for those.
+    for model, kind in ((Company, "company"), (Person, "person")):
+        event.listen(model, "after_insert", _entity_saved(kind))
+        event.listen(model, "after_delete", _entity_deleted(kind))
+    event.listen(Session, "after_commit", _session_committed)
+    event.listen(Session, "after_rollback", _session_rolled_back)
@@ -0,0 +1,547 @@
+# my_flask_app/ingest.py
+#
+# Turns Companies House API payloads into Company / Person / Relationship rows.
+# Nothing in here commits; callers decide how much work goes in a transaction.
+
+import hashlib
+import json
+import re
+from datetime import datetime
+
+from sqlalchemy import insert, update
+from sqlalchemy.orm import selectinload
+
+from .models import (db, normalize_company_number, create_nodes, Company, Person, Relationship, RelationshipType,
+                     RelationshipAttribute)
+
+# PSCs registered in one of these countries are treated as UK companies.
+UK_COUNTRIES = ['england', 'scotland', 'wales', 'northern ireland']
+# Person columns filled from person_details(), in its tuple order.
+PERSON_DETAIL_COLUMNS = ("birth_year", "birth_month", "nationality")
+# Parts of a fetched company bundle; each has a <part>_hash column on Company.
+BUNDLE_PARTS = ("profile", "officers", "psc")
+
+_NUMBER_RE = re.compile(r"^([A-Z]*)(\d+)$")
+
+
+def parse_date(value):
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except ValueError:
+        return None
+
+
+def format_company_number(number):
+    """
+    Return a company number in Companies House's canonical 8 character form,
+    e.g. "1234" -> "00001234" and "sc1234" -> "SC001234".
+    """
+    number = (number or "").replace(" ", "").upper()
+    match = _NUMBER_RE.match(number)
+    if not match or len(number) >= 8:
+        return number
+    prefix, digits = match.groups()
+    return prefix + digits.zfill(8 - len(prefix))
+
+
+def company_fields_from_profile(data):
+    """Extract the Company columns we store from a company profile payload."""
+    address_parts = []
+    reg_address = data.get("registered_office_address", {})
+    for part in ["address_line_1", "address_line_2", "postal_code", "locality"]:
+        if reg_address.get(part):
+            address_parts.append(reg_address.get(part))
+    return {
+        "name": data.get("company_name"),
+        "registered_address": ", ".join(address_parts),
+        "company_status": data.get("company_status"),
+        "incorporation_date": parse_date(data.get("date_of_creation")),
+    }
+
+
+def upsert_company(company_number, fields):
+    """
+    Update the company with this number, or create it. Returns
+    (company, created).
+    """
+    existing = find_company_by_number(company_number)
+    if existing:
+        for key, value in fields.items():
+            setattr(existing, key, value)
+        return existing, False
+    company = Company(company_number=company_number, **fields)
+    db.session.add(company)
+    return company, True
+
+
+class RelationshipTypeCache:
+    """Looks up (or creates) relationship types once per batch."""
+
+    def __init__(self):
+        self._types = {}
+
+    def get(self, name):
+        rel_type = self._types.get(name)
+        if rel_type is None:
+            rel_type = RelationshipType.query.filter_by(name=name).first()
+            if not rel_type:
+                rel_type = RelationshipType(name=name)
+                db.session.add(rel_type)
+                db.session.flush()
+            self._types[name] = rel_type
+        return rel_type
+
+
+def officer_relationship_type(officer_role):
+    if officer_role and "director" in officer_role.lower():
+        return "Director"
+    if officer_role and "secretary" in officer_role.lower():
+        return "Secretary"
+    return None
+
+
+def person_details(item):
+    """
+    (birth_year, birth_month, nationality) from an officer or PSC item; the
+    API only gives month and year of birth. None when it has none of them.
+    """
+    dob = item.get("date_of_birth") or {}
+    details = (dob.get("year"), dob.get("month"), (item.get("nationality") or "").strip() or None)
+    return details if any(details) else None
+
+
+def _persons_by_name(details_by_name):
+    """
+    Return {full_name: Person} for the names in `details_by_name` ({name:
+    (birth_year, birth_month, nationality) or None}), creating the missing
+    people with a single executemany INSERT and filling in details existing
+    people lack. Constant queries for the whole batch.
+    """
+    persons = {}
+    if not details_by_name:
+        return persons
+    names = list(details_by_name)
+    for person in Person.query.filter(Person.full_name.in_(names)).order_by(Person.id):
+        persons.setdefault(person.full_name, person)
+    missing = [name for name in names if name not in persons]
+    if missing:
+        node_ids = create_nodes("person", len(missing))
+        db.session.execute(insert(Person), [
+            dict(zip(PERSON_DETAIL_COLUMNS, details_by_name[name] or (None, None, None)),
+                 full_name=name, node_id=node_id)
+            for name, node_id in zip(missing, node_ids)])
+        for person in Person.query.filter(Person.full_name.in_(missing)).order_by(Person.id):
+            persons.setdefault(person.full_name, person)
+
+    # Officers and PSCs created before details were stored get them on their next refresh.
+    for name, details in details_by_name.items():
+        person = persons[name]
+        if details and name not in missing:
+            for column, value in zip(PERSON_DETAIL_COLUMNS, details):
+                if value is not None and getattr(person, column) is None:
+                    setattr(person, column, value)
+    return persons
+
+
+def _existing_relationships(company, rel_type_ids):
+    """
+    Index the relationships pointing at `company` with the given types by
+    (relationship_type_id, source_type, source_id), attributes preloaded.
+    """
+    if not rel_type_ids:
+        return {}
+    rels = Relationship.query.options(selectinload(Relationship.attributes)).filter(
+        Relationship.target_node_id == company.node_id,
+        Relationship.relationship_type_id.in_(rel_type_ids),
+    )
+    return {(r.relationship_type_id, r.source_type, r.source_id): r for r in rels}
+
+
+def _upsert_relationships(company, rows):
+    """
+    `rows` is a list of (rel_type, source, effective_date) with `source` a
+    Person or Company.
+    Existing relationships get their effective date updated; the rest are
+    inserted with one executemany. Returns the refreshed index from
+    _existing_relationships so callers can attach attributes.
+    """
+    rel_type_ids = {rel_type.id for rel_type, _, _ in rows}
+    existing = _existing_relationships(company, rel_type_ids)
+    new_rows = {}
+    for rel_type, source, effective_date in rows:
+        source_type = "company" if isinstance(source, Company) else "person"
+        key = (rel_type.id, source_type, source.id)
+        if key in existing:
+            existing[key].effective_date = effective_date
+        else:
+            new_rows[key] = {
+                "relationship_type_id": rel_type.id,
+                "source_type": source_type,
+                "source_id": source.id,
+                "source_node_id": source.node_id,
+                "target_type": "company",
+                "target_id": company.id,
+                "target_node_id": company.node_id,
+                "effective_date": effective_date,
+            }
+    if new_rows:
+        db.session.execute(insert(Relationship), list(new_rows.values()))
+        existing = _existing_relationships(company, rel_type_ids)
+    return existing
+
+
+def apply_officers(company, officers, rel_types=None):
+    """
+    Create or update officer -> company relationships for the current
+    (non-resigned) directors and secretaries in one page of `officers`.
+    The page is resolved with a constant number of queries; the caller
+    flushes or commits.
+    """
+    rel_types = rel_types or RelationshipTypeCache()
+    rows, details = [], {}
+    for officer in officers:
+        # Skip if officer has resigned
+        if officer.get("resigned_on"):
+            continue
+        officer_name = officer.get("name")
+        rel_type_name = officer_relationship_type(officer.get("officer_role"))
+        if not officer_name or not rel_type_name:
+            continue  # Skip roles we don't handle
+        rows.append((officer_name, rel_types.get(rel_type_name), parse_date(officer.get("appointed_on"))))
+        details[officer_name] = details.get(officer_name) or person_details(officer)
+    if not rows:
+        return
+
+    persons = _persons_by_name(details)
+    # Source: Person (officer), Target: Company.
+    db.session.flush()  # Make sure the company has its node
+    _upsert_relationships(company, [(rel_type, persons[name], effective_date)
+                                    for name, rel_type, effective_date in rows])
+
+
+def write_officer_rows(rows, rel_types=None):
+    """
+    Batch form of apply_officers for many companies at once: upsert officer
+    -> company relationships for `rows` of (company, officer item), where
+    `company` is a (company id, node id) pair, in a constant number of
+    queries. Resigned officers and roles we don't handle are skipped.
+    Returns the number of relationships inserted or re-dated; the caller
+    commits.
+    """
+    rel_types = rel_types or RelationshipTypeCache()
+    wanted, details = {}, {}
+    for company, officer in rows:
+        officer_name = officer.get("name")
+        rel_type_name = officer_relationship_type(officer.get("officer_role"))
+        if officer.get("resigned_on") or not officer_name or not rel_type_name:
+            continue
+        details[officer_name] = details.get(officer_name) or person_details(officer)
+        wanted[(company, rel_types.get(rel_type_name).id, officer_name)] = parse_date(officer.get("appointed_on"))
+    if not wanted:
+        return 0
+
+    persons = _persons_by_name(details)
+    existing = {}
+    for rel_id, target_node_id, rel_type_id, source_id, effective_date in db.session.query(
+            Relationship.id, Relationship.target_node_id, Relationship.relationship_type_id,
+            Relationship.source_id, Relationship.effective_date).filter(
+            Relationship.target_node_id.in_({company[1] for company, _, _ in wanted}),
+            Relationship.relationship_type_id.in_({rel_type_id for _, rel_type_id, _ in wanted}),
+            Relationship.source_type == "person"):
+        existing[(target_node_id, rel_type_id, source_id)] = (rel_id, effective_date)
+
+    inserts, updates = [], []
+    for (company, rel_type_id, officer_name), effective_date in wanted.items():
+        person = persons[officer_name]
+        found = existing.get((company[1], rel_type_id, person.id))
+        if found is None:
+            inserts.append({
+                "relationship_type_id": rel_type_id,
+                "source_type": "person",
+                "source_id": person.id,
+                "source_node_id": person.node_id,
+                "target_type": "company",
+                "target_id": company[0],
+                "target_node_id": company[1],
+                "effective_date": effective_date,
+            })
+        elif found[1] != effective_date:
+            updates.append({"id": found[0], "effective_date": effective_date})
+    if inserts:
+        db.session.execute(insert(Relationship), inserts)
+    if updates:
+        db.session.execute(update(Relationship), updates)
+    return len(inserts) + len(updates)
+
+
+def find_company_by_number(number):
+    """
+    Find a company by number however it is padded or prefixed ("1234",
+    "00001234", "SC001234"), using the indexed normalized_number column.
+    """
+    return Company.query.filter_by(normalized_number=normalize_company_number(number))\
+        .order_by(Company.id).first()
+
+
+def find_companies_by_numbers(numbers):
+    """Batch form of find_company_by_number: {number: Company} in one query."""
+    keys = {number: normalize_company_number(number) for number in numbers}
+    found = {}
+    if keys:
+        for company in Company.query.filter(Company.normalized_number.in_(set(keys.values())))\
+                .order_by(Company.id):
+            found.setdefault(company.normalized_number, company)
+    return {number: found[key] for number, key in keys.items() if key in found}
+
+
+def company_ids_by_numbers(numbers):
+    """
+    Light form of find_companies_by_numbers for bulk work: {number:
+    (company id, node id)} from one query on narrow columns only.
+    """
+    keys = {number: normalize_company_number(number) for number in numbers}
+    found = {}
+    if keys:
+        rows = db.session.query(Company.id, Company.node_id, Company.normalized_number)\
+            .filter(Company.normalized_number.in_(set(keys.values()))).order_by(Company.id)
+        for company_id, node_id, key in rows:
+            found.setdefault(key, (company_id, node_id))
+    return {number: found[key] for number, key in keys.items() if key in found}
+
+
+def _ensure_companies(names_by_number):
+    """
+    Return {number: (company id, node id)} for `names_by_number`, creating
+    the missing companies (under their PSC name) with one executemany INSERT.
+    """
+    ids = company_ids_by_numbers(names_by_number)
+    missing = {}
+    for number, name in names_by_number.items():
+        if number not in ids:
+            missing.setdefault(normalize_company_number(number), {
+                "name": name,
+                "company_number": format_company_number(number),
+                # Core inserts skip the @validates hook, so normalized_number is set here.
+                "normalized_number": normalize_company_number(number),
+            })
+    if missing:
+        rows = list(missing.values())
+        for row, node_id in zip(rows, create_nodes("company", len(rows))):
+            row["node_id"] = node_id
+        db.session.execute(insert(Company), rows)
+        ids.update(company_ids_by_numbers([number for number in names_by_number if number not in ids]))
+    return ids
+
+
+def _psc_entity(psc):
+    """
+    Work out who a PSC is: ("company", name, registration_number, None) for
+    a UK corporate PSC, ("person", name, None, details) for anyone else
+    (details as from person_details), or None to skip.
+    """
+    psc_kind = psc.get("kind", "").lower()
+    if "corporate-entity" in psc_kind:
+        psc_name = psc.get("name")
+        identification = psc.get("identification", {})
+        reg_number = identification.get("registration_number", "")
+        country_registered = identification.get("country_registered", "").lower()
+        if country_registered in UK_COUNTRIES:
+            return ("company", psc_name, reg_number, None)
+        return ("person", psc_name, None, None) if psc_name else None
+    # For individual PSC, try to get details from "individual_person"; if not, use top-level "name".
+    individual = psc.get("individual_person")
+    if individual and individual.get("name"):
+        psc_name = individual.get("name")
+    else:
+        psc_name = psc.get("name")
+    return ("person", psc_name, None, person_details(psc)) if psc_name else None
+
+
+def psc_record(psc):
+    """
+    Parse one PSC item, from the API or the bulk snapshot, into
+    (entity, effective_date, control_details), or None when it is inactive
+    or not someone we can link. Pure, so it can run in worker processes.
+    """
+    # Skip if the PSC is inactive.
+    if psc.get("ceased") or psc.get("ceased_on"):
+        return None
+    entity = _psc_entity(psc)
+    if entity is None:
+        return None
+    # Extract natures_of_control (list) and join into a string.
+    natures = psc.get("natures_of_control", [])
+    control_details = ", ".join(natures) if natures else None
+    # Use notified_on as effective date.
+    return entity, parse_date(psc.get("notified_on")), control_details
+
+
+def write_psc_rows(rows, rel_types=None):
+    """
+    Upsert PSC -> company relationships, with their "control" attribute,
+    for `rows` of (company, entity, effective_date, control_details), where
+    `company` is a (company id, node id) pair.
+    Rows may span any number of companies; the whole batch costs a constant
+    number of queries, with executemany INSERTs and UPDATEs. UK corporate
+    PSCs are linked to (or created as) companies; everything else is a
+    person. Returns (inserted, updated, unchanged); the caller commits.
+    """
+    if not rows:
+        return 0, 0, 0
+    rel_type = (rel_types or RelationshipTypeCache()).get("PSC")
+    details = {}
+    for _, (kind, name, _, person_info), _, _ in rows:
+        if kind == "person":
+            details[name] = details.get(name) or person_info
+    persons = _persons_by_name(details)
+    psc_companies = _ensure_companies(
+        {reg_number: name for _, (kind, name, reg_number, _), _, _ in rows if kind == "company"})
+
+    # PSC is source, Company is target; both as (id, node id). The last row
+    # wins for duplicates.
+    wanted = {}
+    for company, (kind, name, reg_number, _), effective_date, control_details in rows:
+        if kind == "company":
+            source = psc_companies[reg_number]
+        else:
+            source = (persons[name].id, persons[name].node_id)
+        wanted[(company, kind, source)] = (effective_date, control_details)
+
+    def existing_relationships():
+        found = db.session.query(Relationship.id, Relationship.target_node_id, Relationship.source_node_id,
+                                 Relationship.effective_date).filter(
+            Relationship.relationship_type_id == rel_type.id,
+            Relationship.target_node_id.in_({company[1] for company, _, _ in wanted}),
+        )
+        return {(target_node_id, source_node_id): (rel_id, effective_date)
+                for rel_id, target_node_id, source_node_id, effective_date in found}
+
+    def node_key(key):
+        company, _, source = key
+        return company[1], source[1]
+
+    existing = existing_relationships()
+    new_keys = [key for key in wanted if node_key(key) not in existing]
+    if new_keys:
+        db.session.execute(insert(Relationship), [{
+            "relationship_type_id": rel_type.id,
+            "source_type": kind,
+            "source_id": source[0],
+            "source_node_id": source[1],
+            "target_type": "company",
+            "target_id": company[0],
+            "target_node_id": company[1],
+            "effective_date": wanted[(company, kind, source)][0],
+        } for company, kind, source in new_keys])
+        existing = existing_relationships()
+
+    rel_ids = {existing[node_key(key)][0]: key for key in wanted}
+    attributes = {}
+    for attr_id, rel_id, value in db.session.query(
+            RelationshipAttribute.id, RelationshipAttribute.relationship_id, RelationshipAttribute.value)\
+            .filter(RelationshipAttribute.relationship_id.in_(rel_ids),
+                    db.func.lower(RelationshipAttribute.key) == "control")\
+            .order_by(RelationshipAttribute.id):
+        attributes.setdefault(rel_id, (attr_id, value))
+
+    date_updates, attr_updates, attr_inserts, changed = [], [], [], set()
+    for rel_id, key in rel_ids.items():
+        effective_date, control_details = wanted[key]
+        if key not in new_keys and existing[node_key(key)][1] != effective_date:
+            date_updates.append({"id": rel_id, "effective_date": effective_date})
+            changed.add(rel_id)
+        if not control_details:
+            continue
+        attr = attributes.get(rel_id)
+        if attr is None:
+            attr_inserts.append({"relationship_id": rel_id, "key": "control", "value": control_details})
+            changed.add(rel_id)
+        elif attr[1] != control_details:
+            attr_updates.append({"id": attr[0], "value": control_details})
+            changed.add(rel_id)
+
+    if date_updates:
+        db.session.execute(update(Relationship), date_updates)
+    if attr_updates:
+        db.session.execute(update(RelationshipAttribute), attr_updates)
+    if attr_inserts:
+        db.session.execute(insert(RelationshipAttribute), attr_inserts)
+
+    inserted = len(new_keys)
+    updated = len(changed - {existing[node_key(key)][0] for key in new_keys})
+    return inserted, updated, len(wanted) - inserted - updated
+
+
+def apply_psc(company, psc_list, rel_types=None):
+    """
+    Create or update PSC -> company relationships (with a "control"
+    attribute) for the active PSCs in one page of `psc_list`. The caller
+    flushes or commits.
+    """
+    records = [record for record in map(psc_record, psc_list) if record]
+    if records:
+        db.session.flush()  # Make sure the company has an id and node
+        write_psc_rows([((company.id, company.node_id),) + record for record in records], rel_types)
+
+
+def content_hash(data):
+    """Fingerprint of an API response, to tell whether it changed since the last fetch."""
+    payload = json.dumps(data, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def apply_company_bundle(company_number, bundle, rel_types=None, force=False):
+    """
+    Write a fetched {"profile", "officers", "psc"} bundle for one company,
+    skipping each part whose content hash matches the one stored when it was
+    last written (unless `force`). Returns (company, parts written); raises
+    ValueError when a changed profile has no company name.
+    """
+    hashes = {part: content_hash(bundle[part]) for part in BUNDLE_PARTS}
+    company = find_company_by_number(company_number)
+    changed = [part for part in BUNDLE_PARTS
+               if force or company is None or getattr(company, f"{part}_hash") != hashes[part]]
+    if "profile" in changed:
+        fields = company_fields_from_profile(bundle["profile"])
+        if not fields["name"]:
+            raise ValueError("No company name found in API response.")
+        company, _ = upsert_company(company_number, fields)
+        db.session.flush()
+    if "officers" in changed:
+        apply_officers(company, bundle["officers"], rel_types)
+    if "psc" in changed:
+        apply_psc(company, bundle["psc"], rel_types)
+    for part in changed:
+        setattr(company, f"{part}_hash", hashes[part])
+    company.refreshed_at = datetime.utcnow()
+    return company, changed
+
+
+def linked_company_numbers(officers, psc_list):
+    """
+    Return the UK company numbers a company points at through its corporate
+    officers and active corporate PSCs - the edges a deep dig follows.
+    """
+    numbers = set()
+    for officer in officers:
+        if officer.get("resigned_on") or "corporate" not in (officer.get("officer_role") or ""):
+            continue
+        identification = officer.get("identification") or {}
+        reg_number = identification.get("registration_number")
+        place = (identification.get("place_registered") or "").lower()
+        legal_form = (identification.get("identification_type") or "").lower()
+        if reg_number and (legal_form.startswith("uk") or place in UK_COUNTRIES
+                           or "companies house" in place):
+            numbers.add(format_company_number(reg_number))
+    for psc in psc_list:
+        if psc.get("ceased") or psc.get("ceased_on"):
+            continue
+        if "corporate-entity" not in psc.get("kind", "").lower():
+            continue
+        identification = psc.get("identification", {})
+        reg_number = identification.get("registration_number")
+        if reg_number and identification.get("country_registered", "").lower() in UK_COUNTRIES:
+            numbers.add(format_company_number(reg_number))
+    return numbers
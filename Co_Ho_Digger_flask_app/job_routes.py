@@ -0,0 +1,43 @@
+# my_flask_app/job_routes.py
+
+import json
+
+from flask import Blueprint, render_template, request, jsonify, abort, url_for
+from .models import db, Job
+from .jobs import job_status, ACTIVE_STATUSES
+from .pagination import keyset_paginate, get_page_size
+
+job_bp = Blueprint("job_bp", __name__, template_folder="templates")
+
+@job_bp.route("/jobs")
+def jobs_list():
+    page = keyset_paginate(Job.query, Job.id, Job.id, descending=True,
+                           after=request.args.get("after"), before=request.args.get("before"),
+                           page_size=get_page_size())
+    # What each job touched, for a link: from its result, else its payload.
+    links = {}
+    for job in page.items:
+        data = json.loads(job.result or job.payload or "{}")
+        if data.get("company_id"):
+            links[job.id] = url_for("company_bp.companies_view", company_id=data["company_id"])
+        elif data.get("case_id"):
+            links[job.id] = url_for("case_detail_bp.details_list", case_id=data["case_id"])
+    return render_template("jobs_list.html", jobs=page, page=page, links=links,
+                           active_statuses=ACTIVE_STATUSES)
+
+
+@job_bp.route("/api/jobs/<int:job_id>")
+def job_status_api(job_id):
+    """Status, progress, result and error of one background job."""
+    job = db.session.get(Job, job_id)
+    if job is None:
+        abort(404)
+    return jsonify(job_status(job))
+
+
+@job_bp.route("/api/jobs")
+def jobs_status_api():
+    """Status of several jobs at once: ?ids=3,4,5 (at most 100)."""
+    ids = [int(i) for i in request.args.get("ids", "").split(",") if i.strip().isdigit()][:100]
+    jobs = Job.query.filter(Job.id.in_(ids)).order_by(Job.id).all() if ids else []
+    return jsonify([job_status(job) for job in jobs])
@@ -0,0 +1,351 @@
+# my_flask_app/jobs.py
+#
+# Background Companies House fetches, the graph analytics run and network
+# layouts too big to compute inside a request. Routes
+# queue a Job row and return at once; a small pool of worker threads in this
+# process claims queued jobs, runs the fetch-and-upsert and records
+# progress, result and error on the row, which /jobs and /api/jobs/<id> report.
+#
+# A job whose key matches one already queued or running is not queued again:
+# the existing job is handed back instead. Jobs live in the database, so
+# queued jobs survive a restart, and a job left "running" by a dead process
+# is queued again once its heartbeat is JOB_STALE_SECONDS old.
+#
+# JOB_WORKERS (default 2) sets the pool size; 0 leaves jobs to a separate
+# `flask run-jobs` process.
+
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+
+import requests
+from flask import current_app
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+
+from .models import db, Company, Case, CaseDetail, Job
+from . import companies_house
+from .ingest import company_fields_from_profile, upsert_company, apply_officers, apply_psc, RelationshipTypeCache
+from .crawler import refresh_companies
+from .analytics import refresh_node_metrics
+from .export import graph_records
+from .layout import network_layout, MAX_LAYOUT_EDGES
+
+DEFAULT_WORKERS = 2
+POLL_SECONDS = 2.0
+STALE_SECONDS = 300
+# Longest a compute-bound job goes between committed heartbeats.
+HEARTBEAT_SECONDS = 30
+ACTIVE_STATUSES = ("queued", "running")
+
+
+def _now():
+    return datetime.utcnow()
+
+
+def _heartbeat(job, count=0):
+    job.progress += count
+    job.updated_at = _now()
+
+
+def _keepalive(job, seconds=HEARTBEAT_SECONDS):
+    """
+    A heartbeat for jobs that compute for a long time between writes: call
+    it often and it commits a fresh updated_at every `seconds`, so the job
+    is not taken for stale and run twice.
+    """
+    last = time.monotonic()
+
+    def beat():
+        nonlocal last
+        if time.monotonic() - last >= seconds:
+            _heartbeat(job)
+            db.session.commit()
+            last = time.monotonic()
+
+    return beat
+
+
+# --- Handlers ---------------------------------------------------------------
+# Each takes the running job, its payload and the API key and returns
+# (message, result). Officers and PSC are committed a page at a time, so the
+# progress shows while they run and a failure keeps the pages already written.
+
+def _dig_company(job, payload, api_key):
+    company_number = payload["company_number"]
+    data = companies_house.fetch_company_profile(company_number, api_key)
+    fields = company_fields_from_profile(data)
+    if not fields["name"]:
+        raise ValueError("No company name found in API response.")
+    company, created = upsert_company(company_number, fields)
+    _heartbeat(job, 1)
+    db.session.flush()
+    message = "New company added." if created else "Existing company updated with latest data."
+
+    case_id = payload.get("case_id")
+    if case_id and not CaseDetail.query.filter_by(case_id=case_id, company_id=company.id).first():
+        db.session.add(CaseDetail(case_id=case_id, company_id=company.id))
+        message += " Added to the current case."
+    return message, {"company_id": company.id}
+
+
+def _update_officers(job, payload, api_key):
+    company = db.session.get(Company, payload["company_id"])
+    if company is None:
+        raise ValueError("Company no longer exists.")
+    rel_types = RelationshipTypeCache()
+    for officers_page in companies_house.iter_officer_pages(company.company_number, api_key):
+        apply_officers(company, officers_page, rel_types)
+        _heartbeat(job, len(officers_page))
+        db.session.commit()
+    return f"Officers updated successfully ({job.progress}).", {"company_id": company.id}
+
+
+def _update_psc(job, payload, api_key):
+    company = db.session.get(Company, payload["company_id"])
+    if company is None:
+        raise ValueError("Company no longer exists.")
+    rel_types = RelationshipTypeCache()
+    for psc_page in companies_house.iter_psc_pages(company.company_number, api_key):
+        apply_psc(company, psc_page, rel_types)
+        _heartbeat(job, len(psc_page))
+        db.session.commit()
+    if not job.progress:
+        return "No PSC data returned from Companies House.", {"company_id": company.id}
+    return f"PSC data updated successfully ({job.progress}).", {"company_id": company.id}
+
+
+def _refresh_case(job, payload, api_key):
+    case = db.session.get(Case, payload["case_id"])
+    if case is None:
+        raise ValueError("Case no longer exists.")
+    company_ids = [company_id for (company_id,) in db.session.query(CaseDetail.company_id)
+                   .filter(CaseDetail.case_id == case.id, CaseDetail.company_id.isnot(None)).distinct()]
+    summary = refresh_companies(company_ids, api_key, force=payload.get("force", False),
+                                progress=lambda count: _heartbeat(job, count))
+    message = (f"Refreshed {summary['companies']} companies: {summary['changed']} changed, "
+               f"{summary['unchanged']} unchanged, {len(summary['errors'])} failed.")
+    return message, {"case_id": case.id, "errors": summary["errors"]}
+
+
+def _graph_metrics(job, payload, api_key):
+    summary = refresh_node_metrics(force=payload.get("force", False),
+                                   progress=lambda count: _heartbeat(job, count), heartbeat=_keepalive(job))
+    if summary["skipped"]:
+        return "Graph unchanged since the last run; scores kept.", summary
+    return (f"Scored {summary['nodes']} nodes over {summary['edges']} relationships: "
+            f"{summary['written']} rows written, {summary['deleted']} removed."), summary
+
+
+def _network_layout(job, payload, api_key):
+    _, edges = graph_records(payload.get("focus_company"), payload.get("case_id"), payload.get("depth", 1),
+                             payload.get("types"))
+    edges = list(edges)
+    if len(edges) > MAX_LAYOUT_EDGES:
+        return f"{len(edges)} relationships is too many to lay out.", {"edges": len(edges)}
+    positions = network_layout(payload["key"], edges, heartbeat=_keepalive(job))
+    _heartbeat(job, len(positions))
+    return f"Laid out {len(positions)} nodes.", {"nodes": len(positions), "edges": len(edges)}
+
+
+HANDLERS = {
+    "dig_company": _dig_company,
+    "update_officers": _update_officers,
+    "update_psc": _update_psc,
+    "refresh_case": _refresh_case,
+    "graph_metrics": _graph_metrics,
+    "network_layout": _network_layout,
+}
+# Kinds that never call Companies House, so run without an API key.
+OFFLINE_KINDS = {"graph_metrics", "network_layout"}
+
+
+# --- Queue ------------------------------------------------------------------
+
+def enqueue_job(kind, key, payload=None):
+    """
+    Queue a job and commit. Returns (job, created); when a job with the same
+    key is already queued or running that job is returned with created False.
+    """
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    existing = Job.query.filter(Job.key == key, Job.status.in_(ACTIVE_STATUSES)).first()
+    if existing:
+        return existing, False
+    job = Job(kind=kind, key=key, payload=json.dumps(payload or {}), status="queued", progress=0,
+              created_at=_now())
+    db.session.add(job)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another request queued the same job between our check and insert.
+        db.session.rollback()
+        existing = Job.query.filter(Job.key == key, Job.status.in_(ACTIVE_STATUSES)).first()
+        if existing:
+            return existing, False
+        raise
+    runner = current_app.extensions.get("job_runner")
+    if runner:
+        runner.start()
+        runner.wake()
+    return job, True
+
+
+def job_status(job):
+    """JSON-ready view of a job for the status endpoint."""
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "key": job.key,
+        "status": job.status,
+        "progress": job.progress,
+        "message": job.message,
+        "error": job.error,
+        "result": json.loads(job.result) if job.result else None,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+def requeue_stale_jobs(stale_seconds=STALE_SECONDS):
+    """Put "running" jobs whose worker has gone quiet back in the queue."""
+    cutoff = _now() - timedelta(seconds=stale_seconds)
+    result = db.session.execute(
+        update(Job)
+        .where(Job.status == "running", db.func.coalesce(Job.updated_at, Job.started_at) < cutoff)
+        .values(status="queued", started_at=None, updated_at=None)
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def claim_next_job():
+    """Mark the oldest queued job running and return its id, or None if there is none."""
+    while True:
+        job_id = db.session.execute(
+            select(Job.id).where(Job.status == "queued").order_by(Job.id).limit(1)
+        ).scalar()
+        if job_id is None:
+            db.session.commit()
+            return None
+        now = _now()
+        claimed = db.session.execute(
+            update(Job).where(Job.id == job_id, Job.status == "queued")
+            .values(status="running", started_at=now, updated_at=now, progress=0)
+        ).rowcount
+        db.session.commit()
+        if claimed:
+            return job_id
+
+
+def _finish(job_id, status, message=None, result=None, error=None):
+    job = db.session.get(Job, job_id)
+    job.status = status
+    job.message = message
+    job.result = json.dumps(result) if result is not None else None
+    job.error = error
+    job.finished_at = job.updated_at = _now()
+    db.session.commit()
+
+
+def run_job(job_id):
+    """Run one claimed job to completion, recording the outcome on its row."""
+    job = db.session.get(Job, job_id)
+    api_key = companies_house.get_api_key()
+    if not api_key and job.kind not in OFFLINE_KINDS:
+        _finish(job_id, "failed", error="Companies House API key is not configured.")
+        return
+    try:
+        message, result = HANDLERS[job.kind](job, json.loads(job.payload or "{}"), api_key)
+        db.session.commit()
+    except requests.exceptions.HTTPError as err:
+        db.session.rollback()
+        _finish(job_id, "failed", error=f"Error calling Companies House: {err}")
+    except requests.exceptions.RequestException as err:
+        db.session.rollback()
+        _finish(job_id, "failed", error=f"Network error: {err}")
+    except Exception as err:
+        db.session.rollback()
+        current_app.logger.exception("Job %s failed", job_id)
+        _finish(job_id, "failed", error=str(err) or err.__class__.__name__)
+    else:
+        _finish(job_id, "finished", message=message, result=result)
+
+
+# --- Worker pool ------------------------------------------------------------
+
+class JobRunner:
+    """A pool of daemon threads taking jobs off the queue for one app."""
+
+    def __init__(self, app, workers=DEFAULT_WORKERS, poll_seconds=POLL_SECONDS, stale_seconds=STALE_SECONDS):
+        self.app = app
+        self.workers = workers
+        self.poll_seconds = poll_seconds
+        self.stale_seconds = stale_seconds
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def start(self):
+        """Start the worker threads unless they are already running."""
+        with self._lock:
+            if self._threads or self.workers <= 0:
+                return
+            self._stop.clear()
+            for n in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"job-worker-{n}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def run_until_idle(self):
+        """Work through the queue on the calling thread; returns the number of jobs run."""
+        count = 0
+        with self.app.app_context():
+            requeue_stale_jobs(self.stale_seconds)
+            while (job_id := claim_next_job()) is not None:
+                run_job(job_id)
+                count += 1
+        return count
+
+    def _work(self):
+        last_stale_check = 0.0
+        while not self._stop.is_set():
+            try:
+                with self.app.app_context():
+                    if time.monotonic() - last_stale_check > self.stale_seconds / 2:
+                        requeue_stale_jobs(self.stale_seconds)
+                        last_stale_check = time.monotonic()
+                    job_id = claim_next_job()
+                    if job_id is not None:
+                        run_job(job_id)
+                        continue
+            except Exception:
+                self.app.logger.exception("Job worker error")
+            self._wake.wait(self.poll_seconds)
+            self._wake.clear()
+
+
+def init_jobs(app):
+    """Attach a job runner to the app; its threads start with the first request."""
+    runner = JobRunner(app, workers=app.config.get("JOB_WORKERS", DEFAULT_WORKERS),
+                       stale_seconds=app.config.get("JOB_STALE_SECONDS", STALE_SECONDS))
+    app.extensions["job_runner"] = runner
+
+    @app.before_request
+    def _start_job_runner():
+        runner.start()
+
+    return runner
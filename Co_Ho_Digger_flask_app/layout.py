@@ -0,0 +1,181 @@
+# my_flask_app/layout.py
+#
+# Server-side force-directed layout for the network view, so the browser
+# gets fixed positions and can leave physics off.
+#
+# force_layout() is Fruchterman-Reingold vectorised with NumPy: spring
+# attraction along edges, k^2/d repulsion between nodes and a weak pull to
+# the centre that keeps separate components together. Repulsion is exact up
+# to REPULSION_SAMPLE nodes; past that each iteration repels every node from
+# a fresh random sample and scales the force up, which keeps an iteration
+# O(n * sample) instead of O(n^2).
+#
+# Layouts are stored in network_layout under a key for the view (focus
+# company or case, depth, relationship types) with a signature of the subgraph's edges. A
+# request whose subgraph still has that signature gets the stored positions;
+# otherwise the layout is recomputed, starting from the stored positions so
+# the picture only moves where the graph changed. Only views up to
+# SYNC_LAYOUT_EDGES edges are laid out inside the request; bigger ones are
+# queued as a network_layout job (see jobs.py) and drawn with browser physics
+# until their layout is stored.
+
+import hashlib
+import json
+import os
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy.exc import IntegrityError
+
+from .models import db, NetworkLayout
+
+# Ideal edge length, in Vis.js canvas units.
+EDGE_LENGTH = 100.0
+DEFAULT_ITERATIONS = 200
+# Iterations when starting from a previous layout of a changed subgraph.
+WARM_ITERATIONS = 60
+REPULSION_SAMPLE = 250
+# Pairwise distances computed per NumPy block, to bound memory.
+BLOCK_PAIRS = 2000000
+GRAVITY = 0.02
+# Larger subgraphs are sent without positions.
+MAX_LAYOUT_EDGES = int(os.getenv("MAX_LAYOUT_EDGES", "50000"))
+# Larger subgraphs than this are laid out by a background job; about 0.2s of NumPy.
+SYNC_LAYOUT_EDGES = int(os.getenv("SYNC_LAYOUT_EDGES", "500"))
+
+
+def force_layout(n, sources, targets, initial=None, iterations=DEFAULT_ITERATIONS, seed=0, heartbeat=None):
+    """
+    Lay out `n` nodes joined by edges sources[i] -> targets[i] (node
+    indexes) and return an (n, 2) float array of positions. `initial` is an
+    (n, 2) array of starting positions with NaN rows for nodes to place at
+    random. `heartbeat`, if given, is called after every iteration.
+    """
+    rng = np.random.default_rng(seed)
+    k = EDGE_LENGTH
+    spread = k * np.sqrt(max(n, 1))
+    pos = rng.uniform(-spread / 2, spread / 2, (n, 2))
+    # How far each node may move per iteration, as a share of the temperature.
+    mobility = np.ones((n, 1))
+    warm = initial is not None and not np.isnan(initial).all()
+    if warm:
+        known = ~np.isnan(initial).any(axis=1)
+        pos[known] = initial[known]
+        # Placed nodes only ease into the change; the new ones find their place.
+        mobility[known] = 0.1
+        # New nodes start next to a placed neighbour rather than anywhere.
+        for u, v in zip(sources, targets):
+            if known[v] and not known[u]:
+                pos[u] = initial[v] + rng.uniform(-k, k, 2)
+            elif known[u] and not known[v]:
+                pos[v] = initial[u] + rng.uniform(-k, k, 2)
+    if n < 2:
+        return pos
+
+    sources = np.asarray(sources, dtype=np.int64)
+    targets = np.asarray(targets, dtype=np.int64)
+    temperature = k if warm else spread / 5
+    cooling = temperature / (iterations + 1)
+    for _ in range(iterations):
+        if heartbeat:
+            heartbeat()
+        disp = np.zeros((n, 2))
+
+        if n <= REPULSION_SAMPLE:
+            others, scale = pos, 1.0
+        else:
+            others, scale = pos[rng.choice(n, REPULSION_SAMPLE, replace=False)], n / REPULSION_SAMPLE
+        # Pairwise terms through matrix products: |p - o|^2 = |p|^2 + |o|^2 - 2 p.o,
+        # and sum_j w_ij (p_i - o_j) = p_i * sum_j w_ij - (w @ o)_i.
+        others_sq = (others ** 2).sum(axis=1)
+        block = max(1, BLOCK_PAIRS // len(others))
+        for start in range(0, n, block):
+            p = pos[start:start + block]
+            dist2 = (p ** 2).sum(axis=1)[:, None] + others_sq[None, :] - 2 * p @ others.T
+            # A node paired with itself (or one on top of it) adds nothing.
+            weight = np.where(dist2 > 1e-6, k * k / np.maximum(dist2, 1e-6), 0.0)
+            disp[start:start + block] += (p * weight.sum(axis=1)[:, None] - weight @ others) * scale
+
+        if len(sources):
+            delta = pos[sources] - pos[targets]
+            dist = np.sqrt((delta ** 2).sum(axis=1))
+            pull = delta * (dist / k)[:, None]
+            for axis in range(2):
+                disp[:, axis] -= np.bincount(sources, pull[:, axis], minlength=n)
+                disp[:, axis] += np.bincount(targets, pull[:, axis], minlength=n)
+
+        disp -= GRAVITY * pos * np.sqrt((pos ** 2).sum(axis=1, keepdims=True)) / k
+
+        length = np.maximum(np.sqrt((disp ** 2).sum(axis=1)), 1e-9)
+        pos += disp * np.minimum(length[:, None], temperature * mobility) / length[:, None]
+        temperature = max(temperature - cooling, k / 100)
+    return pos - pos.mean(axis=0)
+
+
+def edge_signature(edges):
+    """Fingerprint of a subgraph: its edge ids with their endpoints."""
+    digest = hashlib.sha1()
+    for edge in sorted(edges, key=lambda e: e["id"]):
+        digest.update(f"{edge['id']}:{edge['from']}:{edge['to']};".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def layout_key(focus_company=None, depth=None, rel_types=(), case_id=None):
+    """Cache key for one view of the network."""
+    if case_id:
+        scope = f"case:{case_id}:{depth}"
+    elif focus_company:
+        scope = f"focus:{focus_company}:{depth}"
+    else:
+        scope = "all"
+    return f"{scope}|{','.join(sorted(rel_types))}"
+
+
+def stored_layout(key, edges):
+    """The cached {node id: [x, y]} for `key` if its subgraph is still `edges`, else None."""
+    cached = NetworkLayout.query.filter_by(key=key).first()
+    if cached is not None and cached.signature == edge_signature(edges):
+        return json.loads(cached.positions)
+    return None
+
+
+def network_layout(key, edges, heartbeat=None):
+    """
+    Return {node id: [x, y]} for the nodes of `edges` (edge records), from
+    the cache when the subgraph is unchanged, else computed and stored.
+    `heartbeat` is passed on to force_layout.
+    """
+    signature = edge_signature(edges)
+    cached = NetworkLayout.query.filter_by(key=key).first()
+    if cached is not None and cached.signature == signature:
+        return json.loads(cached.positions)
+
+    node_index = {}
+    sources, targets = [], []
+    for edge in edges:
+        sources.append(node_index.setdefault(edge["from"], len(node_index)))
+        targets.append(node_index.setdefault(edge["to"], len(node_index)))
+    previous = json.loads(cached.positions) if cached is not None else {}
+    initial = None
+    if previous:
+        initial = np.full((len(node_index), 2), np.nan)
+        for node, i in node_index.items():
+            if node in previous:
+                initial[i] = previous[node]
+    pos = force_layout(len(node_index), sources, targets, initial,
+                       iterations=WARM_ITERATIONS if previous else DEFAULT_ITERATIONS, heartbeat=heartbeat)
+    positions = {node: [round(float(pos[i, 0]), 1), round(float(pos[i, 1]), 1)] for node, i in node_index.items()}
+
+    if cached is None:
+        cached = NetworkLayout(key=key)
+        db.session.add(cached)
+    cached.signature = signature
+    cached.node_count = len(positions)
+    cached.positions = json.dumps(positions, separators=(",", ":"))
+    cached.created_at = datetime.utcnow()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another request stored the same view first; its layout will do next time.
+        db.session.rollback()
+    return positions
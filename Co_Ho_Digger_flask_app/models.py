@@ -1,22 +1,88 @@
 # my_flask_app/models.py
 
+import re
+from datetime import datetime
+
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, insert, update, delete, select, inspect
+from sqlalchemy.orm import Session, validates
+
+from .db_tuning import RoutingSession, primary_reads
+
+db = SQLAlchemy(session_options={"class_": RoutingSession})
+
+_COMPANY_NUMBER_RE = re.compile(r"^([A-Z]*)0*(\d+)$")
+
+def normalize_company_number(number):
+    """
+    Reduce a company number to a comparison key: upper case, no spaces and
+    no zero padding, keeping any register prefix. "00012345", "12345" and
+    " 12345" all become "12345"; "sc012345" becomes "SC12345".
+    """
+    number = re.sub(r"[\s\-/.]", "", number or "").upper()
+    match = _COMPANY_NUMBER_RE.match(number)
+    if match:
+        return match.group(1) + match.group(2)
+    return number
+
+class Node(db.Model):
+    """
+    One row per company or person: the id relationship endpoints point at.
+    Company.node_id and Person.node_id map each entity onto its node.
+    """
+    __tablename__ = "node"
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)  # 'company' or 'person'
 
-db = SQLAlchemy()
+def create_nodes(kind, count):
+    """
+    Insert `count` nodes with one executemany and return their ids, for
+    bulk Company / Person inserts that bypass the ORM. The rows are all
+    alike, so the order the ids come back in does not matter.
+    """
+    if not count:
+        return []
+    return list(db.session.scalars(
+        insert(Node).returning(Node.id), [{"kind": kind}] * count))
 
 class Company(db.Model):
     __tablename__ = "company"
+    __table_args__ = (
+        db.Index("ix_company_name_id", "name", "id"),
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
     company_number = db.Column(db.String(50), unique=True, nullable=False)
+    # Kept in step with company_number; used to match numbers however they are padded.
+    normalized_number = db.Column(db.String(50), index=True)
     registered_address = db.Column(db.String(500))   # new field
     company_status = db.Column(db.String(50))          # new field
     incorporation_date = db.Column(db.Date)            # new field
+    node_id = db.Column(db.Integer, db.ForeignKey('node.id'), unique=True)
+    # Content hashes of the last profile / officers / PSC fetch written, so
+    # refreshes can skip what has not changed (see ingest.apply_company_bundle).
+    profile_hash = db.Column(db.String(40))
+    officers_hash = db.Column(db.String(40))
+    psc_hash = db.Column(db.String(40))
+    refreshed_at = db.Column(db.DateTime)
+
+    @validates("company_number")
+    def _set_normalized_number(self, key, value):
+        self.normalized_number = normalize_company_number(value)
+        return value
 
 class Person(db.Model):
     __tablename__ = "person"
+    __table_args__ = (
+        db.Index("ix_person_full_name_id", "full_name", "id"),
+    )
     id = db.Column(db.Integer, primary_key=True)
     full_name = db.Column(db.String(200), nullable=False)
+    node_id = db.Column(db.Integer, db.ForeignKey('node.id'), unique=True)
+    # From the officer / PSC data when known; used to tell namesakes apart.
+    birth_year = db.Column(db.Integer, nullable=True)
+    birth_month = db.Column(db.Integer, nullable=True)
+    nationality = db.Column(db.String(100), nullable=True)
 
 class RelationshipType(db.Model):
     __tablename__ = "relationship_type"
@@ -28,15 +94,24 @@ class RelationshipType(db.Model):
 
 class Relationship(db.Model):
     __tablename__ = "relationship"
+    __table_args__ = (
+        db.Index("ix_relationship_source", "source_type", "source_id"),
+        db.Index("ix_relationship_target", "target_type", "target_id"),
+        db.Index("ix_relationship_source_node", "source_node_id", "relationship_type_id"),
+        db.Index("ix_relationship_target_node", "target_node_id", "relationship_type_id"),
+    )
     id = db.Column(db.Integer, primary_key=True)
 
-    relationship_type_id = db.Column(db.Integer, db.ForeignKey('relationship_type.id'))
+    relationship_type_id = db.Column(db.Integer, db.ForeignKey('relationship_type.id'), index=True)
     relationship_type = db.relationship("RelationshipType", back_populates="relationships")
 
     source_type = db.Column(db.String(50), nullable=False)  # 'company' or 'person'
     source_id = db.Column(db.Integer, nullable=False)
     target_type = db.Column(db.String(50), nullable=False)  # 'company' or 'person'
     target_id = db.Column(db.Integer, nullable=False)
+    # The endpoints' nodes; filled in from source/target type and id on save.
+    source_node_id = db.Column(db.Integer, db.ForeignKey('node.id'), nullable=True)
+    target_node_id = db.Column(db.Integer, db.ForeignKey('node.id'), nullable=True)
     effective_date = db.Column(db.Date, nullable=True)  # if you still want to store a common date
 
     # New: A relationship to extra attributes:
@@ -46,10 +121,28 @@ class Relationship(db.Model):
         cascade="all, delete-orphan"
     )
 
+    @classmethod
+    def touching(cls, node_id):
+        """Query for every relationship with `node_id` at either end."""
+        return cls.query.filter(db.or_(cls.source_node_id == node_id, cls.target_node_id == node_id))
+
+def delete_relationships_of(node_id):
+    """Set-based delete of every relationship (and its attributes) touching a node."""
+    drop_case_subgraphs([node_id])
+    mark_graph_changed()
+    rel_ids = select(Relationship.id).where(
+        db.or_(Relationship.source_node_id == node_id, Relationship.target_node_id == node_id))
+    db.session.execute(delete(RelationshipAttribute).where(RelationshipAttribute.relationship_id.in_(rel_ids)))
+    db.session.execute(delete(Relationship).where(
+        db.or_(Relationship.source_node_id == node_id, Relationship.target_node_id == node_id)))
+
 class RelationshipAttribute(db.Model):
     __tablename__ = "relationship_attribute"
+    __table_args__ = (
+        db.Index("ix_relationship_attribute_key_id", "key", "id"),
+    )
     id = db.Column(db.Integer, primary_key=True)
-    relationship_id = db.Column(db.Integer, db.ForeignKey('relationship.id'), nullable=False)
+    relationship_id = db.Column(db.Integer, db.ForeignKey('relationship.id'), nullable=False, index=True)
     key = db.Column(db.String(50), nullable=False)    # e.g. "shares"
     value = db.Column(db.String(200), nullable=False)   # e.g. "1000"
 
@@ -78,3 +171,400 @@ class CaseDetail(db.Model):
 
     def __repr__(self):
         return f"<CaseDetail case_id={self.case_id} company_id={self.company_id}>"
+
+class Crawl(db.Model):
+    """A deep dig: a breadth-first crawl of an ownership tree from one company."""
+    __tablename__ = "crawl"
+    id = db.Column(db.Integer, primary_key=True)
+    root_company_number = db.Column(db.String(50), nullable=False)
+    max_depth = db.Column(db.Integer, nullable=False, default=2)
+    follow_appointments = db.Column(db.Boolean, nullable=False, default=False)
+    status = db.Column(db.String(20), nullable=False, default="pending")  # pending, running, finished, failed
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    items = db.relationship("CrawlItem", backref="crawl", cascade="all, delete-orphan",
+                            lazy="dynamic")
+
+    def __repr__(self):
+        return f"<Crawl {self.root_company_number} depth={self.max_depth}>"
+
+class CrawlItem(db.Model):
+    """One company in a crawl's frontier; pending items are what a resume picks up."""
+    __tablename__ = "crawl_item"
+    __table_args__ = (
+        db.UniqueConstraint("crawl_id", "company_number", name="uq_crawl_item_number"),
+        db.Index("ix_crawl_item_status", "crawl_id", "status", "depth"),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    crawl_id = db.Column(db.Integer, db.ForeignKey('crawl.id', ondelete="CASCADE"), nullable=False)
+    company_number = db.Column(db.String(50), nullable=False)
+    depth = db.Column(db.Integer, nullable=False, default=0)
+    status = db.Column(db.String(20), nullable=False, default="pending")  # pending, done, error
+    error = db.Column(db.Text, nullable=True)
+
+class SnapshotImport(db.Model):
+    """
+    One load of a Companies House bulk snapshot file. rows_done is the
+    checkpoint: a resumed import skips that many rows of the same file.
+    """
+    __tablename__ = "snapshot_import"
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)        # companies, psc
+    file_name = db.Column(db.String(300), nullable=False)
+    file_size = db.Column(db.BigInteger, nullable=False)
+    rows_done = db.Column(db.Integer, nullable=False, default=0)
+    inserted = db.Column(db.Integer, nullable=False, default=0)
+    updated = db.Column(db.Integer, nullable=False, default=0)
+    unchanged = db.Column(db.Integer, nullable=False, default=0)
+    skipped = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    status = db.Column(db.String(20), nullable=False, default="running")  # running, finished, failed
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f"<SnapshotImport {self.kind} {self.file_name} rows={self.rows_done}>"
+
+class StreamCheckpoint(db.Model):
+    """
+    Where the consumer of one Companies House streaming API stream got to
+    (see streaming.py): `timepoint` is the last event applied, and is
+    committed with the changes it covers.
+    """
+    __tablename__ = "stream_checkpoint"
+    id = db.Column(db.Integer, primary_key=True)
+    stream = db.Column(db.String(20), nullable=False, unique=True)   # companies, officers, psc
+    timepoint = db.Column(db.BigInteger, nullable=True)
+    events = db.Column(db.BigInteger, nullable=False, default=0)     # events read
+    applied = db.Column(db.BigInteger, nullable=False, default=0)    # events that changed a known company
+    updated_at = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f"<StreamCheckpoint {self.stream} timepoint={self.timepoint}>"
+
+class NetworkLayout(db.Model):
+    """
+    Stored node positions for one view of the network (see layout.py);
+    `signature` identifies the subgraph they were computed for.
+    """
+    __tablename__ = "network_layout"
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(300), nullable=False, unique=True)
+    signature = db.Column(db.String(40), nullable=False)
+    node_count = db.Column(db.Integer, nullable=False, default=0)
+    positions = db.Column(db.Text, nullable=False)   # JSON {node id: [x, y]}
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<NetworkLayout {self.key} nodes={self.node_count}>"
+
+class CaseSubgraph(db.Model):
+    """
+    The stored network of a case (see case_graph.py): the relationships
+    within `depth` hops of its companies, following `rel_types` (comma
+    separated, empty for all). Its nodes are in case_subgraph_node.
+    """
+    __tablename__ = "case_subgraph"
+    __table_args__ = (
+        db.UniqueConstraint("case_id", "depth", "rel_types", name="uq_case_subgraph_view"),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    case_id = db.Column(db.Integer, db.ForeignKey('case.id', ondelete="CASCADE"), nullable=False)
+    depth = db.Column(db.Integer, nullable=False)
+    rel_types = db.Column(db.String(300), nullable=False, default="")
+    relationship_ids = db.Column(db.Text, nullable=False)   # JSON [id, ...]
+    node_count = db.Column(db.Integer, nullable=False, default=0)
+    # Highest relationship id when stored; rows bulk-inserted since (which
+    # fire no events) are checked against the nodes before reuse.
+    max_relationship_id = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<CaseSubgraph case={self.case_id} depth={self.depth} nodes={self.node_count}>"
+
+class CaseSubgraphNode(db.Model):
+    """One node of a stored case subgraph, indexed by node so a changed relationship finds what to drop."""
+    __tablename__ = "case_subgraph_node"
+    subgraph_id = db.Column(db.Integer, db.ForeignKey('case_subgraph.id', ondelete="CASCADE"), primary_key=True)
+    node_id = db.Column(db.Integer, primary_key=True, index=True)
+
+def drop_case_subgraphs(node_ids=None, case_id=None, connection=None):
+    """
+    Delete the stored case subgraphs that contain any of `node_ids`, or all
+    of one case's. Runs on `connection` inside mapper events, else on the
+    session.
+    """
+    executor = connection if connection is not None else db.session
+    query = select(CaseSubgraph.id)
+    if case_id is not None:
+        query = query.where(CaseSubgraph.case_id == case_id)
+    else:
+        node_ids = [node for node in node_ids if node is not None]
+        if not node_ids:
+            return
+        query = query.where(CaseSubgraph.id.in_(
+            select(CaseSubgraphNode.subgraph_id).where(CaseSubgraphNode.node_id.in_(node_ids))))
+    subgraph_ids = list(executor.execute(query).scalars())
+    if subgraph_ids:
+        executor.execute(delete(CaseSubgraphNode).where(CaseSubgraphNode.subgraph_id.in_(subgraph_ids)))
+        executor.execute(delete(CaseSubgraph).where(CaseSubgraph.id.in_(subgraph_ids)))
+
+class BeneficialOwnership(db.Model):
+    """
+    Stored ultimate beneficial owners of one company (see ownership.py);
+    `signature` identifies the PSC chain and threshold they were worked out from.
+    """
+    __tablename__ = "beneficial_ownership"
+    id = db.Column(db.Integer, primary_key=True)
+    company_id = db.Column(db.Integer, db.ForeignKey('company.id'), nullable=False, unique=True)
+    signature = db.Column(db.String(40), nullable=False)
+    owners = db.Column(db.Text, nullable=False)   # JSON list, see ownership.resolve_owners
+    computed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<BeneficialOwnership company_id={self.company_id}>"
+
+class NodeMetric(db.Model):
+    """
+    Whole-graph scores of one node, from the last analytics run (see
+    analytics.py). Kept by node id rather than foreign key; rows of nodes
+    that have gone are dropped by the next run.
+    """
+    __tablename__ = "node_metric"
+    __table_args__ = (
+        db.Index("ix_node_metric_degree", "degree", "node_id"),
+        db.Index("ix_node_metric_pagerank", "pagerank", "node_id"),
+        db.Index("ix_node_metric_betweenness", "betweenness", "node_id"),
+        db.Index("ix_node_metric_community", "community"),
+    )
+    node_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    kind = db.Column(db.String(20), nullable=False)
+    degree = db.Column(db.Integer, nullable=False, default=0)
+    in_degree = db.Column(db.Integer, nullable=False, default=0)
+    out_degree = db.Column(db.Integer, nullable=False, default=0)
+    pagerank = db.Column(db.Float, nullable=False, default=0.0)
+    betweenness = db.Column(db.Float, nullable=False, default=0.0)
+    # Component and community are labelled by their lowest node id.
+    component = db.Column(db.Integer, nullable=False)
+    component_size = db.Column(db.Integer, nullable=False, default=1)
+    community = db.Column(db.Integer, nullable=False)
+    is_hub = db.Column(db.Boolean, nullable=False, default=False)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<NodeMetric node={self.node_id} degree={self.degree}>"
+
+class GraphMetricsRun(db.Model):
+    """One analytics run: the graph it saw and how many node_metric rows it wrote."""
+    __tablename__ = "graph_metrics_run"
+    id = db.Column(db.Integer, primary_key=True)
+    started_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    # Graph version, relationship count and highest id, node count and
+    # highest id: unchanged means there is nothing to recompute.
+    signature = db.Column(db.String(100), nullable=True)
+    nodes = db.Column(db.Integer, nullable=False, default=0)
+    edges = db.Column(db.Integer, nullable=False, default=0)
+    written = db.Column(db.Integer, nullable=False, default=0)
+    hub_degree = db.Column(db.Integer, nullable=True)
+
+    def __repr__(self):
+        return f"<GraphMetricsRun {self.id} nodes={self.nodes} written={self.written}>"
+
+class GraphVersion(db.Model):
+    """
+    One row counting the commits that changed the graph through the ORM or
+    a set-based update (see mark_graph_changed). Unlike counts and highest
+    ids it moves when a deleted relationship's id is reused.
+    """
+    __tablename__ = "graph_version"
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+
+@event.listens_for(GraphVersion.__table__, "after_create")
+def _create_graph_version_row(target, connection, **kw):
+    connection.execute(insert(target).values(id=1, version=0))
+
+class Job(db.Model):
+    """
+    A Companies House fetch-and-upsert run off the request thread (see
+    jobs.py). `key` identifies what the job does, e.g. "update_psc:12"; a
+    job is not queued twice while one with the same key is waiting or running,
+    which the partial unique index enforces across processes.
+    """
+    __tablename__ = "job"
+    __table_args__ = (
+        db.Index("ix_job_active_key", "key", unique=True,
+                 sqlite_where=db.text("status IN ('queued', 'running')"),
+                 postgresql_where=db.text("status IN ('queued', 'running')")),
+        db.Index("ix_job_status_id", "status", "id"),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    key = db.Column(db.String(200), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default="{}")   # JSON arguments
+    status = db.Column(db.String(20), nullable=False, default="queued")  # queued, running, finished, failed
+    progress = db.Column(db.Integer, nullable=False, default=0)
+    message = db.Column(db.Text, nullable=True)
+    result = db.Column(db.Text, nullable=True)   # JSON, e.g. {"company_id": 5}
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=True)   # heartbeat while running
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f"<Job {self.id} {self.key} {self.status}>"
+
+class PersonBlockKey(db.Model):
+    """
+    A duplicate-detection blocking key (see dedupe.py). Only persons sharing
+    a key are compared, so the (key, person_id) index is what keeps a run
+    from being quadratic.
+    """
+    __tablename__ = "person_block_key"
+    __table_args__ = (
+        db.Index("ix_person_block_key_key", "key", "person_id"),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    person_id = db.Column(db.Integer, db.ForeignKey('person.id'), nullable=False, index=True)
+    key = db.Column(db.String(120), nullable=False)
+
+class DuplicateCluster(db.Model):
+    """A group of persons that look like the same individual, waiting for review."""
+    __tablename__ = "duplicate_cluster"
+    id = db.Column(db.Integer, primary_key=True)
+    score = db.Column(db.Float, nullable=False)  # weakest link in the cluster, 0..1
+    status = db.Column(db.String(20), nullable=False, default="pending", index=True)  # pending, merged, dismissed
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    members = db.relationship("DuplicateClusterMember", backref="cluster", cascade="all, delete-orphan")
+
+class DuplicateClusterMember(db.Model):
+    __tablename__ = "duplicate_cluster_member"
+    id = db.Column(db.Integer, primary_key=True)
+    cluster_id = db.Column(db.Integer, db.ForeignKey('duplicate_cluster.id', ondelete="CASCADE"), nullable=False,
+                           index=True)
+    person_id = db.Column(db.Integer, db.ForeignKey('person.id'), nullable=False, index=True)
+
+    person = db.relationship("Person")
+
+# -- node bookkeeping -------------------------------------------------------
+# ORM inserts get their node here; bulk inserts use create_nodes().
+
+def _node_id_for(connection, kind, entity_id):
+    model = Company if (kind or "").lower() == "company" else Person
+    return connection.execute(select(model.node_id).where(model.id == entity_id)).scalar()
+
+def _create_node(kind):
+    def listener(mapper, connection, target):
+        if target.node_id is None:
+            target.node_id = connection.execute(insert(Node).values(kind=kind)).inserted_primary_key[0]
+    return listener
+
+def _delete_node(mapper, connection, target):
+    if target.node_id is not None:
+        drop_case_subgraphs([target.node_id], connection=connection)
+        connection.execute(delete(NodeMetric).where(NodeMetric.node_id == target.node_id))
+        connection.execute(delete(Node).where(Node.id == target.node_id))
+
+def _set_endpoint_nodes(mapper, connection, target):
+    state = inspect(target)
+    for end in ("source", "target"):
+        changed = any(state.attrs[f"{end}_{part}"].history.has_changes() for part in ("type", "id"))
+        if getattr(target, f"{end}_node_id") is None or changed:
+            setattr(target, f"{end}_node_id",
+                    _node_id_for(connection, getattr(target, f"{end}_type"), getattr(target, f"{end}_id")))
+
+def _drop_beneficial_ownership(mapper, connection, target):
+    connection.execute(delete(BeneficialOwnership).where(BeneficialOwnership.company_id == target.id))
+
+for _model, _kind in ((Company, "company"), (Person, "person")):
+    event.listen(_model, "before_insert", _create_node(_kind))
+    event.listen(_model, "after_delete", _delete_node)
+event.listen(Company, "before_delete", _drop_beneficial_ownership)
+event.listen(Relationship, "before_insert", _set_endpoint_nodes)
+event.listen(Relationship, "before_update", _set_endpoint_nodes)
+
+# -- case subgraph bookkeeping -------------------------------------------------
+# A stored case subgraph is dropped when the case's companies change or a
+# relationship touching one of its nodes is added, moved or deleted.
+
+_SUBGRAPH_COLUMNS = ("source_node_id", "target_node_id", "relationship_type_id")
+
+def _drop_subgraphs_of_relationship(mapper, connection, target):
+    node_ids = {target.source_node_id, target.target_node_id}
+    state = inspect(target)
+    for column in ("source_node_id", "target_node_id"):
+        node_ids.update(state.attrs[column].history.deleted or ())
+    drop_case_subgraphs(node_ids, connection=connection)
+
+def _drop_subgraphs_of_changed_relationship(mapper, connection, target):
+    # Updates that leave the graph as it was (dates, say) keep the subgraphs.
+    state = inspect(target)
+    if any(state.attrs[column].history.has_changes() for column in _SUBGRAPH_COLUMNS):
+        _drop_subgraphs_of_relationship(mapper, connection, target)
+
+def _drop_subgraphs_of_case_detail(mapper, connection, target):
+    drop_case_subgraphs(case_id=target.case_id, connection=connection)
+
+def _drop_subgraphs_of_case(mapper, connection, target):
+    drop_case_subgraphs(case_id=target.id, connection=connection)
+
+event.listen(Relationship, "after_insert", _drop_subgraphs_of_relationship)
+event.listen(Relationship, "after_update", _drop_subgraphs_of_changed_relationship)
+event.listen(Relationship, "after_delete", _drop_subgraphs_of_relationship)
+for _event in ("after_insert", "after_update", "after_delete"):
+    event.listen(CaseDetail, _event, _drop_subgraphs_of_case_detail)
+event.listen(Case, "before_delete", _drop_subgraphs_of_case)
+
+# -- graph version -----------------------------------------------------------
+# Writes that change the graph mark the session (graph_index's listeners do
+# it for ORM writes); the version is bumped once per transaction that carries
+# a mark, just before it commits, so the row is locked only for the commit
+# and concurrent writers don't queue behind each other for the whole of it.
+
+_GRAPH_CHANGED_KEY = "graph_changed"
+
+def mark_graph_changed(session=None):
+    """Note that the graph changed in this session, e.g. after a set-based UPDATE or DELETE."""
+    (session if session is not None else db.session).info[_GRAPH_CHANGED_KEY] = True
+
+def _bump_graph_version(session):
+    if session.in_nested_transaction():
+        return
+    # Commit's own flush runs after this hook; flush first so its marks count.
+    session.flush()
+    if session.info.pop(_GRAPH_CHANGED_KEY, False):
+        table = GraphVersion.__table__
+        # Never on the replica, even from a @replica_reads view.
+        with primary_reads():
+            session.connection().execute(update(table).values(version=table.c.version + 1))
+
+def _forget_graph_change(session, transaction):
+    if transaction.parent is None:
+        session.info.pop(_GRAPH_CHANGED_KEY, None)
+
+event.listen(Session, "before_commit", _bump_graph_version)
+event.listen(Session, "after_transaction_end", _forget_graph_change)
+
+# -- duplicate-detection bookkeeping -----------------------------------------
+# A person's blocking keys are dropped when what they are built from changes
+# (the next dedupe run re-keys it) and, with its cluster memberships, when
+# the person is deleted.
+
+_BLOCK_KEY_COLUMNS = ("full_name", "birth_year", "birth_month")
+
+def _drop_stale_block_keys(mapper, connection, target):
+    state = inspect(target)
+    if any(state.attrs[column].history.has_changes() for column in _BLOCK_KEY_COLUMNS):
+        connection.execute(delete(PersonBlockKey).where(PersonBlockKey.person_id == target.id))
+
+def _drop_dedupe_rows(mapper, connection, target):
+    connection.execute(delete(PersonBlockKey).where(PersonBlockKey.person_id == target.id))
+    connection.execute(delete(DuplicateClusterMember).where(DuplicateClusterMember.person_id == target.id))
+
+event.listen(Person, "after_update", _drop_stale_block_keys)
+event.listen(Person, "before_delete", _drop_dedupe_rows)
@@ -1,144 +1,331 @@
 # my_flask_app/network_routes.py
-from flask import Blueprint, render_template, request
-from .models import db, Company, Person, Relationship, RelationshipType
+from flask import (Blueprint, render_template, request, jsonify, Response, stream_with_context, redirect, url_for,
+                   flash, current_app)
+from .models import db, Case, Company, Person, Relationship, RelationshipType
+from .graph_data import (iter_nodes, iter_edges, iter_edges_by_ids, filter_relationship_types,
+                         relationship_type_names, relationship_type_ids, parse_node_id,
+                         split_node_keys, incident_relationship_ids, node_id)
+from .graph_index import get_graph_index, seeded_subgraph
+from .db_tuning import replica_reads, primary_reads
+from .layout import network_layout, stored_layout, layout_key, MAX_LAYOUT_EDGES, SYNC_LAYOUT_EDGES
+from .paths import paths_query, DEFAULT_MAX_DEPTH, MAX_DEPTH, MAX_PATHS
+from .analytics import metrics_for, last_metrics_run
+from .case_graph import case_subgraph
+from .export import graph_records, export_graph, export_filename, missing_dependency, ExportStats, FORMATS
+from .jobs import enqueue_job
 import json
+import zlib
 
 network_bp = Blueprint("network_bp", __name__, template_folder="templates")
 
 def build_full_graph_edges():
     """
     Build a list of all edges from the database.
-    Each edge is a dict with keys: 'from', 'to', 'label', and 'rtype'
+    Each edge is a dict with keys: 'id', 'from', 'to', 'label', and 'rtype'
     (where node ids are strings like "company_1" or "person_3").
     """
-    relationships = Relationship.query.all()
-    edges = []
-    for r in relationships:
-        base_rtype = r.relationship_type.name if r.relationship_type else "Unknown"
-        # Build attribute string (if any)
-        attributes_str = ", ".join([f"{attr.key}: {attr.value}" for attr in r.attributes]) if r.attributes else ""
-        edge_label = f"{base_rtype} ({attributes_str})" if attributes_str else base_rtype
-
-        source_id = f"company_{r.source_id}" if r.source_type.lower() == "company" else f"person_{r.source_id}"
-        target_id = f"company_{r.target_id}" if r.target_type.lower() == "company" else f"person_{r.target_id}"
-        edges.append({
-            "from": source_id,
-            "to": target_id,
-            "label": edge_label,
-            "rtype": base_rtype
-        })
-    return edges
+    return list(iter_edges())
 
 def build_full_graph_nodes():
     """
     Build a list of all nodes from the database.
     """
-    nodes = []
-    companies = Company.query.all()
-    persons = Person.query.all()
-    for c in companies:
-        nodes.append({
-            "id": f"company_{c.id}",
-            "label": f"{c.name} ({c.company_number})",
-            "group": "company"
-        })
-    for p in persons:
-        nodes.append({
-            "id": f"person_{p.id}",
-            "label": p.full_name,
-            "group": "person"
-        })
-    return nodes
-
-def bfs_filter(start_node, edges, max_depth):
-    """
-    Given a starting node (e.g. "company_5"), the full edge list, and a maximum depth,
-    return a set of node ids that are reachable within that depth.
-    We treat the graph as undirected.
-    """
-    visited = set([start_node])
-    frontier = [start_node]
-    depth = 0
-    # Build an adjacency list from edges for efficiency
-    adjacency = {}
-    for edge in edges:
-        adjacency.setdefault(edge["from"], []).append(edge["to"])
-        adjacency.setdefault(edge["to"], []).append(edge["from"])
-    
-    while frontier and depth < max_depth:
-        next_frontier = []
-        for node in frontier:
-            for neighbor in adjacency.get(node, []):
-                if neighbor not in visited:
-                    visited.add(neighbor)
-                    next_frontier.append(neighbor)
-        frontier = next_frontier
-        depth += 1
-    return visited
+    return list(iter_nodes())
 
-@network_bp.route("/network")
-def network_view():
-    companies = Company.query.all()
-    persons = Person.query.all()
-    relationships = Relationship.query.all()
-
-    # Build full nodes list
-    all_nodes = []
-    for c in companies:
-        all_nodes.append({
-            "id": f"company_{c.id}",
-            "label": f"{c.name} ({c.company_number})",
-            "group": "company"
-        })
-    for p in persons:
-        all_nodes.append({
-            "id": f"person_{p.id}",
-            "label": p.full_name,
-            "group": "person"
-        })
-
-    # Build full edges list (each edge gets an "rtype" property)
-    all_edges = []
-    for r in relationships:
-        base_rtype = r.relationship_type.name if r.relationship_type else "Unknown"
-        attributes_str = ", ".join([f"{attr.key}: {attr.value}" for attr in r.attributes]) if r.attributes else ""
-        edge_label = f"{base_rtype} ({attributes_str})" if attributes_str else base_rtype
-
-        source_id = f"company_{r.source_id}" if r.source_type.lower() == "company" else f"person_{r.source_id}"
-        target_id = f"company_{r.target_id}" if r.target_type.lower() == "company" else f"person_{r.target_id}"
-        all_edges.append({
-            "from": source_id,
-            "to": target_id,
-            "label": edge_label,
-            "rtype": base_rtype
-        })
-
-    # Focus filtering: if focus_company and depth are provided, run a BFS to filter the graph.
-    focus_company = request.args.get("focus_company")
-    depth_str = request.args.get("depth")
-    if focus_company and depth_str:
+def focus_subgraph(focus_company, max_depth, rel_types=None):
+    """
+    Return (node keys, relationship ids) within `max_depth` hops of a
+    company, treating the graph as undirected. Walks the in-memory graph
+    index when it is ready and runs a recursive query otherwise; either way
+    the cost follows the size of the neighbourhood.
+    """
+    return seeded_subgraph([("company", focus_company)], max_depth, relationship_type_ids(rel_types))
+
+def find_connections(source, target, k=1, rel_types=None, max_depth=DEFAULT_MAX_DEPTH):
+    """
+    Up to `k` shortest paths between two (kind, id) entities as
+    {"length", "nodes", "edges"} dicts with node and edge records in path
+    order. Searches the graph index when it is ready, else the database.
+    """
+    type_ids = relationship_type_ids(rel_types)
+    index = get_graph_index()
+    if index is not None:
+        paths = index.shortest_paths(source, target, k, type_ids, max_depth)
+    else:
+        paths = paths_query(source, target, k, type_ids, max_depth)
+    company_ids, person_ids = split_node_keys(key for node_keys, _ in paths for key in node_keys)
+    nodes = {node["id"]: node for node in iter_nodes(company_ids, person_ids)}
+    edges = {edge["id"]: edge for edge in iter_edges_by_ids({rel_id for _, rel_ids in paths for rel_id in rel_ids})}
+    return [{"length": len(rel_ids),
+             "nodes": [nodes[node_id(*key)] for key in node_keys if node_id(*key) in nodes],
+             "edges": [edges[f"rel_{rel_id}"] for rel_id in rel_ids if f"rel_{rel_id}" in edges]}
+            for node_keys, rel_ids in paths]
+
+def _path_request():
+    """(source, target, k, max_depth) from the query string; the ends are None if missing."""
+    source = parse_node_id(request.args.get("from"))
+    target = parse_node_id(request.args.get("to"))
+    k = request.args.get("k", 1, type=int)
+    max_depth = request.args.get("max_depth", DEFAULT_MAX_DEPTH, type=int)
+    return source, target, k, max_depth
+
+def _requested_types():
+    return [t for t in request.args.getlist("types") if t]
+
+def _wants_gzip():
+    return "gzip" in request.headers.get("Accept-Encoding", "").lower()
+
+def ndjson_response(records, compress=False, batch_size=500):
+    """
+    Stream an iterable of dicts as newline-delimited JSON, optionally gzip
+    compressed. Records are serialised and sent in batches as they are
+    produced, so the response never exists in full in memory.
+    """
+    def generate():
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+        lines = []
+
+        def emit(lines):
+            chunk = ("\n".join(lines) + "\n").encode("utf-8")
+            if compressor:
+                # Sync flush so the browser can start drawing before the end.
+                return compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            return chunk
+
+        for record in records:
+            lines.append(json.dumps(record, separators=(",", ":")))
+            if len(lines) >= batch_size:
+                yield emit(lines)
+                lines = []
+        if lines:
+            yield emit(lines)
+        if compressor:
+            yield compressor.flush()
+
+    response = Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+    if compress:
+        response.headers["Content-Encoding"] = "gzip"
+    response.headers["Vary"] = "Accept-Encoding"
+    return response
+
+def _scored(nodes, batch_size=1000):
+    """
+    Add the stored graph scores to node records: "degree", "pagerank",
+    "betweenness", "community" and "hub". Nodes not scored yet pass through
+    unchanged. One lookup per batch.
+    """
+    def flush(batch):
+        company_ids, person_ids = split_node_keys(parse_node_id(node["id"]) for node in batch)
+        metrics = metrics_for(company_ids, person_ids)
+        for node in batch:
+            metric = metrics.get(parse_node_id(node["id"]))
+            if metric is None:
+                yield node
+                continue
+            yield dict(node, degree=metric.degree, pagerank=metric.pagerank, betweenness=metric.betweenness,
+                       community=metric.community, hub=bool(metric.is_hub),
+                       title=f"{node['label']}\n{metric.degree} relationships" + (" (hub)" if metric.is_hub else ""))
+
+    batch = []
+    for node in nodes:
+        batch.append(node)
+        if len(batch) >= batch_size:
+            yield from flush(batch)
+            batch = []
+    if batch:
+        yield from flush(batch)
+
+def _tagged(kind, records):
+    for record in records:
+        yield dict(record, type=kind)
+
+@network_bp.route("/api/network")
+@replica_reads
+def network_api():
+    """
+    Stream the graph as NDJSON: {"type": "node", ...} lines, then
+    {"type": "edge", ...} lines. With focus_company and depth only that
+    neighbourhood is sent, and with case_id and depth the neighbourhood of
+    every company in the case (see case_graph.py); repeated ?types=
+    restrict relationship types.
+    With layout=1 nodes carry precomputed "x" and "y" (see layout.py) unless
+    the subgraph has more than MAX_LAYOUT_EDGES edges. A subgraph over
+    SYNC_LAYOUT_EDGES with no stored layout is sent without positions while
+    a job lays it out (X-Network-Layout: pending). Nodes carry their stored
+    graph scores (see analytics.py).
+    """
+    focus_company = request.args.get("focus_company", type=int)
+    case_id = request.args.get("case_id", type=int)
+    rel_types = _requested_types()
+    type_names = relationship_type_names()
+    want_layout = request.args.get("layout") == "1"
+
+    if case_id or focus_company:
         try:
-            max_depth = int(depth_str)
+            max_depth = int(request.args.get("depth", 1))
         except ValueError:
             max_depth = 1
-        start_node = f"company_{focus_company}"
-        allowed_nodes = bfs_filter(start_node, all_edges, max_depth)
-        filtered_nodes = [node for node in all_nodes if node["id"] in allowed_nodes]
-        filtered_edges = [edge for edge in all_edges if edge["from"] in allowed_nodes and edge["to"] in allowed_nodes]
+        if case_id:
+            node_keys, rel_ids = case_subgraph(case_id, max_depth, rel_types)
+        else:
+            node_keys, rel_ids = focus_subgraph(focus_company, max_depth, rel_types)
+        company_ids, person_ids = split_node_keys(node_keys)
+        nodes = iter_nodes(company_ids, person_ids)
+        edges = iter_edges_by_ids(rel_ids, type_names)
+        key = layout_key(focus_company, max_depth, rel_types, case_id=case_id)
+        edge_count = len(rel_ids)
+    else:
+        nodes = iter_nodes()
+        edge_query = filter_relationship_types(Relationship.query, rel_types)
+        edges = iter_edges(edge_query, type_names)
+        key = layout_key(rel_types=rel_types)
+        edge_count = edge_query.count() if want_layout else None
+
+    positions = None
+    layout_pending = False
+    if want_layout and edge_count <= MAX_LAYOUT_EDGES:
+        edges = list(edges)
+        if edge_count <= SYNC_LAYOUT_EDGES:
+            positions = network_layout(key, edges)
+        else:
+            positions = stored_layout(key, edges)
+            if positions is None:
+                # The duplicate check must see jobs the replica may not have yet.
+                with primary_reads():
+                    enqueue_job("network_layout", f"network_layout:{key}",
+                                {"key": key, "focus_company": focus_company, "case_id": case_id,
+                                 "depth": max_depth if case_id or focus_company else None, "types": rel_types})
+                layout_pending = True
+
+    def records():
+        yield from _tagged("node", _scored(_placed(nodes, positions)))
+        yield from _tagged("edge", edges)
+
+    response = ndjson_response(records(), compress=_wants_gzip())
+    if positions is not None:
+        response.headers["X-Network-Layout"] = "1"
+    elif layout_pending:
+        response.headers["X-Network-Layout"] = "pending"
+    return response
+
+def _placed(nodes, positions):
+    for node in nodes:
+        position = positions.get(node["id"]) if positions else None
+        yield dict(node, x=position[0], y=position[1]) if position else node
+
+@network_bp.route("/api/network/export")
+@replica_reads
+def network_export():
+    """
+    Download the graph as ?format=graphml, gexf, csv or parquet (the last
+    two zipped nodes and edges tables): the whole graph, or with
+    focus_company or case_id and depth that subgraph; repeated ?types=
+    restrict relationship types. Streamed as it is written.
+    """
+    fmt = request.args.get("format", "graphml")
+    if fmt not in FORMATS:
+        return jsonify({"error": f"format must be one of {', '.join(FORMATS)}."}), 400
+    problem = missing_dependency(fmt)
+    if problem:
+        return jsonify({"error": problem}), 501
+    focus_company = request.args.get("focus_company", type=int)
+    case_id = request.args.get("case_id", type=int)
+    max_depth = request.args.get("depth", 1, type=int)
+    nodes, edges = graph_records(focus_company, case_id, max_depth, _requested_types())
+    stats = ExportStats()
+
+    def generate():
+        yield from export_graph(fmt, nodes, edges, stats)
+        current_app.logger.info("Exported %s: %s", export_filename(fmt, focus_company, case_id), stats.summary())
+
+    response = Response(stream_with_context(generate()), mimetype=FORMATS[fmt][0])
+    response.headers["Content-Disposition"] = \
+        f'attachment; filename="{export_filename(fmt, focus_company, case_id)}"'
+    return response
+
+@network_bp.route("/api/network/expand/<node>")
+@replica_reads
+def network_expand(node):
+    """Return one node, its direct neighbours and the edges between them."""
+    parsed = parse_node_id(node)
+    if not parsed:
+        return jsonify({"error": "Unknown node id."}), 404
+    kind, entity_id = parsed
+    type_ids = relationship_type_ids(_requested_types())
+    index = get_graph_index()
+    if index is not None:
+        rel_ids = index.incident(kind, entity_id, type_ids)
     else:
-        filtered_nodes = all_nodes
-        filtered_edges = all_edges
+        rel_ids = incident_relationship_ids(kind, entity_id, type_ids)
+    edges = list(iter_edges_by_ids(rel_ids))
+    neighbour_ids = {node} | {edge["from"] for edge in edges} | {edge["to"] for edge in edges}
+    company_ids, person_ids = split_node_keys(parse_node_id(n) for n in neighbour_ids)
+    return jsonify({"nodes": list(_scored(iter_nodes(company_ids, person_ids))), "edges": edges})
+
+@network_bp.route("/network")
+@replica_reads
+def network_view():
+    # The page fetches its nodes and edges from /api/network and expands
+    # nodes on demand, so nothing graph-sized is inlined here.
+    focus_company = request.args.get("focus_company", type=int)
+    # Case mode: the neighbourhood of every company in the case.
+    case = db.session.get(Case, request.args.get("case_id", type=int) or 0)
 
     # Get the list of relationship types (for the checkboxes)
     relationship_types = [rt.name for rt in RelationshipType.query.all()]
 
-    # Also, get companies for the focus dropdown.
-    companies_sorted = Company.query.order_by(Company.name.asc()).all()
+    # The focus picker searches /api/search; only the current choice is loaded.
+    focus = db.session.get(Company, focus_company) if focus_company else None
 
     return render_template("network_view.html", 
-                           nodes=filtered_nodes, 
-                           edges=filtered_edges,
-                           companies=companies_sorted,
+                           focus=focus,
                            current_focus=focus_company,
+                           case=case,
                            current_depth=request.args.get("depth", 1),
-                           relationship_types=relationship_types)
+                           relationship_types=relationship_types,
+                           metrics_run=last_metrics_run())
+
+@network_bp.route("/network/metrics", methods=["POST"])
+def network_metrics_refresh():
+    """Queue a run of the graph analytics (see analytics.py)."""
+    job, created = enqueue_job("graph_metrics", "graph_metrics", {"force": request.form.get("force") == "on"})
+    if created:
+        flash(f"Recomputing graph scores (job {job.id}).", "info")
+    else:
+        flash(f"Graph scores are already being recomputed (job {job.id}).", "info")
+    return redirect(request.referrer or url_for("network_bp.network_view"))
+
+@network_bp.route("/api/network/paths")
+@replica_reads
+def network_paths_api():
+    """
+    Shortest connections: ?from=person_3&to=company_12, optionally &k= paths
+    (default 1), &max_depth= hops and repeated &types=.
+    """
+    source, target, k, max_depth = _path_request()
+    if not source or not target:
+        return jsonify({"error": "from and to must be node ids like company_12 or person_3."}), 400
+    return jsonify({"paths": find_connections(source, target, k, _requested_types(), max_depth)})
+
+@network_bp.route("/network/paths")
+@replica_reads
+def network_paths():
+    """Pick two entities and list the shortest ways they are connected."""
+    source, target, k, max_depth = _path_request()
+    rel_types = _requested_types()
+    paths = None
+    if source and target:
+        paths = find_connections(source, target, k, rel_types, max_depth)
+
+    # Labels for the pickers' current choices.
+    selected = {}
+    company_ids, person_ids = split_node_keys(key for key in (source, target) if key)
+    for node in iter_nodes(company_ids, person_ids):
+        selected[node["id"]] = node["label"]
+
+    return render_template("network_paths.html", paths=paths, selected=selected,
+                           source=node_id(*source) if source else None,
+                           target=node_id(*target) if target else None,
+                           k=k, max_depth=max_depth, max_k=MAX_PATHS, max_depth_limit=MAX_DEPTH,
+                           relationship_types=[rt.name for rt in RelationshipType.query.all()],
+                           selected_types=rel_types)
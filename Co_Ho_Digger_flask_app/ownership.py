@@ -0,0 +1,246 @@
+# my_flask_app/ownership.py
+#
+# Ultimate beneficial owners from the PSC register. Each PSC relationship
+# (owner -> company) carries a "control" attribute listing its
+# natures_of_control, e.g. "ownership-of-shares-50-to-75-percent"; these are
+# read as a band of the company's shares, low to high.
+#
+# The chain above a company is read from the database one layer at a time
+# (corporate PSCs, then their corporate PSCs, ...) and turned into two sparse
+# matrices of direct holdings, one of the band lows and one of the highs.
+# Multiplying the company's column through them layer by layer gives every
+# owner's effective share by summing over all paths, as a min/max range.
+# A holding is not followed once its share drops below the threshold. Where
+# companies own each other in a cycle, the holdings that lead back round it
+# (towards the company, measured in steps from it) are dropped and the rest
+# are followed, so owners above the cycle are still reached; a cycle nobody
+# outside owns is where the walk stops, and its members are reported,
+# flagged.
+#
+# Results are stored per company in beneficial_ownership with a signature of
+# the chain's edges and controls, and reused while the chain is unchanged.
+
+import hashlib
+import json
+import os
+from datetime import datetime
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components, shortest_path
+from sqlalchemy import and_, select
+from sqlalchemy.exc import IntegrityError
+
+from .models import db, Node, Company, Person, Relationship, RelationshipType, RelationshipAttribute, BeneficialOwnership
+from .graph_data import node_keys_for
+
+# Share of a company (0-1) that makes an owner worth reporting; 25% is the
+# PSC register's own line.
+DEFAULT_THRESHOLD = float(os.getenv("UBO_THRESHOLD", "25")) / 100
+MAX_DEPTH = 30
+# Node ids per IN (...) when walking the chain.
+WALK_CHUNK = 500
+
+_NATURE_PREFIXES = ("ownership-of-shares", "right-to-share-surplus-assets", "voting-rights")
+
+
+def nature_band(nature):
+    """
+    (low, high) share of a company for one nature of control, or None when
+    it says nothing about shares: "ownership-of-shares-25-to-50-percent" ->
+    (0.25, 0.5), "...-more-than-25-percent" -> (0.25, 1.0). Suffixes like
+    "-as-trust" or "-limited-liability-partnership" are ignored.
+    """
+    nature = nature.strip().lower()
+    for prefix in _NATURE_PREFIXES:
+        if not nature.startswith(prefix + "-"):
+            continue
+        parts = nature[len(prefix) + 1:].split("-")
+        if len(parts) >= 4 and parts[1] == "to" and parts[3] == "percent" and parts[0].isdigit() and parts[2].isdigit():
+            return int(parts[0]) / 100, int(parts[2]) / 100
+        if len(parts) >= 4 and parts[:2] == ["more", "than"] and parts[2].isdigit() and parts[3] == "percent":
+            return int(parts[2]) / 100, 1.0
+    return None
+
+
+def control_band(control):
+    """
+    (low, high) share of a company held by a PSC, from its "control"
+    attribute (comma-separated natures of control). Shares and surplus
+    assets are used when given, else voting rights. A PSC with neither
+    registered only for other control, so holds at most 25%.
+    """
+    bands = {}
+    for nature in (control or "").split(","):
+        band = nature_band(nature)
+        if band:
+            kind = "votes" if nature.strip().lower().startswith("voting-rights") else "shares"
+            low, high = bands.get(kind, band)
+            bands[kind] = (max(low, band[0]), max(high, band[1]))
+    return bands.get("shares") or bands.get("votes") or (0.0, 0.25)
+
+
+def _psc_type_id():
+    return db.session.execute(select(RelationshipType.id).where(RelationshipType.name == "PSC")).scalar()
+
+
+def ownership_chain(company, max_depth=MAX_DEPTH):
+    """
+    PSC edges above a company, as (relationship id, owner node, owned node,
+    control) tuples: its PSCs, the PSCs of those that are companies, and so
+    on for up to `max_depth` layers. One query per layer.
+    """
+    type_id = _psc_type_id()
+    if type_id is None or company.node_id is None:
+        return []
+    rel = Relationship.__table__
+    attr = RelationshipAttribute.__table__
+    node = Node.__table__
+    query = select(rel.c.id, rel.c.source_node_id, rel.c.target_node_id, node.c.kind, attr.c.value)\
+        .select_from(rel.join(node, node.c.id == rel.c.source_node_id)
+                     .outerjoin(attr, and_(attr.c.relationship_id == rel.c.id,
+                                           db.func.lower(attr.c.key) == "control")))\
+        .where(rel.c.relationship_type_id == type_id)
+
+    edges = []
+    seen = {company.node_id}
+    frontier = [company.node_id]
+    for _ in range(max_depth):
+        next_frontier = []
+        for start in range(0, len(frontier), WALK_CHUNK):
+            chunk = frontier[start:start + WALK_CHUNK]
+            for rel_id, owner, owned, kind, control in db.session.execute(query.where(rel.c.target_node_id.in_(chunk))):
+                edges.append((rel_id, owner, owned, control))
+                if kind == "company" and owner not in seen:
+                    seen.add(owner)
+                    next_frontier.append(owner)
+        if not next_frontier:
+            break
+        frontier = next_frontier
+    return edges
+
+
+def chain_signature(edges, threshold):
+    """Fingerprint of a chain: its edges with their controls, and the threshold."""
+    digest = hashlib.sha1(f"{threshold:.4f};".encode("utf-8"))
+    for rel_id, owner, owned, control in sorted(edges, key=lambda e: e[0]):
+        digest.update(f"{rel_id}:{owner}:{owned}:{control or ''};".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def propagate(root, edges, threshold=DEFAULT_THRESHOLD, max_depth=MAX_DEPTH):
+    """
+    Effective shares of `root` (a node id) held through `edges` (see
+    ownership_chain). Returns {node id: {"min", "max", "depth", "reason"}}
+    for the owners at the top of each chain with a share of at least
+    `threshold`, where reason is "top" (nobody above it is recorded),
+    "cycle" (it is part of an ownership cycle with no owner outside it) or
+    "depth" (the walk stopped at max_depth).
+    """
+    if not edges:
+        return {}
+    index = {root: 0}
+    for _, owner, owned, _ in edges:
+        index.setdefault(owned, len(index))
+        index.setdefault(owner, len(index))
+    n = len(index)
+    # Several PSC rows for the same pair (say as a person and as a trustee) add up.
+    owners = np.array([index[e[1]] for e in edges])
+    owned = np.array([index[e[2]] for e in edges])
+    bands = np.array([control_band(e[3]) for e in edges]).reshape(-1, 2)
+    # held[i, j]: share of j held directly by i.
+    held_high = sparse.csr_matrix((bands[:, 1], (owners, owned)), shape=(n, n))
+
+    _, labels = connected_components(held_high, directed=True, connection="strong")
+    cyclic = np.bincount(labels)[labels] > 1
+    cyclic |= held_high.diagonal() > 0
+    # Within a cycle only holdings by an owner more steps from the company
+    # than what it owns are followed; the back-edges round the cycle are not.
+    steps = shortest_path(held_high.T, unweighted=True, indices=0)
+    forward = (labels[owners] != labels[owned]) | (steps[owners] > steps[owned])
+    held_low = sparse.csr_matrix((bands[forward, 0], (owners[forward], owned[forward])), shape=(n, n))
+    held_high = sparse.csr_matrix((bands[forward, 1], (owners[forward], owned[forward])), shape=(n, n))
+
+    # The walk stops at owners with nobody (left) above them.
+    stop = ~(np.asarray((held_high != 0).sum(axis=0)).ravel() > 0)
+
+    # low/high[i]: share of the company reached owner i by paths of `depth` steps.
+    low, high = held_low[:, 0].toarray().ravel(), held_high[:, 0].toarray().ravel()
+    found = {}
+    for depth in range(1, max_depth + 1):
+        high = np.minimum(high, 1.0)
+        # Holdings below the threshold are not followed any further.
+        keep = (high > 0) & (high >= threshold)
+        low, high = np.where(keep, low, 0.0), np.where(keep, high, 0.0)
+        for i in np.flatnonzero(stop & keep):
+            entry = found.setdefault(int(i), {"min": 0.0, "max": 0.0, "depth": depth,
+                                              "reason": "cycle" if cyclic[i] else "top"})
+            entry["min"] = min(entry["min"] + float(low[i]), 1.0)
+            entry["max"] = min(entry["max"] + float(high[i]), 1.0)
+        moving = keep & ~stop
+        if not moving.any():
+            break
+        if depth == max_depth:
+            for i in np.flatnonzero(moving):
+                found[int(i)] = {"min": float(low[i]), "max": float(high[i]), "depth": depth, "reason": "depth"}
+            break
+        low, high = held_low @ np.where(moving, low, 0.0), held_high @ np.where(moving, high, 0.0)
+
+    nodes = list(index)
+    return {nodes[i]: entry for i, entry in found.items() if nodes[i] != root and entry["max"] >= threshold}
+
+
+def _owner_rows(found):
+    """JSON-ready owner rows, largest share first, without names (see resolve_owners)."""
+    keys = node_keys_for(found)
+    rows = []
+    for node_id, entry in found.items():
+        kind, entity_id = keys.get(node_id, ("person", None))
+        rows.append({"kind": kind, "id": entity_id, "min": round(entry["min"] * 100, 2),
+                     "max": round(entry["max"] * 100, 2), "depth": entry["depth"], "reason": entry["reason"]})
+    rows.sort(key=lambda row: (-row["max"], -row["min"], row["depth"]))
+    return rows
+
+
+def resolve_owners(rows):
+    """Add "name" to owner rows: one query per kind."""
+    company_ids = [row["id"] for row in rows if row["kind"] == "company"]
+    person_ids = [row["id"] for row in rows if row["kind"] == "person"]
+    names = {}
+    if company_ids:
+        names.update((("company", i), name) for i, name in
+                     db.session.execute(select(Company.id, Company.name).where(Company.id.in_(company_ids))))
+    if person_ids:
+        names.update((("person", i), name) for i, name in
+                     db.session.execute(select(Person.id, Person.full_name).where(Person.id.in_(person_ids))))
+    return [dict(row, name=names.get((row["kind"], row["id"]), "Unknown")) for row in rows]
+
+
+def beneficial_owners(company, threshold=DEFAULT_THRESHOLD):
+    """
+    The ultimate beneficial owners of a company as owner rows: {"kind",
+    "id", "name", "min", "max" (effective percentages), "depth", "reason"}.
+    Stored results are reused while the PSC chain above the company is
+    unchanged.
+    """
+    # One layer more than propagate() follows, so owners cut off by the depth
+    # limit are told apart from the top of a chain.
+    edges = ownership_chain(company, MAX_DEPTH + 1)
+    signature = chain_signature(edges, threshold)
+    cached = BeneficialOwnership.query.filter_by(company_id=company.id).first()
+    if cached is not None and cached.signature == signature:
+        return resolve_owners(json.loads(cached.owners))
+
+    rows = _owner_rows(propagate(company.node_id, edges, threshold))
+    if cached is None:
+        cached = BeneficialOwnership(company_id=company.id)
+        db.session.add(cached)
+    cached.signature = signature
+    cached.owners = json.dumps(rows, separators=(",", ":"))
+    cached.computed_at = datetime.utcnow()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another request stored this company first; its result will do next time.
+        db.session.rollback()
+    return resolve_owners(rows)
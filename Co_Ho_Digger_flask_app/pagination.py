@@ -0,0 +1,129 @@
+# my_flask_app/pagination.py
+#
+# Keyset helpers: walk a table in (sort column, id) order with indexed range
+# queries instead of OFFSETs or loading every row.
+
+import base64
+import json
+
+from flask import current_app, request, url_for
+from sqlalchemy import tuple_
+
+
+def keyset_neighbors(query, sort_col, id_col, sort_value, row_id):
+    """
+    Return (previous, next) rows around (sort_value, row_id) in
+    (sort_col, id_col) order. Each is a single-row indexed range query.
+    """
+    key = tuple_(sort_col, id_col)
+    previous_row = query.filter(key < tuple_(sort_value, row_id))\
+        .order_by(sort_col.desc(), id_col.desc()).first()
+    next_row = query.filter(key > tuple_(sort_value, row_id))\
+        .order_by(sort_col.asc(), id_col.asc()).first()
+    return previous_row, next_row
+
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(sort_value, row_id):
+    raw = json.dumps([sort_value, row_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Return (sort_value, id) from a cursor, or None if it is missing or garbled."""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        sort_value, row_id = json.loads(raw)
+        return sort_value, int(row_id)
+    except (ValueError, TypeError):
+        return None
+
+
+def get_page_size():
+    """Page size from ?per_page=, else LIST_PAGE_SIZE config, clamped to MAX_PAGE_SIZE."""
+    default = current_app.config.get("LIST_PAGE_SIZE", DEFAULT_PAGE_SIZE)
+    try:
+        size = int(request.args.get("per_page", default))
+    except ValueError:
+        size = default
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+class KeysetPage:
+    """One page of a keyset-paginated query plus cursors for its neighbours."""
+
+    def __init__(self, items, page_size, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.page_size = page_size
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def _url(self, **cursor):
+        args = request.args.to_dict()
+        args.pop("after", None)
+        args.pop("before", None)
+        args.update(cursor)
+        return url_for(request.endpoint, **(request.view_args or {}), **args)
+
+    @property
+    def next_url(self):
+        return self._url(after=self.next_cursor) if self.next_cursor else None
+
+    @property
+    def prev_url(self):
+        return self._url(before=self.prev_cursor) if self.prev_cursor else None
+
+
+def keyset_paginate(query, sort_col, id_col, descending=False, after=None, before=None,
+                    page_size=DEFAULT_PAGE_SIZE):
+    """
+    Fetch one page of `query` in (sort_col, id_col) order starting after (or
+    ending before) an opaque cursor. Costs one indexed range query that reads
+    page_size + 1 rows, however deep into the table the page is.
+    """
+    key = tuple_(sort_col, id_col)
+    after = decode_cursor(after)
+    before = decode_cursor(before) if after is None else None
+
+    def cursor_for(row):
+        return encode_cursor(getattr(row, sort_col.key), getattr(row, id_col.key))
+
+    if before is not None:
+        # Walk backwards from the cursor, then flip the rows into display order.
+        bound = tuple_(*before)
+        query = query.filter(key > bound if descending else key < bound)
+        order = (sort_col.asc(), id_col.asc()) if descending else (sort_col.desc(), id_col.desc())
+        rows = query.order_by(*order).limit(page_size + 1).all()
+        has_prev = len(rows) > page_size
+        items = list(reversed(rows[:page_size]))
+        return KeysetPage(items, page_size,
+                          next_cursor=cursor_for(items[-1]) if items else None,
+                          prev_cursor=cursor_for(items[0]) if has_prev and items else None)
+
+    if after is not None:
+        bound = tuple_(*after)
+        query = query.filter(key < bound if descending else key > bound)
+    order = (sort_col.desc(), id_col.desc()) if descending else (sort_col.asc(), id_col.asc())
+    rows = query.order_by(*order).limit(page_size + 1).all()
+    has_next = len(rows) > page_size
+    items = rows[:page_size]
+    return KeysetPage(items, page_size,
+                      next_cursor=cursor_for(items[-1]) if has_next and items else None,
+                      prev_cursor=cursor_for(items[0]) if after is not None and items else None)
+
+
+def like_pattern(text):
+    """Escape a user's filter text for a case-insensitive LIKE ... ESCAPE '\\'."""
+    escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
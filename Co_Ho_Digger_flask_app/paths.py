@@ -0,0 +1,158 @@
+# my_flask_app/paths.py
+#
+# Connection finder: the shortest chains of relationships between two
+# companies or persons, treating the graph as undirected.
+#
+# The search is a bidirectional breadth-first search over integer node ids:
+# both ends grow a layer at a time, always the smaller frontier, until they
+# meet, so a path of length d costs about two searches of depth d/2 instead
+# of one of depth d. More than one path comes from Yen's algorithm, which
+# re-runs the search from each node of the paths found so far with the
+# steps already used there taken out.
+#
+# GraphIndex.shortest_paths runs the search over the in-memory graph index;
+# paths_query() is the fallback until the index is ready, with each layer
+# one query on the relationship node indexes.
+
+import heapq
+
+from sqlalchemy import or_, select
+
+from .models import db, Relationship
+from .graph_data import entity_node_id, node_keys_for, _type_filter
+
+DEFAULT_MAX_DEPTH = 6
+MAX_DEPTH = 12
+MAX_PATHS = 10
+# Node ids per IN (...) when expanding a frontier in SQL.
+EXPAND_CHUNK = 500
+
+
+def _step(u, v):
+    return (u, v) if u <= v else (v, u)
+
+
+def bidirectional_bfs(source, target, expand, max_depth, banned_nodes=frozenset(), banned_steps=frozenset()):
+    """
+    Shortest path from `source` to `target` as (nodes, edges), or None if
+    there is none within `max_depth` hops. `expand(nodes)` returns
+    {node: [(edge, neighbour), ...]} for a frontier. Paths never pass
+    through `banned_nodes` or take a `banned_steps` (node pair) hop.
+    """
+    if source == target:
+        return [source], []
+    # node -> (previous node, edge) on each side.
+    parents = ({source: None}, {target: None})
+    depths = ({source: 0}, {target: 0})
+    frontiers = ([source], [target])
+    while frontiers[0] and frontiers[1] and depths[0][frontiers[0][0]] + depths[1][frontiers[1][0]] < max_depth:
+        side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+        mine, theirs = parents[side], parents[1 - side]
+        depth = depths[side][frontiers[side][0]] + 1
+        meetings = []
+        next_frontier = []
+        for node, links in expand(frontiers[side]).items():
+            for edge, neighbour in links:
+                if neighbour in mine or neighbour in banned_nodes or _step(node, neighbour) in banned_steps:
+                    continue
+                mine[neighbour] = (node, edge)
+                depths[side][neighbour] = depth
+                next_frontier.append(neighbour)
+                if neighbour in theirs:
+                    meetings.append(neighbour)
+        if meetings:
+            # Every meeting in this layer is reached in `depth` steps from this
+            # side; take the one closest to the other end.
+            meet = min(meetings, key=lambda n: depths[1 - side][n])
+            return _join(meet, parents)
+        frontiers = (next_frontier, frontiers[1]) if side == 0 else (frontiers[0], next_frontier)
+    return None
+
+
+def _join(meet, parents):
+    nodes, edges = [meet], []
+    node = meet
+    while parents[0][node] is not None:
+        node, edge = parents[0][node]
+        nodes.insert(0, node)
+        edges.insert(0, edge)
+    node = meet
+    while parents[1][node] is not None:
+        node, edge = parents[1][node]
+        nodes.append(node)
+        edges.append(edge)
+    return nodes, edges
+
+
+def k_shortest_paths(source, target, expand, k=1, max_depth=DEFAULT_MAX_DEPTH):
+    """
+    Up to `k` shortest loopless paths, shortest first, as (nodes, edges)
+    pairs (Yen's algorithm). Paths differ in the nodes they pass through;
+    parallel relationships between the same two nodes do not make a new path.
+    """
+    first = bidirectional_bfs(source, target, expand, max_depth)
+    if first is None:
+        return []
+    found = [first]
+    candidates = []
+    seen = {tuple(first[0])}
+    counter = 0
+    while len(found) < k:
+        nodes, edges = found[-1]
+        for i in range(len(nodes) - 1):
+            root_nodes = nodes[:i + 1]
+            banned_steps = {_step(p[i], p[i + 1]) for p, _ in found if len(p) > i + 1 and p[:i + 1] == root_nodes}
+            spur = bidirectional_bfs(nodes[i], target, expand, max_depth - i,
+                                     banned_nodes=frozenset(root_nodes[:-1]), banned_steps=banned_steps)
+            if spur is None:
+                continue
+            path = (root_nodes[:-1] + spur[0], edges[:i] + spur[1])
+            if tuple(path[0]) not in seen:
+                seen.add(tuple(path[0]))
+                counter += 1
+                heapq.heappush(candidates, (len(path[1]), counter, path))
+        if not candidates:
+            break
+        found.append(heapq.heappop(candidates)[2])
+    return found
+
+
+def _query_expander(type_ids):
+    rel = Relationship.__table__
+
+    def expand(nodes):
+        links = {node: [] for node in nodes}
+        for start in range(0, len(nodes), EXPAND_CHUNK):
+            chunk = nodes[start:start + EXPAND_CHUNK]
+            query = select(rel.c.id, rel.c.source_node_id, rel.c.target_node_id)\
+                .where(or_(rel.c.source_node_id.in_(chunk), rel.c.target_node_id.in_(chunk)))
+            if type_ids is not None:
+                query = query.where(_type_filter(rel, type_ids))
+            for rel_id, u, v in db.session.execute(query):
+                if u in links:
+                    links[u].append((rel_id, v))
+                if v in links and v != u:
+                    links[v].append((rel_id, u))
+        return links
+    return expand
+
+
+def clamp_search(k, max_depth):
+    """Keep a requested path count and depth within the limits."""
+    return max(1, min(k, MAX_PATHS)), max(1, min(max_depth, MAX_DEPTH))
+
+
+def paths_query(source, target, k=1, type_ids=None, max_depth=DEFAULT_MAX_DEPTH):
+    """
+    Shortest connections between two (kind, id) entities as
+    (node keys, relationship ids) pairs, shortest first, in the same shape
+    as GraphIndex.shortest_paths, searching the database a layer at a time.
+    """
+    k, max_depth = clamp_search(k, max_depth)
+    start = db.session.execute(select(entity_node_id(*source))).scalar()
+    end = db.session.execute(select(entity_node_id(*target))).scalar()
+    if start is None or end is None:
+        return []
+    paths = k_shortest_paths(start, end, _query_expander(type_ids), k, max_depth)
+    keys = node_keys_for({n for nodes, _ in paths for n in nodes})
+    return [([keys[n] for n in nodes], edges) for nodes, edges in paths]
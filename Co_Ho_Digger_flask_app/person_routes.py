@@ -1,26 +1,47 @@
 # my_flask_app/person_routes.py
 
-from flask import Blueprint, render_template, request, redirect, url_for, flash
-from .models import db, Person, Relationship, Company
+import threading
+
+from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app
+from sqlalchemy import update
+from sqlalchemy.orm import joinedload
+from .models import (db, delete_relationships_of, drop_case_subgraphs, Person, Relationship, Company,
+                     DuplicateCluster, DuplicateClusterMember)
+from .graph_index import record_node_merge
+from .ingest import find_company_by_number
+from .relationship_display import relationship_display_rows
+from .pagination import keyset_neighbors, keyset_paginate, get_page_size, like_pattern
+from .db_tuning import replica_reads
+from .dedupe import run_dedupe, merge_persons
+from .analytics import with_scores, split_scores, LIST_SCORES
 
 person_bp = Blueprint("person_bp", __name__, template_folder="templates")
 
 @person_bp.route("/persons")
+@replica_reads
 def persons_list():
     sort = request.args.get("sort", "full_name")
     order = request.args.get("order", "asc")
+    hubs = request.args.get("hubs", "off")
+    q = request.args.get("q", "").strip()
     
     query = Person.query
-    if sort == "full_name":
-        if order == "asc":
-            query = query.order_by(Person.full_name.asc())
-        else:
-            query = query.order_by(Person.full_name.desc())
+    if q:
+        query = query.filter(Person.full_name.ilike(like_pattern(q), escape="\\"))
+
+    id_col = Person.id
+    if sort in LIST_SCORES:
+        sort_col, id_col = LIST_SCORES[sort]
     else:
-        query = query.order_by(Person.full_name.asc())
+        sort, sort_col = "full_name", Person.full_name
 
-    persons = query.all()
-    return render_template("persons_list.html", persons=persons, sort=sort, order=order)
+    query = with_scores(query, Person, sort_col, id_col, hubs_only=(hubs == "on"))
+    page = keyset_paginate(query, sort_col, id_col, descending=(order == "desc"),
+                           after=request.args.get("after"), before=request.args.get("before"),
+                           page_size=get_page_size())
+    scores = split_scores(page)
+    return render_template("persons_list.html", persons=page, page=page, sort=sort, order=order, q=q,
+                           scores=scores, hubs=hubs)
 
 
 @person_bp.route("/persons/new", methods=["GET", "POST"])
@@ -49,15 +70,10 @@ def persons_edit(person_id):
 @person_bp.route("/persons/<int:person_id>/delete", methods=["POST"])
 def persons_delete(person_id):
     person = Person.query.get_or_404(person_id)
-    
-    # Delete any relationships where this person is the source.
-    rels_as_source = Relationship.query.filter_by(source_type="person", source_id=person.id).all()
-    # Delete any relationships where this person is the target.
-    rels_as_target = Relationship.query.filter_by(target_type="person", target_id=person.id).all()
-    all_relationships = rels_as_source + rels_as_target
-    for rel in all_relationships:
-        db.session.delete(rel)
-    
+
+    # Remove every relationship touching the person in one statement.
+    delete_relationships_of(person.node_id)
+
     # Delete the person.
     db.session.delete(person)
     db.session.commit()
@@ -69,60 +85,13 @@ def persons_delete(person_id):
 def persons_view(person_id):
     person = Person.query.get_or_404(person_id)
     
-    # Get all persons sorted alphabetically by full_name
-    all_persons = Person.query.order_by(Person.full_name.asc()).all()
-    current_index = None
-    for idx, p in enumerate(all_persons):
-        if p.id == person.id:
-            current_index = idx
-            break
-    previous_person = all_persons[current_index - 1] if current_index and current_index > 0 else None
-    next_person = all_persons[current_index + 1] if current_index is not None and current_index < len(all_persons) - 1 else None
+    # Neighbours in (full_name, id) order for the previous/next links.
+    previous_person, next_person = keyset_neighbors(Person.query, Person.full_name, Person.id,
+                                                    person.full_name, person.id)
 
-    
-    # Get relationships where this person is source or target
-    relationships_source = Relationship.query.filter_by(source_type="person", source_id=person.id).all()
-    relationships_target = Relationship.query.filter_by(target_type="person", target_id=person.id).all()
-    all_relationships = relationships_source + relationships_target
-
-    display_data = []
-    for r in all_relationships:
-        # Get the relationship type name
-        rtype = r.relationship_type.name if r.relationship_type else "Unknown"
-
-        # Build friendly source display string
-        if r.source_type.lower() == "company":
-            source_obj = Company.query.get(r.source_id)
-            source_display = f"{source_obj.name} ({source_obj.company_number})" if source_obj else "Unknown Company"
-        else:
-            source_obj = Person.query.get(r.source_id)
-            source_display = source_obj.full_name if source_obj else "Unknown Person"
-
-        # Build friendly target display string
-        if r.target_type.lower() == "company":
-            target_obj = Company.query.get(r.target_id)
-            target_display = f"{target_obj.name} ({target_obj.company_number})" if target_obj else "Unknown Company"
-        else:
-            target_obj = Person.query.get(r.target_id)
-            target_display = target_obj.full_name if target_obj else "Unknown Person"
-
-        # Build attributes string if any
-        attributes_str = ", ".join([f"{attr.key}: {attr.value}" for attr in r.attributes]) if r.attributes else "N/A"
-
-        effective_date_str = r.effective_date.isoformat() if r.effective_date else "N/A"
-
-        display_data.append({
-            "id": r.id,
-            "relationship_type": rtype,
-            "source_display": source_display,
-            "source_type": r.source_type,
-            "source_id": r.source_id,
-            "target_display": target_display,
-            "target_type": r.target_type,
-            "target_id": r.target_id,
-            "effective_date": effective_date_str,
-            "attributes": attributes_str
-        })
+    # Get relationships where this person is source or target, resolved in bulk.
+    all_relationships = Relationship.touching(person.node_id).all()
+    display_data = relationship_display_rows(all_relationships)
 
     return render_template("persons_view.html", person=person, relationships=display_data, previous_person=previous_person, next_person=next_person)
     
@@ -138,7 +107,7 @@ def convert_person_to_company(person_id):
         return redirect(url_for("person_bp.persons_view", person_id=person_id))
     
     # Check if a company with this number exists
-    company = Company.query.filter_by(company_number=new_company_number).first()
+    company = find_company_by_number(new_company_number)
     if not company:
         # Create a new company record using the person's name
         company = Company(
@@ -151,18 +120,17 @@ def convert_person_to_company(person_id):
         db.session.add(company)
         db.session.flush()  # assign an ID
 
-    # Update any relationships where this person is involved.
-    # For relationships where person is source:
-    relationships_as_source = Relationship.query.filter_by(source_type="person", source_id=person.id).all()
-    for rel in relationships_as_source:
-        rel.source_type = "company"
-        rel.source_id = company.id
-
-    # For relationships where person is target:
-    relationships_as_target = Relationship.query.filter_by(target_type="person", target_id=person.id).all()
-    for rel in relationships_as_target:
-        rel.target_type = "company"
-        rel.target_id = company.id
+    # Repoint every relationship where this person is source or target at
+    # the company, one UPDATE per end.
+    drop_case_subgraphs([person.node_id, company.node_id])
+    for end in ("source", "target"):
+        node_column = getattr(Relationship, f"{end}_node_id")
+        db.session.execute(update(Relationship).where(node_column == person.node_id).values({
+            f"{end}_type": "company",
+            f"{end}_id": company.id,
+            node_column: company.node_id,
+        }).execution_options(synchronize_session=False))
+    record_node_merge(("person", person.id), ("company", company.id))
 
     # Delete the person record.
     db.session.delete(person)
@@ -176,3 +144,89 @@ def convert_person_to_company(person_id):
         return redirect(url_for("person_bp.persons_view", person_id=person_id))
     
     return redirect(url_for("company_bp.companies_view", company_id=company.id))
+
+
+# Set while a duplicate search runs in this process; "last" is its summary.
+_dedupe_status = {"running": False, "last": None}
+
+
+def _run_dedupe_in_background():
+    app = current_app._get_current_object()
+    _dedupe_status["running"] = True
+
+    def target():
+        with app.app_context():
+            try:
+                _dedupe_status["last"] = run_dedupe()
+            except Exception:
+                app.logger.exception("Duplicate search failed")
+            finally:
+                _dedupe_status["running"] = False
+
+    threading.Thread(target=target, name="dedupe-persons", daemon=True).start()
+
+
+@person_bp.route("/persons/duplicates")
+def duplicates_list():
+    """Pending duplicate clusters, most confident first, with their members bulk loaded."""
+    page = keyset_paginate(DuplicateCluster.query.filter_by(status="pending"), DuplicateCluster.score,
+                           DuplicateCluster.id, descending=True,
+                           after=request.args.get("after"), before=request.args.get("before"),
+                           page_size=get_page_size())
+    members = {}
+    if page.items:
+        for member in DuplicateClusterMember.query.options(joinedload(DuplicateClusterMember.person))\
+                .filter(DuplicateClusterMember.cluster_id.in_([c.id for c in page.items]))\
+                .order_by(DuplicateClusterMember.person_id):
+            members.setdefault(member.cluster_id, []).append(member.person)
+
+    # Relationship counts for every member, one grouped query per end.
+    counts = {}
+    node_ids = {p.node_id: p.id for ps in members.values() for p in ps}
+    for column in (Relationship.source_node_id, Relationship.target_node_id):
+        if node_ids:
+            for node_id, count in db.session.query(column, db.func.count()).filter(column.in_(node_ids))\
+                    .group_by(column):
+                counts[node_ids[node_id]] = counts.get(node_ids[node_id], 0) + count
+
+    return render_template("persons_duplicates.html", clusters=page, page=page, members=members,
+                           counts=counts, status=_dedupe_status)
+
+
+@person_bp.route("/persons/duplicates/find", methods=["POST"])
+def duplicates_find():
+    if _dedupe_status["running"]:
+        flash("A duplicate search is already running.", "warning")
+    else:
+        _run_dedupe_in_background()
+        flash("Duplicate search started; refresh this page to see the results.", "success")
+    return redirect(url_for("person_bp.duplicates_list"))
+
+
+@person_bp.route("/persons/duplicates/<int:cluster_id>/merge", methods=["POST"])
+def duplicates_merge(cluster_id):
+    cluster = DuplicateCluster.query.get_or_404(cluster_id)
+    keep = db.session.get(Person, request.form.get("keep", type=int))
+    selected = set(request.form.getlist("merge", type=int))
+    members = [m.person for m in cluster.members]
+    if keep is None or keep not in members:
+        flash("Choose which person to keep.", "warning")
+        return redirect(url_for("person_bp.duplicates_list"))
+
+    merge_persons(keep, [p for p in members if p.id in selected])
+    cluster.status = "merged"
+    try:
+        db.session.commit()
+        flash(f"Merged into {keep.full_name}.", "success")
+    except Exception as e:
+        db.session.rollback()
+        flash(f"Error during merge: {e}", "danger")
+    return redirect(url_for("person_bp.duplicates_list"))
+
+
+@person_bp.route("/persons/duplicates/<int:cluster_id>/dismiss", methods=["POST"])
+def duplicates_dismiss(cluster_id):
+    cluster = DuplicateCluster.query.get_or_404(cluster_id)
+    cluster.status = "dismissed"
+    db.session.commit()
+    return redirect(url_for("person_bp.duplicates_list"))
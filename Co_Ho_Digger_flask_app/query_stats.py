@@ -0,0 +1,45 @@
+# my_flask_app/query_stats.py
+#
+# Counts the SQL statements each request runs. In debug mode the count is
+# sent back as an X-Query-Count header, logged, and shown in the page footer.
+
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.query_count = g.get("query_count", 0) + 1
+
+
+def query_count():
+    return g.get("query_count", 0) if has_request_context() else 0
+
+
+def init_query_stats(app):
+    # app.debug is checked per request because app.run(debug=True) turns it
+    # on after create_app has returned.
+    if not event.contains(Engine, "before_cursor_execute", _count_query):
+        event.listen(Engine, "before_cursor_execute", _count_query)
+
+    @app.before_request
+    def _start_timer():
+        if app.debug:
+            g.request_started = time.perf_counter()
+
+    @app.after_request
+    def _report_queries(response):
+        if not app.debug:
+            return response
+        count = query_count()
+        elapsed_ms = (time.perf_counter() - g.get("request_started", time.perf_counter())) * 1000
+        response.headers["X-Query-Count"] = str(count)
+        app.logger.debug("%s %s: %d queries in %.1f ms", request.method, request.path, count, elapsed_ms)
+        return response
+
+    @app.context_processor
+    def _inject_query_count():
+        return dict(debug_query_count=query_count if app.debug else None)
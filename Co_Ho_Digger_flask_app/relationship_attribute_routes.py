@@ -1,41 +1,39 @@
 # my_flask_app/relationship_attribute_routes.py
 from flask import Blueprint, render_template, request, redirect, url_for, flash
+from sqlalchemy.orm import joinedload
 from .models import db, RelationshipAttribute, Relationship
+from .relationship_display import RelationshipResolver, load_in
+from .pagination import keyset_paginate, get_page_size, like_pattern
+from .db_tuning import replica_reads
 
 relattr_bp = Blueprint("relattr_bp", __name__, template_folder="templates")
 
 @relattr_bp.route("/relationship_attributes")
+@replica_reads
 def relationship_attributes_list():
-    from .models import Company, Person  # ensure these are imported
-    attributes = RelationshipAttribute.query.all()
+    q = request.args.get("q", "").strip()
+    query = RelationshipAttribute.query
+    if q:
+        pattern = like_pattern(q)
+        query = query.filter(db.or_(RelationshipAttribute.key.ilike(pattern, escape="\\"),
+                                    RelationshipAttribute.value.ilike(pattern, escape="\\")))
+    page = keyset_paginate(query, RelationshipAttribute.key, RelationshipAttribute.id,
+                           after=request.args.get("after"), before=request.args.get("before"),
+                           page_size=get_page_size())
+    attributes = page.items
+    # Load the owning relationships in one query and resolve them in bulk.
+    rel_ids = {attr.relationship_id for attr in attributes}
+    relationships = {r.id: r for r in load_in(Relationship, Relationship.id, rel_ids)}
+    resolver = RelationshipResolver(relationships.values())
     display_data = []
     for attr in attributes:
-        rel = attr.relationship
-        if rel:
-            # Determine friendly source name.
-            if rel.source_type.lower() == 'company':
-                source_obj = Company.query.get(rel.source_id)
-                source_display = f"{source_obj.name} ({source_obj.company_number})" if source_obj else "Unknown Company"
-            else:
-                source_obj = Person.query.get(rel.source_id)
-                source_display = source_obj.full_name if source_obj else "Unknown Person"
-            # Determine friendly target name.
-            if rel.target_type.lower() == 'company':
-                target_obj = Company.query.get(rel.target_id)
-                target_display = f"{target_obj.name} ({target_obj.company_number})" if target_obj else "Unknown Company"
-            else:
-                target_obj = Person.query.get(rel.target_id)
-                target_display = target_obj.full_name if target_obj else "Unknown Person"
-            # Build a friendly description: RelationshipType: source -> target.
-            rel_type = rel.relationship_type.name if rel.relationship_type else "Unknown"
-            rel_desc = f"{rel_type}: {source_display} → {target_display}"
-        else:
-            rel_desc = "N/A"
+        rel = relationships.get(attr.relationship_id)
         display_data.append({
             "attribute": attr,
-            "relationship_display": rel_desc
+            # Build a friendly description: RelationshipType: source -> target.
+            "relationship_display": resolver.describe(rel) if rel else "N/A"
         })
-    return render_template("relationship_attributes_list.html", attributes=display_data)
+    return render_template("relationship_attributes_list.html", attributes=display_data, page=page, q=q)
 
 @relattr_bp.route("/relationship_attributes/new", methods=["GET", "POST"])
 def relationship_attributes_new():
@@ -57,7 +55,7 @@ def relationship_attributes_new():
         return redirect(url_for("relattr_bp.relationship_attributes_list"))
     
     # For the form, we provide a list of relationships to choose from.
-    relationships = Relationship.query.all()
+    relationships = Relationship.query.options(joinedload(Relationship.relationship_type)).all()
     return render_template("relationship_attributes_new.html", relationships=relationships)
 
 @relattr_bp.route("/relationship_attributes/<int:attr_id>/edit", methods=["GET", "POST"])
@@ -0,0 +1,95 @@
+# my_flask_app/relationship_display.py
+#
+# Turns a batch of Relationship rows into the display dicts the relationship
+# tables render. Every endpoint, type and attribute is bulk loaded, so a
+# batch costs a constant number of queries however many rows it has.
+
+from .models import Company, Person, RelationshipType, RelationshipAttribute
+
+
+# Keeps IN lists under SQLite's bound-parameter limit on very large batches.
+IN_CHUNK = 5000
+
+
+def load_in(model, column, ids, order_by=None):
+    ids = list(ids)
+    for start in range(0, len(ids), IN_CHUNK):
+        query = model.query.filter(column.in_(ids[start:start + IN_CHUNK]))
+        if order_by is not None:
+            query = query.order_by(order_by)
+        yield from query
+
+
+def _company_display(company):
+    return f"{company.name} ({company.company_number})" if company else "Unknown Company"
+
+
+def _person_display(person):
+    return person.full_name if person else "Unknown Person"
+
+
+class RelationshipResolver:
+    """
+    Bulk-loads the companies, persons, types and attributes referenced by a
+    batch of relationships: four queries per batch, none per row.
+    """
+
+    def __init__(self, relationships):
+        self.relationships = list(relationships)
+        company_ids, person_ids, type_ids, rel_ids = set(), set(), set(), set()
+        for r in self.relationships:
+            rel_ids.add(r.id)
+            if r.relationship_type_id:
+                type_ids.add(r.relationship_type_id)
+            for end_type, end_id in ((r.source_type, r.source_id), (r.target_type, r.target_id)):
+                if end_type.lower() == "company":
+                    company_ids.add(end_id)
+                else:
+                    person_ids.add(end_id)
+
+        self.companies = {c.id: c for c in load_in(Company, Company.id, company_ids)}
+        self.persons = {p.id: p for p in load_in(Person, Person.id, person_ids)}
+        self.types = {t.id: t.name for t in load_in(RelationshipType, RelationshipType.id, type_ids)}
+        self.attributes = {}
+        for attr in load_in(RelationshipAttribute, RelationshipAttribute.relationship_id, rel_ids,
+                             order_by=RelationshipAttribute.id):
+            self.attributes.setdefault(attr.relationship_id, []).append(attr)
+
+    def endpoint_display(self, end_type, end_id):
+        if end_type.lower() == "company":
+            return _company_display(self.companies.get(end_id))
+        return _person_display(self.persons.get(end_id))
+
+    def type_name(self, r):
+        return self.types.get(r.relationship_type_id, "Unknown")
+
+    def attributes_str(self, r, default="N/A"):
+        attrs = self.attributes.get(r.id)
+        return ", ".join([f"{attr.key}: {attr.value}" for attr in attrs]) if attrs else default
+
+    def describe(self, r):
+        """One-line description: "Type: source -> target"."""
+        return f"{self.type_name(r)}: {self.endpoint_display(r.source_type, r.source_id)} → " \
+               f"{self.endpoint_display(r.target_type, r.target_id)}"
+
+    def display_rows(self):
+        """The dicts relationships_list / companies_view / persons_view render."""
+        display_data = []
+        for r in self.relationships:
+            display_data.append({
+                "id": r.id,
+                "relationship_type": self.type_name(r),
+                "source_display": self.endpoint_display(r.source_type, r.source_id),
+                "source_type": r.source_type,
+                "source_id": r.source_id,
+                "target_display": self.endpoint_display(r.target_type, r.target_id),
+                "target_type": r.target_type,
+                "target_id": r.target_id,
+                "effective_date": r.effective_date.isoformat() if r.effective_date else "N/A",
+                "attributes": self.attributes_str(r)
+            })
+        return display_data
+
+
+def relationship_display_rows(relationships):
+    return RelationshipResolver(relationships).display_rows()
@@ -2,51 +2,38 @@
 
 from flask import Blueprint, render_template, request, redirect, url_for
 from .models import db, Relationship, RelationshipType, Company, Person, RelationshipAttribute
+from .relationship_display import relationship_display_rows
+from .pagination import keyset_paginate, get_page_size, like_pattern
+from .db_tuning import replica_reads
 
 relationship_bp = Blueprint("relationship_bp", __name__, template_folder="templates")
 
 @relationship_bp.route("/relationships")
+@replica_reads
 def relationships_list():
-    relationships = Relationship.query.all()
-    display_data = []
-
-    for r in relationships:
-        # Get relationship type label
-        rtype = r.relationship_type.name if r.relationship_type else "Unknown"
-
-        # Build source display (if company, show name and number; if person, show full name)
-        if r.source_type.lower() == "company":
-            company_obj = Company.query.get(r.source_id)
-            source_display = f"{company_obj.name} ({company_obj.company_number})" if company_obj else "Unknown Company"
-        else:
-            person_obj = Person.query.get(r.source_id)
-            source_display = person_obj.full_name if person_obj else "Unknown Person"
-
-        # Build target display similarly
-        if r.target_type.lower() == "company":
-            company_obj = Company.query.get(r.target_id)
-            target_display = f"{company_obj.name} ({company_obj.company_number})" if company_obj else "Unknown Company"
-        else:
-            person_obj = Person.query.get(r.target_id)
-            target_display = person_obj.full_name if person_obj else "Unknown Person"
-
-        # Build attributes string, if any
-        attributes_str = ", ".join([f"{attr.key}: {attr.value}" for attr in r.attributes]) if r.attributes else "N/A"
-
-        display_data.append({
-            "id": r.id,
-            "relationship_type": rtype,
-            "source_display": source_display,
-            "source_type": r.source_type,    # corrected
-            "source_id": r.source_id,          # corrected
-            "target_display": target_display,
-            "target_type": r.target_type,      # corrected
-            "target_id": r.target_id,          # corrected
-            "effective_date": r.effective_date.isoformat() if r.effective_date else "N/A",
-            "attributes": attributes_str
-        })
-
-    return render_template("relationships_list.html", relationships=display_data)
+    q = request.args.get("q", "").strip()
+    query = Relationship.query
+    if q:
+        # Match the relationship type or either endpoint's name.
+        pattern = like_pattern(q)
+        type_ids = db.select(RelationshipType.id).where(RelationshipType.name.ilike(pattern, escape="\\"))
+        node_ids = db.select(Company.node_id).where(db.or_(Company.name.ilike(pattern, escape="\\"),
+                                                           Company.company_number.ilike(pattern, escape="\\")))\
+            .union_all(db.select(Person.node_id).where(Person.full_name.ilike(pattern, escape="\\")))
+        query = query.filter(db.or_(
+            Relationship.relationship_type_id.in_(type_ids),
+            Relationship.source_node_id.in_(node_ids),
+            Relationship.target_node_id.in_(node_ids),
+        ))
+
+    page = keyset_paginate(query, Relationship.id, Relationship.id,
+                           after=request.args.get("after"), before=request.args.get("before"),
+                           page_size=get_page_size())
+    relationships = page.items
+    # Endpoints, types and attributes for the whole page are bulk loaded.
+    display_data = relationship_display_rows(relationships)
+
+    return render_template("relationships_list.html", relationships=display_data, page=page, q=q)
 
 
 
@@ -103,14 +90,11 @@ def relationships_new():
         return redirect(url_for("relationship_bp.relationships_list"))
 
     # GET
+    # Sources and targets are picked with the /api/search typeahead.
     relationship_types = RelationshipType.query.order_by(RelationshipType.name.asc()).all()
-    companies = Company.query.order_by(Company.name.asc()).all()
-    persons = Person.query.order_by(Person.full_name.asc()).all()   
     return render_template(
         "relationships_new.html",
-        relationship_types=relationship_types,
-        companies=companies,
-        persons=persons
+        relationship_types=relationship_types
     )
 
 @relationship_bp.route("/relationships/<int:rel_id>/delete", methods=["POST"])
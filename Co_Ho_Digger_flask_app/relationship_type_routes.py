@@ -2,13 +2,24 @@
 
 from flask import Blueprint, render_template, request, redirect, url_for
 from .models import db, RelationshipType
+from .pagination import keyset_paginate, get_page_size, like_pattern
+from .db_tuning import replica_reads
 
 reltype_bp = Blueprint("reltype_bp", __name__, template_folder="templates")
 
 @reltype_bp.route("/relationship_types")
+@replica_reads
 def relationship_types_list():
-    types_ = RelationshipType.query.all()
-    return render_template("relationship_types_list.html", types=types_)
+    q = request.args.get("q", "").strip()
+    query = RelationshipType.query
+    if q:
+        pattern = like_pattern(q)
+        query = query.filter(db.or_(RelationshipType.name.ilike(pattern, escape="\\"),
+                                    RelationshipType.description.ilike(pattern, escape="\\")))
+    types_ = keyset_paginate(query, RelationshipType.name, RelationshipType.id,
+                             after=request.args.get("after"), before=request.args.get("before"),
+                             page_size=get_page_size())
+    return render_template("relationship_types_list.html", types=types_, q=q)
 
 @reltype_bp.route("/relationship_types/new", methods=["GET", "POST"])
 def relationship_types_new():
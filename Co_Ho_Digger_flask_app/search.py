@@ -0,0 +1,181 @@
+# my_flask_app/search.py
+#
+# Prefix full-text search over company name / number / address and person
+# name, for the typeahead pickers (/api/search).
+#
+# SQLite: an FTS5 table, search_index, filled by triggers on company and
+# person so every write - ORM, bulk import or raw SQL - keeps it in sync.
+# Its rowid encodes the row: company id * 2, person id * 2 + 1.
+# PostgreSQL: GIN indexes on to_tsvector('simple', ...) expressions over the
+# tables themselves, which PostgreSQL maintains on write.
+#
+# The structures are created by the migration, by db.create_all() (see the
+# after_create hook below) and by `flask rebuild-search-index`.
+
+import re
+
+from sqlalchemy import event, text
+
+from .models import db, Company, Person
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 50
+
+# Must match the index expressions exactly for PostgreSQL to use them.
+PG_COMPANY_DOCUMENT = ("to_tsvector('simple', coalesce(name, '') || ' ' || coalesce(company_number, '') || ' ' || "
+                       "coalesce(normalized_number, '') || ' ' || coalesce(registered_address, ''))")
+PG_PERSON_DOCUMENT = "to_tsvector('simple', coalesce(full_name, ''))"
+
+_SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5("
+    "name, number, address, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')",
+    """CREATE TRIGGER IF NOT EXISTS company_search_insert AFTER INSERT ON company BEGIN
+         INSERT INTO search_index (rowid, name, number, address)
+         VALUES (new.id * 2, new.name, new.company_number || ' ' || coalesce(new.normalized_number, ''),
+                 coalesce(new.registered_address, ''));
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS company_search_update
+       AFTER UPDATE OF name, company_number, normalized_number, registered_address ON company BEGIN
+         DELETE FROM search_index WHERE rowid = old.id * 2;
+         INSERT INTO search_index (rowid, name, number, address)
+         VALUES (new.id * 2, new.name, new.company_number || ' ' || coalesce(new.normalized_number, ''),
+                 coalesce(new.registered_address, ''));
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS company_search_delete AFTER DELETE ON company BEGIN
+         DELETE FROM search_index WHERE rowid = old.id * 2;
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS person_search_insert AFTER INSERT ON person BEGIN
+         INSERT INTO search_index (rowid, name, number, address) VALUES (new.id * 2 + 1, new.full_name, '', '');
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS person_search_update AFTER UPDATE OF full_name ON person BEGIN
+         DELETE FROM search_index WHERE rowid = old.id * 2 + 1;
+         INSERT INTO search_index (rowid, name, number, address) VALUES (new.id * 2 + 1, new.full_name, '', '');
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS person_search_delete AFTER DELETE ON person BEGIN
+         DELETE FROM search_index WHERE rowid = old.id * 2 + 1;
+       END""",
+]
+
+_PG_DDL = [
+    "CREATE INDEX IF NOT EXISTS ix_company_search ON company USING gin ((" + PG_COMPANY_DOCUMENT + "))",
+    "CREATE INDEX IF NOT EXISTS ix_person_search ON person USING gin ((" + PG_PERSON_DOCUMENT + "))",
+]
+
+
+def install_search_index(connection):
+    """Create the search structures for this database if they are missing."""
+    if connection.dialect.name == "sqlite":
+        for statement in _SQLITE_DDL:
+            connection.execute(text(statement))
+    elif connection.dialect.name == "postgresql":
+        for statement in _PG_DDL:
+            connection.execute(text(statement))
+
+
+def rebuild_search_index(connection):
+    """Refill the SQLite search table from scratch (PostgreSQL's indexes need no rebuild)."""
+    install_search_index(connection)
+    if connection.dialect.name != "sqlite":
+        return
+    connection.execute(text("DELETE FROM search_index"))
+    connection.execute(text(
+        "INSERT INTO search_index (rowid, name, number, address) "
+        "SELECT id * 2, name, company_number || ' ' || coalesce(normalized_number, ''), "
+        "coalesce(registered_address, '') FROM company"))
+    connection.execute(text(
+        "INSERT INTO search_index (rowid, name, number, address) SELECT id * 2 + 1, full_name, '', '' FROM person"))
+    connection.execute(text("INSERT INTO search_index (search_index) VALUES ('optimize')"))
+
+
+@event.listens_for(db.metadata, "after_create")
+def _create_search_index(target, connection, **kw):
+    install_search_index(connection)
+
+
+def search_terms(q):
+    """Letters/digits runs of the query, lower case: what both backends match as prefixes."""
+    return re.findall(r"[^\W_]+", (q or "").lower())[:8]
+
+
+def _sqlite_matches(terms, kinds, limit):
+    # Name matches count most, then numbers, then addresses.
+    match = " ".join(f'"{term}"*' for term in terms)
+    kind_filter = ""
+    if kinds == {"company"}:
+        kind_filter = "AND rowid % 2 = 0"
+    elif kinds == {"person"}:
+        kind_filter = "AND rowid % 2 = 1"
+    rows = db.session.execute(text(
+        f"SELECT rowid FROM search_index WHERE search_index MATCH :match {kind_filter} "
+        "ORDER BY bm25(search_index, 10.0, 5.0, 1.0) LIMIT :limit"), {"match": match, "limit": limit})
+    return [("person" if rowid % 2 else "company", rowid // 2) for rowid, in rows]
+
+
+def _postgres_matches(terms, kinds, limit):
+    query = " & ".join(f"{term}:*" for term in terms)
+    parts = []
+    if "company" in kinds:
+        parts.append(f"SELECT 'company' AS kind, id, ts_rank({PG_COMPANY_DOCUMENT}, q) AS rank "
+                     f"FROM company, to_tsquery('simple', :query) q WHERE {PG_COMPANY_DOCUMENT} @@ q")
+    if "person" in kinds:
+        parts.append(f"SELECT 'person' AS kind, id, ts_rank({PG_PERSON_DOCUMENT}, q) AS rank "
+                     f"FROM person, to_tsquery('simple', :query) q WHERE {PG_PERSON_DOCUMENT} @@ q")
+    rows = db.session.execute(text(" UNION ALL ".join(parts) + " ORDER BY rank DESC, id LIMIT :limit"),
+                              {"query": query, "limit": limit})
+    return [(kind, entity_id) for kind, entity_id, _ in rows]
+
+
+def _like_matches(terms, kinds, limit):
+    # Other databases: unranked LIKE matching, no index.
+    matches = []
+    if "company" in kinds:
+        query = Company.query
+        for term in terms:
+            query = query.filter(db.or_(Company.name.ilike(f"%{term}%"), Company.company_number.ilike(f"{term}%")))
+        matches += [("company", c.id) for c in query.order_by(Company.name).limit(limit)]
+    if "person" in kinds:
+        query = Person.query
+        for term in terms:
+            query = query.filter(Person.full_name.ilike(f"%{term}%"))
+        matches += [("person", p.id) for p in query.order_by(Person.full_name).limit(limit)]
+    return matches[:limit]
+
+
+def search_entities(q, kinds=("company", "person"), limit=DEFAULT_LIMIT):
+    """
+    Best matches for the query `q`, each term matched as a word prefix, as
+    result dicts in rank order: {"id": "company_5", "kind", "entity_id",
+    "label", "detail"}. Two queries: the index lookup, then one per kind to
+    fetch the rows.
+    """
+    terms = search_terms(q)
+    kinds = set(kinds)
+    if not terms or not kinds:
+        return []
+    limit = max(1, min(limit, MAX_LIMIT))
+    dialect = db.session.get_bind().dialect.name
+    if dialect == "sqlite":
+        matches = _sqlite_matches(terms, kinds, limit)
+    elif dialect == "postgresql":
+        matches = _postgres_matches(terms, kinds, limit)
+    else:
+        matches = _like_matches(terms, kinds, limit)
+
+    company_ids = [entity_id for kind, entity_id in matches if kind == "company"]
+    person_ids = [entity_id for kind, entity_id in matches if kind == "person"]
+    companies = {c.id: c for c in Company.query.filter(Company.id.in_(company_ids))} if company_ids else {}
+    persons = {p.id: p for p in Person.query.filter(Person.id.in_(person_ids))} if person_ids else {}
+
+    results = []
+    for kind, entity_id in matches:
+        if kind == "company" and entity_id in companies:
+            c = companies[entity_id]
+            results.append({"id": f"company_{c.id}", "kind": "company", "entity_id": c.id,
+                            "label": f"{c.name} ({c.company_number})", "detail": c.registered_address or ""})
+        elif kind == "person" and entity_id in persons:
+            p = persons[entity_id]
+            results.append({"id": f"person_{p.id}", "kind": "person", "entity_id": p.id,
+                            "label": p.full_name, "detail": p.nationality or ""})
+    # Names that start with what was typed first; the index order is kept otherwise.
+    results.sort(key=lambda result: not result["label"].lower().startswith(terms[0]))
+    return results
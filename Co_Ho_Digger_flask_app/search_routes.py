@@ -0,0 +1,19 @@
+# my_flask_app/search_routes.py
+
+from flask import Blueprint, request, jsonify
+from .search import search_entities, DEFAULT_LIMIT
+from .db_tuning import replica_reads
+
+search_bp = Blueprint("search_bp", __name__)
+
+@search_bp.route("/api/search")
+@replica_reads
+def search_api():
+    """
+    Typeahead search: ?q=smith+hold, optionally &kind=company or &kind=person
+    and &limit=. Every word is matched as a prefix; best matches first.
+    """
+    kind = request.args.get("kind")
+    kinds = (kind,) if kind in ("company", "person") else ("company", "person")
+    limit = request.args.get("limit", DEFAULT_LIMIT, type=int)
+    return jsonify(search_entities(request.args.get("q", ""), kinds, limit))
@@ -0,0 +1,321 @@
+# my_flask_app/streaming.py
+#
+# Incremental sync from the Companies House streaming API
+# (stream.companieshouse.gov.uk): long-lived HTTP connections that send one
+# JSON event per line for every change to a company profile, officer
+# appointment or PSC, each with an increasing "timepoint". Only companies
+# already in the database are touched. Events are applied in batches, each
+# batch in one transaction together with the stream's StreamCheckpoint, so a
+# restart carries on from the last timepoint applied.
+#
+# replay_events() reads the same newline-delimited JSON from a file - one
+# recorded with `flask stream-sync --record`, or made by `flask stream-sample`
+# - so the consumer can be tested and benchmarked offline.
+
+import gzip
+import json
+import os
+import random
+import re
+import time
+from datetime import datetime, timedelta
+
+import requests
+from sqlalchemy import update
+
+from .models import db, Company, StreamCheckpoint
+from .ingest import (company_fields_from_profile, content_hash, write_officer_rows, psc_record, write_psc_rows,
+                     find_companies_by_numbers, company_ids_by_numbers, RelationshipTypeCache)
+
+STREAM_BASE_URL = "https://stream.companieshouse.gov.uk"
+STREAM_PATHS = {
+    "companies": "/companies",
+    "officers": "/officers",
+    "psc": "/persons-with-significant-control",
+}
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_FLUSH_SECONDS = 5.0
+# The stream sends a blank heartbeat line every 30 seconds or so.
+READ_TIMEOUT = 90
+MAX_BACKOFF = 60
+
+_COMPANY_URI_RE = re.compile(r"^/company/([A-Za-z0-9]+)")
+
+
+def get_stream_key():
+    return os.getenv("COMPANIES_HOUSE_STREAM_KEY")
+
+
+def _parse_lines(lines):
+    """Decode stream lines into event dicts; blank heartbeat lines become None."""
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        line = line.strip()
+        yield json.loads(line) if line else None
+
+
+def _tee(lines, record):
+    for line in lines:
+        if line:
+            record.write((line.decode("utf-8") if isinstance(line, bytes) else line) + "\n")
+        yield line
+
+
+def live_events(stream, timepoint=None, stream_key=None, record=None):
+    """
+    Yield events (and None for heartbeats) from the live stream, from
+    `timepoint` on if given, until the server closes the connection.
+    `record`, an open text file, gets a copy of every event line.
+    """
+    params = {"timepoint": timepoint} if timepoint is not None else None
+    url = os.getenv("CH_STREAM_URL", STREAM_BASE_URL) + STREAM_PATHS[stream]
+    with requests.get(url, auth=(stream_key or get_stream_key(), ""), params=params,
+                      stream=True, timeout=(10, READ_TIMEOUT)) as response:
+        response.raise_for_status()
+        lines = response.iter_lines()
+        if record is not None:
+            lines = _tee(lines, record)
+        yield from _parse_lines(lines)
+
+
+def _open_text(path, mode):
+    return gzip.open(path, mode + "t", encoding="utf-8") if path.endswith(".gz") \
+        else open(path, mode, encoding="utf-8")
+
+
+def replay_events(path):
+    """Yield the events of a recorded stream file (.ndjson, or .ndjson.gz)."""
+    with _open_text(path, "r") as f:
+        yield from _parse_lines(f)
+
+
+def write_events(path, events):
+    """Write events as a replayable stream file; returns the number written."""
+    count = 0
+    with _open_text(path, "w") as f:
+        for event in events:
+            f.write(json.dumps(event, separators=(",", ":")) + "\n")
+            count += 1
+    return count
+
+
+def synthetic_events(stream, company_numbers, count, unknown_share=0.5, start_timepoint=1, seed=0):
+    """
+    Yield `count` made-up events shaped like the real stream's, spread over
+    `company_numbers` plus, for `unknown_share` of them, companies we do not
+    hold (most real traffic is for those).
+    """
+    rng = random.Random(seed)
+    company_numbers = list(company_numbers)
+    published = datetime(2026, 1, 1)
+    for n in range(count):
+        if not company_numbers or rng.random() < unknown_share:
+            number = f"ZZ{rng.randrange(10 ** 6):06d}"
+        else:
+            number = rng.choice(company_numbers)
+        event = {"event": {"timepoint": start_timepoint + n, "type": "changed",
+                           "published_at": (published + timedelta(seconds=n)).isoformat()}}
+        if stream == "companies":
+            event.update(resource_kind="company-profile", resource_uri=f"/company/{number}", data={
+                "company_name": f"COMPANY {number} LIMITED", "company_number": number,
+                "company_status": rng.choice(["active", "active", "liquidation", "dissolved"]),
+                "date_of_creation": "2001-02-03",
+                "registered_office_address": {"address_line_1": f"{rng.randrange(1, 200)} High Street",
+                                              "postal_code": "AB1 2CD"}})
+        elif stream == "officers":
+            event.update(resource_kind="company-officers",
+                         resource_uri=f"/company/{number}/appointments/{rng.randrange(10 ** 9)}", data={
+                             "name": f"OFFICER{rng.randrange(10 ** 5)}, Alex", "officer_role": "director",
+                             "appointed_on": "2020-01-01", "nationality": "British",
+                             "date_of_birth": {"year": rng.randrange(1940, 2000), "month": rng.randrange(1, 13)}})
+        else:
+            event.update(resource_kind="company-psc-individual",
+                         resource_uri=f"/company/{number}/persons-with-significant-control/individual/"
+                                      f"{rng.randrange(10 ** 9)}", data={
+                             "kind": "individual-person-with-significant-control",
+                             "name": f"Mx Alex Psc{rng.randrange(10 ** 5)}", "notified_on": "2020-01-01",
+                             "natures_of_control": ["ownership-of-shares-75-to-100-percent"]})
+        yield event
+
+
+def _company_number(event):
+    number = (event.get("data") or {}).get("company_number")
+    if not number:
+        match = _COMPANY_URI_RE.match(event.get("resource_uri") or "")
+        number = match.group(1) if match else None
+    return number
+
+
+def _changes_by_company(events):
+    """{company number: [data, ...]} for the "changed" events, in stream order."""
+    changes = {}
+    for event in events:
+        # Deletions (companies struck off long ago, appointments removed) are
+        # ignored, as a refresh never deletes rows either.
+        if (event.get("event") or {}).get("type") == "deleted":
+            continue
+        number = _company_number(event)
+        if number and event.get("data"):
+            changes.setdefault(number, []).append(event["data"])
+    return changes
+
+
+def _apply_companies(events, rel_types):
+    changes = _changes_by_company(events)
+    applied = 0
+    now = datetime.utcnow()
+    for number, company in find_companies_by_numbers(changes).items():
+        data = changes[number][-1]   # only the latest profile matters
+        digest = content_hash(data)
+        if company.profile_hash == digest:
+            continue
+        fields = company_fields_from_profile(data)
+        if not fields["name"]:
+            continue
+        for key, value in fields.items():
+            setattr(company, key, value)
+        company.profile_hash = digest
+        company.refreshed_at = now
+        applied += 1
+    return applied
+
+
+def _clear_hashes(column, ids):
+    # The stored hash was of the whole list from the REST API, which the
+    # companies' rows no longer match; the next refresh rewrites them.
+    db.session.execute(update(Company).where(Company.id.in_([company_id for company_id, _ in ids.values()]))
+                       .values({column: None}))
+
+
+def _apply_officers(events, rel_types):
+    changes = _changes_by_company(events)
+    ids = company_ids_by_numbers(changes)
+    write_officer_rows([(ids[number], item) for number, items in changes.items() if number in ids
+                        for item in items], rel_types)
+    if ids:
+        _clear_hashes("officers_hash", ids)
+    return sum(len(changes[number]) for number in ids)
+
+
+def _apply_psc(events, rel_types):
+    changes = _changes_by_company(events)
+    ids = company_ids_by_numbers(changes)
+    rows = [(ids[number],) + record for number, items in changes.items() if number in ids
+            for record in map(psc_record, items) if record]
+    if rows:
+        write_psc_rows(rows, rel_types)
+    if ids:
+        _clear_hashes("psc_hash", ids)
+    return sum(len(changes[number]) for number in ids)
+
+
+_APPLY = {"companies": _apply_companies, "officers": _apply_officers, "psc": _apply_psc}
+
+
+def get_checkpoint(stream):
+    checkpoint = StreamCheckpoint.query.filter_by(stream=stream).first()
+    if checkpoint is None:
+        checkpoint = StreamCheckpoint(stream=stream, events=0, applied=0)
+        db.session.add(checkpoint)
+        db.session.commit()
+    return checkpoint
+
+
+def consume(stream, events, batch_size=DEFAULT_BATCH_SIZE, flush_seconds=DEFAULT_FLUSH_SECONDS,
+            stop=None, progress=None):
+    """
+    Apply `events` (None entries are heartbeats) in batches of up to
+    `batch_size`, or whatever has arrived after `flush_seconds`, each in one
+    transaction with the checkpoint. Events at or before the checkpoint are
+    skipped. `progress`, if given, is called with the checkpoint after each
+    batch. Returns {"events", "applied"} for this call.
+    """
+    checkpoint = get_checkpoint(stream)
+    last = checkpoint.timepoint
+    rel_types = RelationshipTypeCache()
+    summary = {"events": 0, "applied": 0}
+    batch, started = [], None
+
+    def flush():
+        applied = _APPLY[stream](batch, rel_types)
+        checkpoint.timepoint = last
+        checkpoint.events += len(batch)
+        checkpoint.applied += applied
+        checkpoint.updated_at = datetime.utcnow()
+        db.session.commit()
+        summary["events"] += len(batch)
+        summary["applied"] += applied
+        if progress:
+            progress(checkpoint)
+
+    for event in events:
+        if event is not None:
+            timepoint = (event.get("event") or {}).get("timepoint")
+            if timepoint is not None:
+                if last is not None and timepoint <= last:
+                    continue
+                last = timepoint
+            batch.append(event)
+            started = started or time.monotonic()
+        if batch and (len(batch) >= batch_size or time.monotonic() - started >= flush_seconds):
+            flush()
+            batch, started = [], None
+        if stop is not None and stop.is_set():
+            break
+    if batch:
+        flush()
+    return summary
+
+
+def run_stream(stream, replay=None, record=None, batch_size=DEFAULT_BATCH_SIZE,
+               flush_seconds=DEFAULT_FLUSH_SECONDS, stop=None, progress=None, log=print):
+    """
+    Consume one stream from its checkpoint: the replay file if given, else
+    the live stream, reconnecting with backoff until `stop` is set. `record`
+    is a file path to append the live events to.
+    """
+    if replay:
+        return consume(stream, replay_events(replay), batch_size, flush_seconds, stop, progress)
+
+    totals = {"events": 0, "applied": 0}
+    backoff = 1
+    record_file = open(record, "a", encoding="utf-8", buffering=1) if record else None
+    try:
+        while stop is None or not stop.is_set():
+            checkpoint = get_checkpoint(stream)
+            timepoint = checkpoint.timepoint + 1 if checkpoint.timepoint is not None else None
+            try:
+                summary = consume(stream, live_events(stream, timepoint, record=record_file),
+                                  batch_size, flush_seconds, stop, progress)
+                totals["events"] += summary["events"]
+                totals["applied"] += summary["applied"]
+                # The server closed the connection; reconnect, but not in a tight loop.
+                backoff = 1 if summary["events"] else min(backoff * 2, MAX_BACKOFF)
+                log(f"{stream}: connection closed; reconnecting in {backoff}s")
+            except requests.exceptions.HTTPError as err:
+                db.session.rollback()
+                status = err.response.status_code if err.response is not None else None
+                if status == 401:
+                    raise
+                if status == 416:
+                    # The checkpoint is older than the stream keeps; start again from now.
+                    log(f"{stream}: timepoint {timepoint} is no longer available, resuming from the latest event")
+                    checkpoint = get_checkpoint(stream)
+                    checkpoint.timepoint = None
+                    db.session.commit()
+                    continue
+                log(f"{stream}: {err}; reconnecting in {backoff}s")
+                backoff = min(backoff * 2, MAX_BACKOFF)
+            except requests.exceptions.RequestException as err:
+                db.session.rollback()
+                log(f"{stream}: {err}; reconnecting in {backoff}s")
+                backoff = min(backoff * 2, MAX_BACKOFF)
+            if stop is not None:
+                stop.wait(backoff)
+            else:
+                time.sleep(backoff)
+    finally:
+        if record_file:
+            record_file.close()
+    return totals
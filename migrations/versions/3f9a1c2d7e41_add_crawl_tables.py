@@ -0,0 +1,51 @@
+"""Add crawl and crawl_item tables for deep digs
+
+Revision ID: 3f9a1c2d7e41
+Revises: 0cb6d94c0138
+Create Date: 2026-10-18 09:12:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9a1c2d7e41'
+down_revision = '0cb6d94c0138'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('crawl',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('root_company_number', sa.String(length=50), nullable=False),
+    sa.Column('max_depth', sa.Integer(), nullable=False),
+    sa.Column('follow_appointments', sa.Boolean(), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('crawl_item',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('crawl_id', sa.Integer(), nullable=False),
+    sa.Column('company_number', sa.String(length=50), nullable=False),
+    sa.Column('depth', sa.Integer(), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.ForeignKeyConstraint(['crawl_id'], ['crawl.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('crawl_id', 'company_number', name='uq_crawl_item_number')
+    )
+    with op.batch_alter_table('crawl_item', schema=None) as batch_op:
+        batch_op.create_index('ix_crawl_item_status', ['crawl_id', 'status', 'depth'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('crawl_item', schema=None) as batch_op:
+        batch_op.drop_index('ix_crawl_item_status')
+
+    op.drop_table('crawl_item')
+    op.drop_table('crawl')
@@ -0,0 +1,34 @@
+"""Add indexes behind list page sorting and filtering
+
+Revision ID: 5e7f3b1a9d20
+Revises: c41d7a9e2b36
+Create Date: 2026-10-18 14:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e7f3b1a9d20'
+down_revision = 'c41d7a9e2b36'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('relationship', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_relationship_relationship_type_id'), ['relationship_type_id'], unique=False)
+
+    with op.batch_alter_table('relationship_attribute', schema=None) as batch_op:
+        batch_op.create_index('ix_relationship_attribute_key_id', ['key', 'id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_relationship_attribute_relationship_id'), ['relationship_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('relationship_attribute', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_relationship_attribute_relationship_id'))
+        batch_op.drop_index('ix_relationship_attribute_key_id')
+
+    with op.batch_alter_table('relationship', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_relationship_relationship_type_id'))
@@ -0,0 +1,54 @@
+"""Add indexed normalized_number to company and backfill it
+
+Revision ID: 8b2e64d0c5a7
+Revises: 3f9a1c2d7e41
+Create Date: 2026-10-18 11:40:00.000000
+
+"""
+import re
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b2e64d0c5a7'
+down_revision = '3f9a1c2d7e41'
+branch_labels = None
+depends_on = None
+
+# Frozen copy of models.normalize_company_number as of this revision.
+_NUMBER_RE = re.compile(r"^([A-Z]*)0*(\d+)$")
+
+
+def _normalize(number):
+    number = re.sub(r"[\s\-/.]", "", number or "").upper()
+    match = _NUMBER_RE.match(number)
+    if match:
+        return match.group(1) + match.group(2)
+    return number
+
+
+def upgrade():
+    with op.batch_alter_table('company', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('normalized_number', sa.String(length=50), nullable=True))
+        batch_op.create_index(batch_op.f('ix_company_normalized_number'), ['normalized_number'], unique=False)
+
+    company = sa.table('company',
+                       sa.column('id', sa.Integer),
+                       sa.column('company_number', sa.String),
+                       sa.column('normalized_number', sa.String))
+    bind = op.get_bind()
+    rows = bind.execute(sa.select(company.c.id, company.c.company_number)).fetchall()
+    updates = [{"row_id": row_id, "key": _normalize(number)} for row_id, number in rows]
+    for start in range(0, len(updates), 1000):
+        bind.execute(
+            company.update().where(company.c.id == sa.bindparam("row_id"))
+                   .values(normalized_number=sa.bindparam("key")),
+            updates[start:start + 1000])
+
+
+def downgrade():
+    with op.batch_alter_table('company', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_company_normalized_number'))
+        batch_op.drop_column('normalized_number')
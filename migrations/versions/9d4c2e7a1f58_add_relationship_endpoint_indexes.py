@@ -0,0 +1,28 @@
+"""Add relationship endpoint indexes for graph traversal
+
+Revision ID: 9d4c2e7a1f58
+Revises: 5e7f3b1a9d20
+Create Date: 2026-10-18 16:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d4c2e7a1f58'
+down_revision = '5e7f3b1a9d20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('relationship', schema=None) as batch_op:
+        batch_op.create_index('ix_relationship_source', ['source_type', 'source_id'], unique=False)
+        batch_op.create_index('ix_relationship_target', ['target_type', 'target_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('relationship', schema=None) as batch_op:
+        batch_op.drop_index('ix_relationship_target')
+        batch_op.drop_index('ix_relationship_source')
@@ -0,0 +1,29 @@
+"""Add graph_version, a counter of graph changes for the analytics run
+
+Revision ID: a4e8c2f6d519
+Revises: f1d4b8c6a293
+Create Date: 2026-10-24 10:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4e8c2f6d519'
+down_revision = 'f1d4b8c6a293'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    graph_version = op.create_table('graph_version',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.bulk_insert(graph_version, [{'id': 1, 'version': 0}])
+
+
+def downgrade():
+    op.drop_table('graph_version')
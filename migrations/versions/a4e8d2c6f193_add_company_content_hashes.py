@@ -0,0 +1,32 @@
+"""Add content hashes of the last Companies House fetch to company
+
+Revision ID: a4e8d2c6f193
+Revises: f1c9e2b4a357
+Create Date: 2026-10-19 15:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4e8d2c6f193'
+down_revision = 'f1c9e2b4a357'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('company', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('profile_hash', sa.String(length=40), nullable=True))
+        batch_op.add_column(sa.Column('officers_hash', sa.String(length=40), nullable=True))
+        batch_op.add_column(sa.Column('psc_hash', sa.String(length=40), nullable=True))
+        batch_op.add_column(sa.Column('refreshed_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('company', schema=None) as batch_op:
+        batch_op.drop_column('refreshed_at')
+        batch_op.drop_column('psc_hash')
+        batch_op.drop_column('officers_hash')
+        batch_op.drop_column('profile_hash')
@@ -0,0 +1,26 @@
+"""Add skipped count to snapshot_import
+
+Revision ID: b5f81e6a2d93
+Revises: a7e3d91c4b62
+Create Date: 2026-10-18 18:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5f81e6a2d93'
+down_revision = 'a7e3d91c4b62'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('snapshot_import', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('skipped', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade():
+    with op.batch_alter_table('snapshot_import', schema=None) as batch_op:
+        batch_op.drop_column('skipped')
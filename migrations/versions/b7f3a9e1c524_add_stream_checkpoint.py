@@ -0,0 +1,33 @@
+"""Add stream_checkpoint table for the streaming API consumer
+
+Revision ID: b7f3a9e1c524
+Revises: a4e8d2c6f193
+Create Date: 2026-10-20 09:45:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7f3a9e1c524'
+down_revision = 'a4e8d2c6f193'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('stream_checkpoint',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('stream', sa.String(length=20), nullable=False),
+    sa.Column('timepoint', sa.BigInteger(), nullable=True),
+    sa.Column('events', sa.BigInteger(), nullable=False),
+    sa.Column('applied', sa.BigInteger(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('stream')
+    )
+
+
+def downgrade():
+    op.drop_table('stream_checkpoint')
@@ -0,0 +1,81 @@
+"""Add node table and node foreign keys for relationship endpoints
+
+Revision ID: c2d6a8f4e915
+Revises: b5f81e6a2d93
+Create Date: 2026-10-18 20:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c2d6a8f4e915'
+down_revision = 'b5f81e6a2d93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('node',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(length=20), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('company', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('node_id', sa.Integer(), nullable=True))
+    with op.batch_alter_table('person', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('node_id', sa.Integer(), nullable=True))
+    with op.batch_alter_table('relationship', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('source_node_id', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('target_node_id', sa.Integer(), nullable=True))
+
+    # Companies keep their id as node id; persons are numbered after them.
+    bind = op.get_bind()
+    offset = bind.execute(sa.text("SELECT COALESCE(MAX(id), 0) FROM company")).scalar()
+    op.execute("INSERT INTO node (id, kind) SELECT id, 'company' FROM company")
+    op.execute(sa.text("INSERT INTO node (id, kind) SELECT id + :offset, 'person' FROM person")
+               .bindparams(offset=offset))
+    op.execute("UPDATE company SET node_id = id")
+    op.execute(sa.text("UPDATE person SET node_id = id + :offset").bindparams(offset=offset))
+    # Endpoints whose company or person no longer exists are left NULL.
+    for end in ('source', 'target'):
+        for table in ('company', 'person'):
+            op.execute(
+                f"UPDATE relationship SET {end}_node_id = "
+                f"(SELECT node_id FROM {table} WHERE {table}.id = relationship.{end}_id) "
+                f"WHERE lower({end}_type) = '{table}'")
+    if bind.dialect.name == 'postgresql':
+        op.execute("SELECT setval(pg_get_serial_sequence('node', 'id'), "
+                   "COALESCE((SELECT MAX(id) FROM node), 0) + 1, false)")
+
+    with op.batch_alter_table('company', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_company_node_id', ['node_id'])
+        batch_op.create_foreign_key('fk_company_node_id_node', 'node', ['node_id'], ['id'])
+    with op.batch_alter_table('person', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_person_node_id', ['node_id'])
+        batch_op.create_foreign_key('fk_person_node_id_node', 'node', ['node_id'], ['id'])
+    with op.batch_alter_table('relationship', schema=None) as batch_op:
+        batch_op.create_foreign_key('fk_relationship_source_node_id_node', 'node', ['source_node_id'], ['id'])
+        batch_op.create_foreign_key('fk_relationship_target_node_id_node', 'node', ['target_node_id'], ['id'])
+        batch_op.create_index('ix_relationship_source_node', ['source_node_id', 'relationship_type_id'], unique=False)
+        batch_op.create_index('ix_relationship_target_node', ['target_node_id', 'relationship_type_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('relationship', schema=None) as batch_op:
+        batch_op.drop_index('ix_relationship_target_node')
+        batch_op.drop_index('ix_relationship_source_node')
+        batch_op.drop_constraint('fk_relationship_target_node_id_node', type_='foreignkey')
+        batch_op.drop_constraint('fk_relationship_source_node_id_node', type_='foreignkey')
+        batch_op.drop_column('target_node_id')
+        batch_op.drop_column('source_node_id')
+    with op.batch_alter_table('person', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_person_node_id_node', type_='foreignkey')
+        batch_op.drop_constraint('uq_person_node_id', type_='unique')
+        batch_op.drop_column('node_id')
+    with op.batch_alter_table('company', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_company_node_id_node', type_='foreignkey')
+        batch_op.drop_constraint('uq_company_node_id', type_='unique')
+        batch_op.drop_column('node_id')
+    op.drop_table('node')
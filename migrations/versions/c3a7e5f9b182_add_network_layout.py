@@ -0,0 +1,33 @@
+"""Add network_layout table for cached server-side layouts
+
+Revision ID: c3a7e5f9b182
+Revises: b7f3a9e1c524
+Create Date: 2026-10-20 16:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3a7e5f9b182'
+down_revision = 'b7f3a9e1c524'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('network_layout',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('key', sa.String(length=300), nullable=False),
+    sa.Column('signature', sa.String(length=40), nullable=False),
+    sa.Column('node_count', sa.Integer(), nullable=False),
+    sa.Column('positions', sa.Text(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('key')
+    )
+
+
+def downgrade():
+    op.drop_table('network_layout')
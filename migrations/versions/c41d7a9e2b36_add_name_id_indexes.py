@@ -0,0 +1,32 @@
+"""Add (name, id) indexes for keyset navigation on company and person
+
+Revision ID: c41d7a9e2b36
+Revises: 8b2e64d0c5a7
+Create Date: 2026-10-18 13:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41d7a9e2b36'
+down_revision = '8b2e64d0c5a7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('company', schema=None) as batch_op:
+        batch_op.create_index('ix_company_name_id', ['name', 'id'], unique=False)
+
+    with op.batch_alter_table('person', schema=None) as batch_op:
+        batch_op.create_index('ix_person_full_name_id', ['full_name', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('person', schema=None) as batch_op:
+        batch_op.drop_index('ix_person_full_name_id')
+
+    with op.batch_alter_table('company', schema=None) as batch_op:
+        batch_op.drop_index('ix_company_name_id')
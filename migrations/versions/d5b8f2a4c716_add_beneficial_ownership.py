@@ -0,0 +1,33 @@
+"""Add beneficial_ownership table for cached ultimate beneficial owners
+
+Revision ID: d5b8f2a4c716
+Revises: c3a7e5f9b182
+Create Date: 2026-10-21 10:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5b8f2a4c716'
+down_revision = 'c3a7e5f9b182'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('beneficial_ownership',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('company_id', sa.Integer(), nullable=False),
+    sa.Column('signature', sa.String(length=40), nullable=False),
+    sa.Column('owners', sa.Text(), nullable=False),
+    sa.Column('computed_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['company_id'], ['company.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('company_id')
+    )
+
+
+def downgrade():
+    op.drop_table('beneficial_ownership')
@@ -0,0 +1,74 @@
+"""Add person details and duplicate-detection tables
+
+Revision ID: d8a4f6c2b719
+Revises: c2d6a8f4e915
+Create Date: 2026-10-18 22:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd8a4f6c2b719'
+down_revision = 'c2d6a8f4e915'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('person', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('birth_year', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('birth_month', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('nationality', sa.String(length=100), nullable=True))
+
+    op.create_table('person_block_key',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('person_id', sa.Integer(), nullable=False),
+    sa.Column('key', sa.String(length=120), nullable=False),
+    sa.ForeignKeyConstraint(['person_id'], ['person.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('person_block_key', schema=None) as batch_op:
+        batch_op.create_index('ix_person_block_key_key', ['key', 'person_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_person_block_key_person_id'), ['person_id'], unique=False)
+
+    op.create_table('duplicate_cluster',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('score', sa.Float(), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('duplicate_cluster', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_duplicate_cluster_status'), ['status'], unique=False)
+
+    op.create_table('duplicate_cluster_member',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('cluster_id', sa.Integer(), nullable=False),
+    sa.Column('person_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['cluster_id'], ['duplicate_cluster.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['person_id'], ['person.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('duplicate_cluster_member', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_duplicate_cluster_member_cluster_id'), ['cluster_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_duplicate_cluster_member_person_id'), ['person_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('duplicate_cluster_member', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_duplicate_cluster_member_person_id'))
+        batch_op.drop_index(batch_op.f('ix_duplicate_cluster_member_cluster_id'))
+    op.drop_table('duplicate_cluster_member')
+    with op.batch_alter_table('duplicate_cluster', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_duplicate_cluster_status'))
+    op.drop_table('duplicate_cluster')
+    with op.batch_alter_table('person_block_key', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_person_block_key_person_id'))
+        batch_op.drop_index('ix_person_block_key_key')
+    op.drop_table('person_block_key')
+    with op.batch_alter_table('person', schema=None) as batch_op:
+        batch_op.drop_column('nationality')
+        batch_op.drop_column('birth_month')
+        batch_op.drop_column('birth_year')
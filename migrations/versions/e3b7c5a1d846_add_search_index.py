@@ -0,0 +1,76 @@
+"""Add full-text search index over companies and persons
+
+Revision ID: e3b7c5a1d846
+Revises: d8a4f6c2b719
+Create Date: 2026-10-19 09:15:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3b7c5a1d846'
+down_revision = 'd8a4f6c2b719'
+branch_labels = None
+depends_on = None
+
+# Kept in step with Co_Ho_Digger_flask_app/search.py.
+PG_COMPANY_DOCUMENT = ("to_tsvector('simple', coalesce(name, '') || ' ' || coalesce(company_number, '') || ' ' || "
+                       "coalesce(normalized_number, '') || ' ' || coalesce(registered_address, ''))")
+PG_PERSON_DOCUMENT = "to_tsvector('simple', coalesce(full_name, ''))"
+
+COMPANY_ROW = ("new.id * 2, new.name, new.company_number || ' ' || coalesce(new.normalized_number, ''), "
+               "coalesce(new.registered_address, '')")
+PERSON_ROW = "new.id * 2 + 1, new.full_name, '', ''"
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute(f"CREATE INDEX ix_company_search ON company USING gin (({PG_COMPANY_DOCUMENT}))")
+        op.execute(f"CREATE INDEX ix_person_search ON person USING gin (({PG_PERSON_DOCUMENT}))")
+        return
+    if dialect != 'sqlite':
+        return
+
+    op.execute("CREATE VIRTUAL TABLE search_index USING fts5("
+               "name, number, address, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')")
+    op.execute(f"""CREATE TRIGGER company_search_insert AFTER INSERT ON company BEGIN
+         INSERT INTO search_index (rowid, name, number, address) VALUES ({COMPANY_ROW});
+       END""")
+    op.execute(f"""CREATE TRIGGER company_search_update
+       AFTER UPDATE OF name, company_number, normalized_number, registered_address ON company BEGIN
+         DELETE FROM search_index WHERE rowid = old.id * 2;
+         INSERT INTO search_index (rowid, name, number, address) VALUES ({COMPANY_ROW});
+       END""")
+    op.execute("""CREATE TRIGGER company_search_delete AFTER DELETE ON company BEGIN
+         DELETE FROM search_index WHERE rowid = old.id * 2;
+       END""")
+    op.execute(f"""CREATE TRIGGER person_search_insert AFTER INSERT ON person BEGIN
+         INSERT INTO search_index (rowid, name, number, address) VALUES ({PERSON_ROW});
+       END""")
+    op.execute(f"""CREATE TRIGGER person_search_update AFTER UPDATE OF full_name ON person BEGIN
+         DELETE FROM search_index WHERE rowid = old.id * 2 + 1;
+         INSERT INTO search_index (rowid, name, number, address) VALUES ({PERSON_ROW});
+       END""")
+    op.execute("""CREATE TRIGGER person_search_delete AFTER DELETE ON person BEGIN
+         DELETE FROM search_index WHERE rowid = old.id * 2 + 1;
+       END""")
+
+    op.execute("INSERT INTO search_index (rowid, name, number, address) "
+               "SELECT id * 2, name, company_number || ' ' || coalesce(normalized_number, ''), "
+               "coalesce(registered_address, '') FROM company")
+    op.execute("INSERT INTO search_index (rowid, name, number, address) "
+               "SELECT id * 2 + 1, full_name, '', '' FROM person")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute("DROP INDEX IF EXISTS ix_person_search")
+        op.execute("DROP INDEX IF EXISTS ix_company_search")
+    elif dialect == 'sqlite':
+        for trigger in ('person_search_delete', 'person_search_update', 'person_search_insert',
+                        'company_search_delete', 'company_search_update', 'company_search_insert'):
+            op.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        op.execute("DROP TABLE IF EXISTS search_index")
@@ -0,0 +1,62 @@
+"""Add node_metric and graph_metrics_run tables for precomputed graph scores
+
+Revision ID: e7c2a9d4f318
+Revises: d5b8f2a4c716
+Create Date: 2026-10-22 09:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7c2a9d4f318'
+down_revision = 'd5b8f2a4c716'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('node_metric',
+    sa.Column('node_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('kind', sa.String(length=20), nullable=False),
+    sa.Column('degree', sa.Integer(), nullable=False),
+    sa.Column('in_degree', sa.Integer(), nullable=False),
+    sa.Column('out_degree', sa.Integer(), nullable=False),
+    sa.Column('pagerank', sa.Float(), nullable=False),
+    sa.Column('betweenness', sa.Float(), nullable=False),
+    sa.Column('component', sa.Integer(), nullable=False),
+    sa.Column('component_size', sa.Integer(), nullable=False),
+    sa.Column('community', sa.Integer(), nullable=False),
+    sa.Column('is_hub', sa.Boolean(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('node_id')
+    )
+    with op.batch_alter_table('node_metric', schema=None) as batch_op:
+        batch_op.create_index('ix_node_metric_degree', ['degree', 'node_id'], unique=False)
+        batch_op.create_index('ix_node_metric_pagerank', ['pagerank', 'node_id'], unique=False)
+        batch_op.create_index('ix_node_metric_betweenness', ['betweenness', 'node_id'], unique=False)
+        batch_op.create_index('ix_node_metric_community', ['community'], unique=False)
+
+    op.create_table('graph_metrics_run',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('started_at', sa.DateTime(), nullable=False),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.Column('signature', sa.String(length=100), nullable=True),
+    sa.Column('nodes', sa.Integer(), nullable=False),
+    sa.Column('edges', sa.Integer(), nullable=False),
+    sa.Column('written', sa.Integer(), nullable=False),
+    sa.Column('hub_degree', sa.Integer(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('graph_metrics_run')
+    with op.batch_alter_table('node_metric', schema=None) as batch_op:
+        batch_op.drop_index('ix_node_metric_community')
+        batch_op.drop_index('ix_node_metric_betweenness')
+        batch_op.drop_index('ix_node_metric_pagerank')
+        batch_op.drop_index('ix_node_metric_degree')
+
+    op.drop_table('node_metric')
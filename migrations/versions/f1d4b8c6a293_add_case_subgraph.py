@@ -0,0 +1,48 @@
+"""Add case_subgraph and case_subgraph_node tables for cached case networks
+
+Revision ID: f1d4b8c6a293
+Revises: e7c2a9d4f318
+Create Date: 2026-10-23 11:15:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1d4b8c6a293'
+down_revision = 'e7c2a9d4f318'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('case_subgraph',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('case_id', sa.Integer(), nullable=False),
+    sa.Column('depth', sa.Integer(), nullable=False),
+    sa.Column('rel_types', sa.String(length=300), nullable=False),
+    sa.Column('relationship_ids', sa.Text(), nullable=False),
+    sa.Column('node_count', sa.Integer(), nullable=False),
+    sa.Column('max_relationship_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['case_id'], ['case.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('case_id', 'depth', 'rel_types', name='uq_case_subgraph_view')
+    )
+    op.create_table('case_subgraph_node',
+    sa.Column('subgraph_id', sa.Integer(), nullable=False),
+    sa.Column('node_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['subgraph_id'], ['case_subgraph.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('subgraph_id', 'node_id')
+    )
+    with op.batch_alter_table('case_subgraph_node', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_case_subgraph_node_node_id'), ['node_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('case_subgraph_node', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_case_subgraph_node_node_id'))
+
+    op.drop_table('case_subgraph_node')
+    op.drop_table('case_subgraph')
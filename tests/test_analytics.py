@@ -0,0 +1,55 @@
+# tests/test_analytics.py
+#
+# Whole-graph scores in analytics.py on small graphs whose values are known.
+#
+#   python -m unittest discover tests
+
+import unittest
+
+import numpy as np
+
+from Co_Ho_Digger_flask_app.analytics import pagerank, sampled_betweenness, undirected_adjacency
+
+
+def graph(n, edges):
+    sources, targets = zip(*edges)
+    return undirected_adjacency(n, np.array(sources), np.array(targets))
+
+
+class BetweennessTest(unittest.TestCase):
+
+    def betweenness(self, n, edges, **kwargs):
+        return sampled_betweenness(graph(n, edges), np.arange(n), **kwargs)
+
+    def test_path(self):
+        np.testing.assert_allclose(self.betweenness(3, [(0, 1), (1, 2)]), [0, 1, 0])
+        np.testing.assert_allclose(self.betweenness(5, [(0, 1), (1, 2), (2, 3), (3, 4)]),
+                                   [0, 0.5, 2 / 3, 0.5, 0])
+
+    def test_star(self):
+        np.testing.assert_allclose(self.betweenness(5, [(0, 1), (0, 2), (0, 3), (0, 4)]), [1, 0, 0, 0, 0])
+
+    def test_equal_shortest_paths_share_the_credit(self):
+        # A 4-cycle: each opposite pair has two shortest paths, one through each other node.
+        np.testing.assert_allclose(self.betweenness(4, [(0, 1), (1, 2), (2, 3), (3, 0)]), [1 / 6] * 4)
+
+    def test_blocks_and_duplicate_edges_do_not_change_the_result(self):
+        edges = [(0, 1), (1, 2), (2, 3), (3, 4), (1, 0), (2, 2), (1, 3)]
+        calls = []
+        blocked = self.betweenness(5, edges, block=2, heartbeat=lambda: calls.append(1))
+        np.testing.assert_allclose(blocked, self.betweenness(5, edges[:4] + edges[-1:]))
+        self.assertTrue(calls)
+
+
+class PagerankTest(unittest.TestCase):
+
+    def test_symmetric_graph(self):
+        rank = pagerank(graph(5, [(0, 1), (0, 2), (0, 3), (0, 4)]))
+        self.assertAlmostEqual(rank.sum(), 1.0)
+        self.assertEqual(rank.argmax(), 0)
+        np.testing.assert_allclose(rank[1:], rank[1])
+        np.testing.assert_allclose(pagerank(graph(4, [(0, 1), (1, 2), (2, 3), (3, 0)])), [0.25] * 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
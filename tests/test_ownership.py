@@ -0,0 +1,59 @@
+# tests/test_ownership.py
+#
+# propagate() on small hand-built PSC chains: node ids are plain integers
+# and each edge is (relationship id, owner, owned, control).
+#
+#   python -m unittest discover tests
+
+import unittest
+
+from Co_Ho_Digger_flask_app.ownership import propagate
+
+SHARES = "ownership-of-shares-{}-percent"
+
+
+def edge(rel_id, owner, owned, band):
+    return rel_id, owner, owned, SHARES.format(band)
+
+
+class PropagateTest(unittest.TestCase):
+
+    def test_owner_above_a_cycle_is_reached(self):
+        # person 4 -> C1 (3) -> C2 (2) -> C3 (1), and C3 holds part of C1 back.
+        edges = [edge(1, 2, 1, "50-to-75"), edge(2, 3, 2, "75-to-100"), edge(3, 4, 3, "75-to-100"),
+                 edge(4, 1, 3, "25-to-50")]
+        found = propagate(1, edges)
+        self.assertEqual(set(found), {4})
+        self.assertEqual(found[4]["reason"], "top")
+        self.assertEqual(found[4]["depth"], 3)
+        self.assertAlmostEqual(found[4]["min"], 0.5 * 0.75 * 0.75)
+        self.assertAlmostEqual(found[4]["max"], 0.75)
+
+    def test_cycle_with_no_outside_owner_is_flagged(self):
+        found = propagate(1, [edge(1, 2, 1, "75-to-100"), edge(2, 1, 2, "75-to-100")])
+        self.assertEqual(set(found), {2})
+        self.assertEqual(found[2]["reason"], "cycle")
+
+    def test_holdings_below_the_threshold_are_not_followed(self):
+        # 50% of 50% is still 25%, but a third 50% layer takes 4 to 12.5%,
+        # so that chain is dropped; 5's direct holding is reported.
+        edges = [edge(1, 2, 1, "25-to-50"), edge(2, 3, 2, "25-to-50"), edge(3, 4, 3, "25-to-50"),
+                 edge(4, 5, 1, "25-to-50")]
+        self.assertEqual(set(propagate(1, edges, threshold=0.25)), {5})
+        # With a lower threshold the whole chain is followed to the top.
+        found = propagate(1, edges, threshold=0.1)
+        self.assertEqual(set(found), {4, 5})
+        self.assertAlmostEqual(found[4]["max"], 0.125)
+        self.assertEqual(found[4]["depth"], 3)
+
+    def test_paths_to_the_same_owner_add_up(self):
+        # Person 4 holds 25-50% directly and 75-100% of a holder of 25-50%.
+        edges = [edge(1, 4, 1, "25-to-50"), edge(2, 2, 1, "25-to-50"), edge(3, 4, 2, "75-to-100")]
+        found = propagate(1, edges, threshold=0.25)
+        self.assertEqual(set(found), {4})
+        self.assertAlmostEqual(found[4]["min"], 0.25 + 0.25 * 0.75)
+        self.assertAlmostEqual(found[4]["max"], 1.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+# tests/test_paths.py
+#
+# The path search in paths.py over a small in-memory graph, expanded the
+# way graph_index and the database expander do it.
+#
+#   python -m unittest discover tests
+
+import unittest
+
+from Co_Ho_Digger_flask_app.paths import bidirectional_bfs, k_shortest_paths
+
+#   a - b - d
+#   a - c - d      (b - d twice: parallel relationships 3 and 7)
+#   a - e - f - d
+EDGES = {1: ("a", "b"), 2: ("a", "c"), 3: ("b", "d"), 4: ("c", "d"), 5: ("a", "e"), 6: ("e", "f"),
+         7: ("b", "d"), 8: ("f", "d")}
+
+
+def expand(nodes):
+    links = {node: [] for node in nodes}
+    for edge, (u, v) in EDGES.items():
+        if u in links:
+            links[u].append((edge, v))
+        if v in links:
+            links[v].append((edge, u))
+    return links
+
+
+class PathsTest(unittest.TestCase):
+
+    def test_banned_step_is_not_taken(self):
+        nodes, edges = bidirectional_bfs("a", "d", expand, 6, banned_steps={("a", "b")})
+        self.assertEqual(nodes, ["a", "c", "d"])
+        self.assertEqual(edges, [2, 4])
+
+    def test_banned_steps_and_nodes_leave_the_long_way(self):
+        nodes, _ = bidirectional_bfs("a", "d", expand, 6, banned_nodes={"c"}, banned_steps={("b", "d")})
+        self.assertEqual(nodes, ["a", "e", "f", "d"])
+        self.assertIsNone(bidirectional_bfs("a", "d", expand, 2, banned_nodes={"b", "c"}))
+
+    def test_k_shortest_paths_shortest_first_without_parallel_repeats(self):
+        paths = k_shortest_paths("a", "d", expand, k=5)
+        self.assertEqual([nodes for nodes, _ in paths],
+                         [["a", "b", "d"], ["a", "c", "d"], ["a", "e", "f", "d"]])
+        for nodes, edges in paths:
+            for (u, v), edge in zip(zip(nodes, nodes[1:]), edges):
+                self.assertIn(EDGES[edge], ((u, v), (v, u)))
+
+    def test_max_depth_limits_the_search(self):
+        self.assertEqual(len(k_shortest_paths("a", "d", expand, k=5, max_depth=2)), 2)
+        self.assertEqual(k_shortest_paths("a", "f", expand, k=1, max_depth=1), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+# tests/test_replica_reads.py
+#
+# Views wrapped in @replica_reads must keep working when DATABASE_READ_URL
+# points at a read-only copy: anything they write has to go to the primary.
+# The "replica" here is the primary's own SQLite file opened read-only.
+#
+#   python -m unittest discover tests
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+
+class ReplicaReadsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scratch = tempfile.TemporaryDirectory()
+        path = os.path.join(self.scratch.name, "app.db")
+        env = {
+            "DATABASE_URL": f"sqlite:///{path}",
+            "DATABASE_READ_URL": f"sqlite:///file:{path}?mode=ro&uri=true",
+            "JOB_WORKERS": "0",
+            "CH_CACHE_ENABLED": "false",
+        }
+        self.env = mock.patch.dict(os.environ, env)
+        self.env.start()
+
+        from Co_Ho_Digger_flask_app import create_app, db
+        from Co_Ho_Digger_flask_app.models import Case, CaseDetail, Company, Person, Relationship, RelationshipType
+
+        self.app = create_app()
+        self.db = db
+        with self.app.app_context():
+            db.create_all()
+            director = RelationshipType(name="Director")
+            companies = [Company(name=f"Company {n}", company_number=f"{n:08d}") for n in range(3)]
+            person = Person(full_name="Shared Director")
+            case = Case(name="Case")
+            db.session.add_all([director, person, case] + companies)
+            db.session.flush()
+            for company in companies:
+                db.session.add(Relationship(relationship_type_id=director.id, source_type="person",
+                                            source_id=person.id, target_type="company", target_id=company.id))
+            db.session.add(CaseDetail(case_id=case.id, company_id=companies[0].id))
+            db.session.commit()
+            self.case_id = case.id
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        with self.app.app_context():
+            self.db.session.remove()
+            for engine in self.db.engines.values():
+                engine.dispose()
+        self.env.stop()
+        self.scratch.cleanup()
+
+    def get(self, url):
+        response = self.client.get(url)
+        body = response.get_data()
+        response.close()
+        return response.status_code, body
+
+    def test_case_network_stores_its_subgraph_on_the_primary(self):
+        from Co_Ho_Digger_flask_app.models import CaseSubgraph
+
+        url = f"/api/network?case_id={self.case_id}&depth=2"
+        for _ in range(2):  # computed and stored, then served from the store
+            status, body = self.get(url)
+            self.assertEqual(status, 200)
+            self.assertEqual(body.count(b'"type":"node"'), 4)
+            self.assertEqual(body.count(b'"type":"edge"'), 3)
+        with self.app.app_context():
+            self.assertEqual(CaseSubgraph.query.count(), 1)
+
+    def test_case_export_under_replica_routing(self):
+        import xml.etree.ElementTree as ET
+
+        namespace = {"g": "http://graphml.graphdrawing.org/xmlns"}
+        for _ in range(2):
+            status, body = self.get(f"/api/network/export?format=graphml&case_id={self.case_id}&depth=2")
+            self.assertEqual(status, 200)
+            graph = ET.fromstring(body)
+            self.assertEqual(len(graph.findall(".//g:node", namespace)), 4)
+            self.assertEqual(len(graph.findall(".//g:edge", namespace)), 3)
+
+    def test_case_export_cli_under_replica_routing(self):
+        out = os.path.join(self.scratch.name, "case.csv.zip")
+        result = self.app.test_cli_runner().invoke(
+            args=["export-graph", out, "--case", str(self.case_id), "--depth", "2"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("4 nodes and 3 edges", result.output)
+
+    def test_layout_job_is_not_queued_twice_behind_a_lagging_replica(self):
+        from Co_Ho_Digger_flask_app import create_app
+        from Co_Ho_Digger_flask_app.models import Job
+
+        # A replica stuck at the moment before any job was queued.
+        copy = os.path.join(self.scratch.name, "replica.db")
+        for suffix in ("", "-wal"):
+            if os.path.exists(os.path.join(self.scratch.name, "app.db" + suffix)):
+                shutil.copy(os.path.join(self.scratch.name, "app.db" + suffix), copy + suffix)
+        with mock.patch.dict(os.environ, {"DATABASE_READ_URL": f"sqlite:///file:{copy}?mode=ro&uri=true"}), \
+                mock.patch("Co_Ho_Digger_flask_app.network_routes.SYNC_LAYOUT_EDGES", 0):
+            app = create_app()
+            client = app.test_client()
+            for _ in range(2):
+                response = client.get("/api/network?layout=1")
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.headers.get("X-Network-Layout"), "pending")
+                response.close()
+            with app.app_context():
+                self.assertEqual(Job.query.filter_by(kind="network_layout").count(), 1)
+                for engine in self.db.engines.values():
+                    engine.dispose()
+
+
+if __name__ == "__main__":
+    unittest.main()